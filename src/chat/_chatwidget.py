@@ -4,7 +4,7 @@ logger = logging.getLogger(__name__)
 
 from PyQt5 import QtWidgets, QtCore, QtGui
 from PyQt5.QtNetwork import QNetworkAccessManager
-from PyQt5.QtCore import QSocketNotifier, QTimer
+from PyQt5.QtCore import QTimer
 
 from config import Settings, defaults
 import util
@@ -15,6 +15,7 @@ import chat
 from chat import user2name, parse_irc_source
 from chat.channel import Channel
 from chat.irclib import SimpleIRCClient
+from chat.ircsocket import QtServerConnection
 import notifications as ns
 
 from model.ircuserset import IrcUserset
@@ -32,6 +33,9 @@ class ChatWidget(FormClass, BaseClass, SimpleIRCClient):
     irc_host = Settings.persisted_property('chat/host', type=str, default_value='irc.' + defaults['host'])
     irc_tls = Settings.persisted_property('chat/tls', type=bool, default_value=False)
 
+    # Reads and writes the IRC socket from the Qt event loop
+    connection_class = QtServerConnection
+
     """
     This is the chat lobby module for the FAF client.
     It manages a list of channels and dispatches IRC events (lobby inherits from irclib's client class)
@@ -80,19 +84,22 @@ class ChatWidget(FormClass, BaseClass, SimpleIRCClient):
         self.client.autoJoin.connect(self.autoJoin)
         self.channelsAvailable = []
 
-        self._notifier = None
         self._timer = QTimer()
         self._timer.timeout.connect(self.once)
 
+        # Joins and parts change the nick lists once per event loop tick, in bulk
+        self._batched = []
+        self._flushTimer = QTimer()
+        self._flushTimer.setSingleShot(True)
+        self._flushTimer.setInterval(0)
+        self._flushTimer.timeout.connect(self._flushBatches)
+
         # disconnection checks
         self.canDisconnect = False
 
     def disconnect(self):
         self.canDisconnect = True
         self.irc_disconnect()
-        if self._notifier:
-            self._notifier.activated.disconnect(self.once)
-            self._notifier = None
 
     @QtCore.pyqtSlot(object)
     def connect(self, player):
@@ -104,8 +111,6 @@ class ChatWidget(FormClass, BaseClass, SimpleIRCClient):
                              ssl=self.irc_tls,
                              ircname=player.login,
                              username=player.id)
-            self._notifier = QSocketNotifier(self.ircobj.connections[0]._get_socket().fileno(), QSocketNotifier.Read, self)
-            self._notifier.activated.connect(self.once)
             self._timer.start(PONG_INTERVAL)
 
         except:
@@ -125,6 +130,11 @@ class ChatWidget(FormClass, BaseClass, SimpleIRCClient):
             caller.updateAvatar()
         util.delDownloadAvatar(url)
 
+    def resortChatters(self):
+        """ puts the nick lists in order again, after a change affecting everyone's rank """
+        for channel in self.channels.values():
+            channel.model.resort()
+
     def addChannel(self, name, channel, index = None):
         self.channels[name] = channel
         if index is None:
@@ -292,16 +302,38 @@ class ChatWidget(FormClass, BaseClass, SimpleIRCClient):
     def _remove_chatter(self, name):
         if name not in self._chatters:
             return
+        chatter = self._chatters[name]
+        for channel in self.channels.values():
+            if chatter in channel.chatters:
+                self._batch(channel)
         del self._chatters[name]
         # Channels listen to 'chatter removed' signal on their own
 
     def _add_chatter_channel(self, chatter, elevation, channel, join):
         chatter.set_elevation(channel, elevation)
+        self._batch(self.channels[channel])
         self.channels[channel].addChatter(chatter, join)
 
     def _remove_chatter_channel(self, chatter, channel, msg):
         chatter.set_elevation(channel, None)
-        self.channels[channel].removeChatter(msg)
+        self._batch(self.channels[channel])
+        self.channels[channel].removeChatter(chatter, msg)
+
+    def _batch(self, channel):
+        """
+        Holds back nick list updates of the channel until the IRC events read in this event loop tick are handled,
+        so a NAMES listing or a netsplit sorts and recounts each nick list once, not once per user.
+        """
+        if channel not in self._batched:
+            channel.beginBatch()
+            self._batched.append(channel)
+            self._flushTimer.start()
+
+    @QtCore.pyqtSlot()
+    def _flushBatches(self):
+        batched, self._batched = self._batched, []
+        for channel in batched:
+            channel.endBatch()
 
     def on_whoisuser(self, c, e):
         self.log_event(e)
@@ -474,6 +506,10 @@ class ChatWidget(FormClass, BaseClass, SimpleIRCClient):
             self._timer.stop()
             self.connect(self.client.me.player)
 
+    def on_connect_failed(self, c, e):
+        self.serverLogArea.appendPlainText("Unable to connect to the chat server, but you should still be able to host and join games.")
+        self._timer.stop()
+
     def on_privmsg(self, c, e):
         name, id, elevation, hostname = parse_irc_source(e.source())
         if name not in self._chatters:
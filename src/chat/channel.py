@@ -5,12 +5,15 @@ from PyQt5 import QtWidgets, QtCore, QtGui
 import time
 from chat import logger
 from chat.chatter import Chatter
+from chat.chattermodel import ChatterModel, ChatterFilterModel
+from chat.chatlog import ChatLine
+from chat import history
 import re
 import json
+import sqlite3
 
 QUERY_BLINK_SPEED = 250
-CHAT_TEXT_LIMIT = 350
-CHAT_REMOVEBLOCK = 50
+HISTORY_PAGE = 200  # Lines of history paged into the log at a time
 
 FormClass, BaseClass = util.THEME.loadUiType("chat/channel.ui")
 
@@ -32,25 +35,12 @@ class Formatters(object):
     NICKLIST_COLUMNS         = json.loads(util.THEME.readfile("chat/formatters/nicklist_columns.json"))
 
 
-# Helper class to schedule single event loop calls.
-class ScheduledCall(QtCore.QObject):
-    _call = QtCore.pyqtSignal()
-
-    def __init__(self, fn):
-        QtCore.QObject.__init__(self)
-        self._fn = fn
-        self._called = False
-        self._call.connect(self._runCall, QtCore.Qt.QueuedConnection)
-
-    def scheduleCall(self):
-        if self._called:
-            return
-        self._called = True
-        self._call.emit()
-
-    def _runCall(self):
-        self._called = False
-        self._fn()
+# What the chat history calls the lines of each formatter, lines of other ones are messages
+_HISTORY_KINDS = {
+    Formatters.FORMATTER_ACTION: "action",
+    Formatters.FORMATTER_ACTION_AVATAR: "action",
+    Formatters.FORMATTER_RAW: "event",
+}
 
 
 class Channel(FormClass, BaseClass):
@@ -80,14 +70,17 @@ class Channel(FormClass, BaseClass):
         # Table width of each chatter's name cell...
         self.maxChatterWidth = 100  # TODO: This might / should auto-adapt
 
-        # count the number of line currently in the chat
-        self.lines = 0
-
         # Perform special setup for public channels as opposed to private ones
         self.name = name
         self.private = private
 
-        self.sortCall = ScheduledCall(self._sortChatters)
+        # Sorted as chatters come and change, the filter model only hides rows
+        self.model = ChatterModel(me, self)
+        self.filterModel = ChatterFilterModel(self)
+        self.filterModel.setSourceModel(self.model)
+        self.nickList.setModel(self.filterModel)
+        # Chatters joining and leaving while the nick list updates are held back
+        self._batch = None
 
         if not self.private:
             # Properly and snugly snap all the columns
@@ -102,8 +95,8 @@ class Channel(FormClass, BaseClass):
 
             self.nickList.horizontalHeader().setSectionResizeMode(Chatter.SORT_COLUMN, QtWidgets.QHeaderView.Stretch)
 
-            self.nickList.itemDoubleClicked.connect(self.nickDoubleClicked)
-            self.nickList.itemPressed.connect(self.nickPressed)
+            self.nickList.doubleClicked.connect(self.nickDoubleClicked)
+            self.nickList.pressed.connect(self.nickPressed)
 
             self.nickFilter.textChanged.connect(self.filterNicks)
 
@@ -112,12 +105,24 @@ class Channel(FormClass, BaseClass):
             self.announceLine.hide()
 
         self.chatArea.anchorClicked.connect(self.openUrl)
+
+        # Everything said is logged to the chat history first, if it's kept. The log shows a window of it,
+        # following the newest lines while live, and pages older or newer ones in at its ends.
+        self._live = True
+        self._paging = False
+        self.chatArea.topReached.connect(self.loadOlderLines)
+        self.chatArea.bottomReached.connect(self.loadNewerLines)
+        self.loadOlderLines()
+
+        self.logSearch.hide()
+        self.logSearch.returnPressed.connect(self.searchLog)
+        QtWidgets.QShortcut(QtGui.QKeySequence(QtGui.QKeySequence.Find), self, self.showLogSearch,
+                            context=QtCore.Qt.WidgetWithChildrenShortcut)
+        QtWidgets.QShortcut(QtGui.QKeySequence(QtCore.Qt.Key_Escape), self.logSearch, self.hideLogSearch,
+                            context=QtCore.Qt.WidgetShortcut)
         self.chatEdit.returnPressed.connect(self.sendLine)
         self.chatEdit.setChatters(self.chatters)
 
-    def _sortChatters(self):
-        self.nickList.sortItems(Chatter.SORT_COLUMN)
-
     def joinChannel(self, index):
         """ join another channel """
         channel = self.channelsComboBox.itemText(index)
@@ -131,36 +136,182 @@ class Channel(FormClass, BaseClass):
         if keyevent.key() == 67:
             self.chatArea.copy()
 
-    def resizeEvent(self, size):
-        BaseClass.resizeEvent(self, size)
-        self.setTextWidth()
-
-    def setTextWidth(self):
-        self.chatArea.setLineWrapColumnOrWidth(self.chatArea.size().width() - 20)  # Hardcoded, but seems to be enough (tabstop was a bit large)
-
     def showEvent(self, event):
         self.stopBlink()
-        self.setTextWidth()
         return BaseClass.showEvent(self, event)
 
     @QtCore.pyqtSlot()
     def clearWindow(self):
         if self.isVisible():
-            self.chatArea.setPlainText("")
+            self.chatArea.clear()
+            self._live = True
             self.last_timestamp = 0
 
+    @QtCore.pyqtSlot()
+    def showLogSearch(self):
+        self.logSearch.show()
+        self.logSearch.selectAll()
+        self.logSearch.setFocus()
+
+    @QtCore.pyqtSlot()
+    def hideLogSearch(self):
+        self.logSearch.hide()
+        self.chatEdit.setFocus()
+
+    @QtCore.pyqtSlot()
+    def searchLog(self):
+        """
+        Goes to the previous line matching the search text, Shift+Enter to the next one.
+        Past the oldest line shown, the words are looked up in the chat history.
+        """
+        text = self.logSearch.text()
+        backwards = not QtWidgets.QApplication.keyboardModifiers() & QtCore.Qt.ShiftModifier
+        if self.chatArea.find(text, backwards):
+            return
+        oldest, _ = self.chatArea.historyIds()
+        if backwards and oldest is not None:
+            found = self._readHistory(history.ChatHistory.search, text, oldest)
+            if found:
+                self.showHistoryAt(found[0])
+                return
+        QtWidgets.QApplication.beep()
+
+    def _historyLines(self, records):
+        """ chat lines for lines of the chat history, with the date wherever the day changes """
+        styles = {
+            "message": (Formatters.FORMATTER_MESSAGE, self.chat_widget.a_style),
+            "action": (Formatters.FORMATTER_ACTION, self.chat_widget.a_style),
+            "event": (Formatters.FORMATTER_RAW, self.chat_widget.a_style),
+            "raw": (Formatters.FORMATTER_RAW, None),
+        }
+        lines = []
+        day = minute = None
+        for record in records:
+            when = time.localtime(record.time)
+            if day is not None and time.strftime("%x", when) != day:
+                lines.append(ChatLine(Formatters.FORMATTER_ANNOUNCEMENT, time.strftime("%A %x", when),
+                                      size="+1", color="grey"))
+            day = time.strftime("%x", when)
+            stamp = time.strftime("%H:%M", when)
+            formatter, style = styles.get(record.kind, styles["raw"])
+            chatter = self._chatterset.get(record.name)
+            player_id = chatter.player.id if chatter is not None and chatter.player is not None else -1
+            lines.append(ChatLine(formatter, record.text, style, history_id=record.id,
+                                  time=stamp if stamp != minute else "", name=record.name,
+                                  color=self.chat_widget.client.player_colors.getUserColor(player_id),
+                                  width=self.maxChatterWidth))
+            minute = stamp
+        return lines
+
+    @QtCore.pyqtSlot()
+    def loadOlderLines(self):
+        if self._paging:
+            return
+        oldest, _ = self.chatArea.historyIds()
+        if oldest is None and len(self.chatArea.log):
+            return  # Nothing logged shown, nothing to go back from
+        self._paging = True
+        try:
+            if self.chatArea.prepend(self._historyLines(self._readHistory(history.ChatHistory.before, oldest,
+                                                                          HISTORY_PAGE))):
+                self._live = False
+        finally:
+            self._paging = False
+
+    @QtCore.pyqtSlot()
+    def loadNewerLines(self):
+        if self._live or self._paging:
+            return
+        _, newest = self.chatArea.historyIds()
+        records = self._readHistory(history.ChatHistory.after, newest, HISTORY_PAGE)
+        self._paging = True
+        try:
+            self.chatArea.extend(self._historyLines(records))
+            self._live = len(records) < HISTORY_PAGE
+        finally:
+            self._paging = False
+
+    def showHistoryAt(self, history_id):
+        """ shows the lines of the chat history around the one with history_id, selecting it """
+        older = self._readHistory(history.ChatHistory.before, history_id + 1, HISTORY_PAGE // 2)
+        newer = self._readHistory(history.ChatHistory.after, history_id, HISTORY_PAGE // 2)
+        self._paging = True
+        try:
+            self.chatArea.clear()
+            self.chatArea.extend(self._historyLines(older + newer))
+            self._live = len(newer) < HISTORY_PAGE // 2
+        finally:
+            self._paging = False
+        log = self.chatArea.log
+        row = next((row for row in range(len(log)) if log[row].history_id == history_id), None)
+        if row is not None:
+            self.chatArea.select(row)
+
+    def _showLive(self):
+        """ goes back to the newest lines """
+        self._paging = True
+        try:
+            self.chatArea.clear()
+            self.chatArea.extend(self._historyLines(self._readHistory(history.ChatHistory.before, None,
+                                                                      HISTORY_PAGE)))
+            self._live = True
+        finally:
+            self._paging = False
+        self.chatArea.scrollToBottom()
+
+    def _readHistory(self, read, *args):
+        """ calls read(chat history, channel name, *args), no lines if there's no history or it can't be read """
+        store = history.history()
+        if store is None:
+            return []
+        try:
+            return read(store, self.name, *args)
+        except (OSError, sqlite3.Error):
+            logger.exception("Couldn't read the chat history")
+            return []
+
+    def _log(self, kind, chname, text):
+        """ logs a line to the chat history, returns its id or None if it couldn't be """
+        store = history.history()
+        if store is None:
+            return None
+        try:
+            return store.append(self.name, kind, chname, text)
+        except (OSError, sqlite3.Error):
+            logger.exception("Couldn't write to the chat history")
+            return None
+
+    def _show(self, line, scroll_forced):
+        # A line that isn't in the history can't be paged in later
+        if self._live or line.history_id is None:
+            self.chatArea.append(line, scroll_forced)
+        elif scroll_forced:
+            self._showLive()
+
     @QtCore.pyqtSlot()
     def filterNicks(self):
-        for chatter in self.chatters.values():
-            chatter.setVisible(chatter.isFiltered(self.nickFilter.text().lower()))
+        self.filterModel.setFilter(self.nickFilter.text().lower())
+
+    def beginBatch(self):
+        """
+        Holds nick list updates back until endBatch, which applies them all at once.
+        """
+        if self._batch is None:
+            self._batch = ({}, [])  # joining items, in order, and leaving ones
+
+    def endBatch(self):
+        if self._batch is None:
+            return
+        joining, leaving = self._batch
+        self._batch = None
+        self.model.removeMany(leaving)
+        self.model.addMany(joining)
+        self.updateUserCount()
 
     def updateUserCount(self):
         count = len(self.chatters)
         self.nickFilter.setPlaceholderText(str(count) + " users... (type to filter)")
 
-        if self.nickFilter.text():
-            self.filterNicks()
-
     @QtCore.pyqtSlot()
     def blink(self):
         if self.blinked:
@@ -203,31 +354,10 @@ class Channel(FormClass, BaseClass):
             QtGui.QDesktopServices.openUrl(url)
 
     def printAnnouncement(self, text, color, size, scroll_forced = True):
-        # scroll if close to the last line of the log
-        scroll_current = self.chatArea.verticalScrollBar().value()
-        scroll_needed = scroll_forced or ((self.chatArea.verticalScrollBar().maximum() - scroll_current) < 20)
-
-        cursor = self.chatArea.textCursor()
-        cursor.movePosition(QtGui.QTextCursor.End)
-        self.chatArea.setTextCursor(cursor)
-
-        formatter = Formatters.FORMATTER_ANNOUNCEMENT
-        line = formatter.format(size=size, color=color, text=util.irc_escape(text, self.chat_widget.a_style))
-        self.chatArea.insertHtml(line)
-
-        if scroll_needed:
-            self.chatArea.verticalScrollBar().setValue(self.chatArea.verticalScrollBar().maximum())
-        else:
-            self.chatArea.verticalScrollBar().setValue(scroll_current)
+        line = ChatLine(Formatters.FORMATTER_ANNOUNCEMENT, text, self.chat_widget.a_style, size=size, color=color)
+        self.chatArea.append(line, scroll_forced)
 
     def printLine(self, chname, text, scroll_forced=False, formatter=Formatters.FORMATTER_MESSAGE):
-        if self.lines > CHAT_TEXT_LIMIT:
-            cursor = self.chatArea.textCursor()
-            cursor.movePosition(QtGui.QTextCursor.Start)
-            cursor.movePosition(QtGui.QTextCursor.Down, QtGui.QTextCursor.KeepAnchor, CHAT_REMOVEBLOCK)
-            cursor.removeSelectedText()
-            self.lines = self.lines - CHAT_REMOVEBLOCK
-
         chatter = self._chatterset.get(chname)
         if chatter is not None and chatter.player is not None:
             player = chatter.player
@@ -246,7 +376,7 @@ class Channel(FormClass, BaseClass):
         avatar = None
         if chatter is not None and chatter in self.chatters:
             chatwidget = self.chatters[chatter]
-            color = chatwidget.foreground().color().name()
+            color = chatwidget.foreground.name()
             avatarTip = chatwidget.avatarTip or ""
             if chatter.player is not None:
                 avatar = chatter.player.avatar
@@ -259,34 +389,16 @@ class Channel(FormClass, BaseClass):
         if mentioned:
             color = self.chat_widget.client.player_colors.getColor("you")
 
-        # scroll if close to the last line of the log
-        scroll_current = self.chatArea.verticalScrollBar().value()
-        scroll_needed = scroll_forced or ((self.chatArea.verticalScrollBar().maximum() - scroll_current) < 20)
-
-        cursor = self.chatArea.textCursor()
-        cursor.movePosition(QtGui.QTextCursor.End)
-        self.chatArea.setTextCursor(cursor)
-
-        line = None
-        if avatar is not None:
-            pix = util.respix(avatar)
-            if pix:
-                if not self.chatArea.document().resource(QtGui.QTextDocument.ImageResource, QtCore.QUrl(avatar)):
-                    self.chatArea.document().addResource(QtGui.QTextDocument.ImageResource,  QtCore.QUrl(avatar), pix)
-                line = formatter.format(time=self.timestamp(), avatar=avatar, avatarTip=avatarTip, name=displayName,
-                                        color=color, width=self.maxChatterWidth, text=util.irc_escape(text, self.chat_widget.a_style))
-        if line is None:
-            formatter = Formatters.FORMATTER_MESSAGE
-            line = formatter.format(time=self.timestamp(), name=displayName, color=color,
-                                    width=self.maxChatterWidth, text=util.irc_escape(text, self.chat_widget.a_style))
-
-        self.chatArea.insertHtml(line)
-        self.lines += 1
-
-        if scroll_needed:
-            self.chatArea.verticalScrollBar().setValue(self.chatArea.verticalScrollBar().maximum())
+        history_id = self._log(_HISTORY_KINDS.get(formatter, "message"), chname, text)
+
+        # The text is escaped and formatted once the line is shown
+        if avatar is not None and util.respix(avatar):
+            line = ChatLine(formatter, text, self.chat_widget.a_style, avatar, history_id, time=self.timestamp(),
+                            avatarTip=avatarTip, name=displayName, color=color, width=self.maxChatterWidth)
         else:
-            self.chatArea.verticalScrollBar().setValue(scroll_current)
+            line = ChatLine(Formatters.FORMATTER_MESSAGE, text, self.chat_widget.a_style, history_id=history_id,
+                            time=self.timestamp(), name=displayName, color=color, width=self.maxChatterWidth)
+        self._show(line, scroll_forced)
 
     def _chname_has_avatar(self, chname):
         if chname not in self._chatterset:
@@ -331,22 +443,9 @@ class Channel(FormClass, BaseClass):
         if self.private and chname != self.chat_widget.client.login:
             self.pingWindow()
 
-        # scroll if close to the last line of the log
-        scroll_current = self.chatArea.verticalScrollBar().value()
-        scroll_needed = scroll_forced or ((self.chatArea.verticalScrollBar().maximum() - scroll_current) < 20)
-
-        cursor = self.chatArea.textCursor()
-        cursor.movePosition(QtGui.QTextCursor.End)
-        self.chatArea.setTextCursor(cursor)
-
-        formatter = Formatters.FORMATTER_RAW
-        line = formatter.format(time=self.timestamp(), name=chname, color=color, width=self.maxChatterWidth, text=text)
-        self.chatArea.insertHtml(line)
-
-        if scroll_needed:
-            self.chatArea.verticalScrollBar().setValue(self.chatArea.verticalScrollBar().maximum())
-        else:
-            self.chatArea.verticalScrollBar().setValue(scroll_current)
+        line = ChatLine(Formatters.FORMATTER_RAW, text, history_id=self._log("raw", chname, text),
+                        time=self.timestamp(), name=chname, color=color, width=self.maxChatterWidth)
+        self._show(line, scroll_forced)
 
     def timestamp(self):
         """ returns a fresh timestamp string once every minute, and an empty string otherwise """
@@ -361,53 +460,57 @@ class Channel(FormClass, BaseClass):
         timestamp = time.strftime("%H:%M")
         return self.last_timestamp != timestamp
 
-    @QtCore.pyqtSlot(QtWidgets.QTableWidgetItem)
-    def nickDoubleClicked(self, item):
-        chatter = self.nickList.item(item.row(), Chatter.SORT_COLUMN)  # Look up the associated chatter object
-        chatter.doubleClicked(item)
+    @QtCore.pyqtSlot(QtCore.QModelIndex)
+    def nickDoubleClicked(self, index):
+        chatter = index.data(ChatterModel.ChatterRole)  # Look up the associated chatter object
+        chatter.doubleClicked(index.column())
 
-    @QtCore.pyqtSlot(QtWidgets.QTableWidgetItem)
-    def nickPressed(self, item):
+    @QtCore.pyqtSlot(QtCore.QModelIndex)
+    def nickPressed(self, index):
         if QtWidgets.QApplication.mouseButtons() == QtCore.Qt.RightButton:
             # Look up the associated chatter object
-            chatter = self.nickList.item(item.row(), Chatter.SORT_COLUMN)
-            chatter.pressed(item)
+            chatter = index.data(ChatterModel.ChatterRole)
+            chatter.pressed(index.column())
 
     def addChatter(self, chatter, join=False):
         """
         Adds an user to this chat channel, and assigns an appropriate icon depending on friendship and FAF player status
         """
         if chatter not in self.chatters:
-            item = Chatter(self.nickList, chatter, self,
+            item = Chatter(self.model, chatter, self,
                            self.chat_widget, self._me)
             self.chatters[chatter] = item
+            item.update()
+            if self._batch is not None:
+                self._batch[0][item] = None
+            else:
+                self.model.add(item)
+        else:
+            self.chatters[chatter].update()
 
-        self.chatters[chatter].update()
-
-        self.updateUserCount()
+        if self._batch is None:
+            self.updateUserCount()
 
         if join and self.chat_widget.client.joinsparts:
             self.printAction(chatter.name, "joined the channel.", server_action=True)
 
     def removeChatter(self, chatter, server_action=None):
         if chatter in self.chatters:
-            self.nickList.removeRow(self.chatters[chatter].row())
-            del self.chatters[chatter]
+            item = self.chatters.pop(chatter)
+            if self._batch is None:
+                self.model.remove(item)
+            elif item in self._batch[0]:
+                del self._batch[0][item]
+            else:
+                self._batch[1].append(item)
+            item.detach()
 
             if server_action and (self.chat_widget.client.joinsparts or self.private):
                 self.printAction(chatter.name, server_action, server_action=True)
                 self.stopBlink()
 
-        self.updateUserCount()
-
-    def verifySortOrder(self, chatter):
-        row = chatter.row()
-        next_chatter = self.nickList.item(row + 1, Chatter.SORT_COLUMN)
-        prev_chatter = self.nickList.item(row - 1, Chatter.SORT_COLUMN)
-
-        if (next_chatter is not None and chatter > next_chatter or
-           prev_chatter is not None and chatter < prev_chatter):
-            self.sortCall.scheduleCall()
+        if self._batch is None:
+            self.updateUserCount()
 
     def setAnnounceText(self, text):
         self.announceLine.clear()
@@ -0,0 +1,367 @@
+"""
+Scrollback of a channel.
+
+Lines used to be inserted into a QTextBrowser as HTML as they came, which
+escaped, formatted and laid out every message right away, relaid the
+document out whenever old lines were trimmed and kept only a few hundred
+lines. Here lines are kept as records in a fixed size ring, holding the
+raw text and the formatter fields. A line is escaped and formatted when it
+first scrolls into view, and only the lines in view are laid out.
+
+The view scrolls by lines: the scroll bar value is the row shown at the
+bottom, so following the conversation is being at the maximum.
+"""
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+import util
+
+CHAT_LOG_LIMIT = 5000     # Lines of scrollback kept per channel
+
+
+class ChatLine(object):
+    """
+    One line of the log: a formatter, its fields and the text, escaped only once shown.
+    """
+    __slots__ = ("formatter", "text", "style", "avatar", "history_id", "fields", "_html")
+
+    def __init__(self, formatter, text, style=None, avatar=None, history_id=None, **fields):
+        self.formatter = formatter
+        self.text = text
+        self.style = style      # The anchor style to irc_escape the text with, None if it's HTML already
+        self.avatar = avatar
+        self.history_id = history_id    # Its id in the chat history, if it was logged
+        self.fields = fields
+        self._html = None
+
+    def html(self):
+        if self._html is None:
+            text = self.text if self.style is None else util.irc_escape(self.text, self.style)
+            self._html = self.formatter.format(text=text, avatar=self.avatar, **self.fields)
+        return self._html
+
+    def matches(self, text):
+        """ text being lower case """
+        return text in self.text.lower() or text in str(self.fields.get("name", "")).lower()
+
+
+class ChatLog(object):
+    """
+    The last limit lines of a channel, in a ring. Row 0 is the oldest line kept.
+    """
+    def __init__(self, limit=CHAT_LOG_LIMIT):
+        self.limit = limit
+        self._lines = [None] * limit
+        self._first = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, row):
+        if not 0 <= row < self._count:
+            raise IndexError(row)
+        return self._lines[(self._first + row) % self.limit]
+
+    def append(self, line):
+        """
+        Adds line as the newest row. Returns whether the oldest line was dropped for it.
+        """
+        dropped = self._count == self.limit
+        if dropped:
+            self._first = (self._first + 1) % self.limit
+            self._count -= 1
+        self._lines[(self._first + self._count) % self.limit] = line
+        self._count += 1
+        return dropped
+
+    def prepend(self, lines):
+        """
+        Adds lines, oldest first, before row 0. Returns how many of the newest lines were dropped for them.
+        """
+        lines = lines[-self.limit:]
+        dropped = max(0, self._count + len(lines) - self.limit)
+        self._count -= dropped
+        for line in reversed(lines):
+            self._first = (self._first - 1) % self.limit
+            self._lines[self._first] = line
+            self._count += 1
+        return dropped
+
+    def clear(self):
+        self._lines = [None] * self.limit
+        self._first = 0
+        self._count = 0
+
+    def find(self, text, start, backwards=True):
+        """
+        Returns the row of the first line matching text from start on, or None.
+        """
+        text = text.lower()
+        rows = range(start, -1, -1) if backwards else range(start, self._count)
+        for row in rows:
+            if 0 <= row < self._count and self[row].matches(text):
+                return row
+        return None
+
+
+class ChatLogView(QtWidgets.QAbstractScrollArea):
+    """
+    Shows a ChatLog, promoted in place of the QTextBrowser in channel.ui.
+
+    Whole lines are selected with the mouse and copied with copy(). Scrolling to
+    either end signals topReached or bottomReached, for more lines to be paged in.
+    """
+    anchorClicked = QtCore.pyqtSignal(QtCore.QUrl)
+    topReached = QtCore.pyqtSignal()
+    bottomReached = QtCore.pyqtSignal()
+
+    MARGIN = 2
+
+    def __init__(self, parent=None):
+        QtWidgets.QAbstractScrollArea.__init__(self, parent)
+        self.log = ChatLog()
+        self._docs = {}         # line -> its document, for the lines last shown
+        self._width = None
+        self._shown = []        # (row, top, document) of the lines last shown
+        self._selection = None  # (first, last) rows
+        self._pressed = None    # row the mouse went down on
+
+        self.setHorizontalScrollBarPolicy(QtCore.Qt.ScrollBarAlwaysOff)
+        bar = self.verticalScrollBar()
+        bar.setRange(0, 0)
+        bar.setSingleStep(1)
+        bar.valueChanged.connect(self.viewport().update)
+        bar.valueChanged.connect(self._atScrolled)
+        self.viewport().setMouseTracking(True)
+
+    def setLimit(self, limit):
+        self.log = ChatLog(limit)
+        self.clear()
+
+    def following(self):
+        bar = self.verticalScrollBar()
+        return bar.value() == bar.maximum()
+
+    def append(self, line, scroll=False):
+        """
+        Adds line to the log, scrolling to it if asked to or if the view was following.
+        """
+        follow = scroll or self.following()
+        bar = self.verticalScrollBar()
+        value = bar.value()
+        if self.log.append(line):
+            value -= 1
+            self._shiftRows(-1)
+        bar.setMaximum(len(self.log) - 1)
+        bar.setValue(bar.maximum() if follow else max(0, value))
+        self.viewport().update()
+
+    def extend(self, lines):
+        """
+        Adds newer lines below the others, keeping the view where it is.
+        """
+        bar = self.verticalScrollBar()
+        value = bar.value()
+        for line in lines:
+            if self.log.append(line):
+                value -= 1
+                self._shiftRows(-1)
+        bar.setRange(0, max(0, len(self.log) - 1))
+        bar.setValue(max(0, value))
+        self.viewport().update()
+
+    def scrollToBottom(self):
+        bar = self.verticalScrollBar()
+        bar.setValue(bar.maximum())
+
+    def prepend(self, lines):
+        """
+        Adds older lines above the others, keeping the view where it is. Returns how many
+        of the newest lines were dropped for them.
+        """
+        if not lines:
+            return 0
+        bar = self.verticalScrollBar()
+        value = bar.value()
+        dropped = self.log.prepend(lines)
+        added = min(len(lines), self.log.limit)
+        self._shiftRows(added)
+        bar.setRange(0, len(self.log) - 1)
+        bar.setValue(min(value + added, bar.maximum()))
+        self.viewport().update()
+        return dropped
+
+    def historyIds(self):
+        """ the history ids of the oldest and newest logged lines shown, None if there are none """
+        rows = range(len(self.log))
+        oldest = next((self.log[row].history_id for row in rows if self.log[row].history_id is not None), None)
+        newest = next((self.log[row].history_id for row in reversed(rows) if self.log[row].history_id is not None),
+                      None)
+        return oldest, newest
+
+    def select(self, row):
+        """ selects the line at row and scrolls to it """
+        self._selection = (row, row)
+        bar = self.verticalScrollBar()
+        if not self._shown or not self._shown[0][0] < row <= self._shown[-1][0]:
+            bar.setValue(row)
+        self.viewport().update()
+
+    def _atScrolled(self, value):
+        if value == 0 and len(self.log):
+            self.topReached.emit()
+        elif value == self.verticalScrollBar().maximum():
+            self.bottomReached.emit()
+
+    def clear(self):
+        self.log.clear()
+        self._docs = {}
+        self._shown = []
+        self._selection = None
+        self._pressed = None
+        self.verticalScrollBar().setRange(0, 0)
+        self.viewport().update()
+
+    def _shiftRows(self, delta):
+        """ lines were added or dropped above, rows moved by delta """
+        count = len(self.log)
+        if self._selection is not None:
+            first, last = self._selection[0] + delta, min(self._selection[1] + delta, count - 1)
+            self._selection = (max(0, first), last) if last >= 0 and first < count else None
+        if self._pressed is not None:
+            self._pressed = self._pressed + delta if 0 <= self._pressed + delta < count else None
+
+    def _document(self, row):
+        line = self.log[row]
+        doc = self._docs.get(line)
+        if doc is None:
+            doc = QtGui.QTextDocument()
+            doc.setDefaultFont(self.font())
+            doc.setDocumentMargin(self.MARGIN)
+            if line.avatar is not None:
+                pix = util.respix(line.avatar)
+                if pix:
+                    doc.addResource(QtGui.QTextDocument.ImageResource, QtCore.QUrl(line.avatar), pix)
+            doc.setHtml(line.html())    # A table row, made a table of its own as QTextBrowser.insertHtml did
+            doc.setTextWidth(self._width)
+            self._docs[line] = doc
+        return doc
+
+    def _layout(self):
+        """
+        Lays out the lines in view, upwards from the bottom row. If they don't fill the
+        view, they're shown from the top instead, with the following lines below them.
+        """
+        width = self.viewport().width()
+        if width != self._width:
+            self._width = width
+            for doc in self._docs.values():
+                doc.setTextWidth(width)
+        height = self.viewport().height()
+        shown = []
+        if len(self.log):
+            row = self.verticalScrollBar().value()
+            top = height
+            while row >= 0 and top > 0:
+                doc = self._document(row)
+                top -= doc.size().height()
+                shown.append((row, top, doc))
+                row -= 1
+            shown.reverse()
+            if top > 0:
+                shown = [(row, y - top, doc) for row, y, doc in shown]
+                row = shown[-1][0] + 1
+                bottom = shown[-1][1] + shown[-1][2].size().height()
+                while row < len(self.log) and bottom < height:
+                    doc = self._document(row)
+                    shown.append((row, bottom, doc))
+                    bottom += doc.size().height()
+                    row += 1
+        self._shown = shown
+        self._docs = {self.log[row]: doc for row, _, doc in shown}
+        self.verticalScrollBar().setPageStep(max(1, len(shown) - 1))
+
+    def paintEvent(self, event):
+        self._layout()
+        painter = QtGui.QPainter(self.viewport())
+        context = QtGui.QAbstractTextDocumentLayout.PaintContext()
+        context.palette = self.palette()
+        for row, top, doc in self._shown:
+            size = doc.size()
+            if self._selection is not None and self._selection[0] <= row <= self._selection[1]:
+                painter.fillRect(QtCore.QRectF(0, top, size.width(), size.height()), self.palette().highlight())
+            painter.save()
+            painter.translate(0, top)
+            context.clip = QtCore.QRectF(0, 0, size.width(), size.height())
+            doc.documentLayout().draw(painter, context)
+            painter.restore()
+
+    def _hit(self, pos):
+        for row, top, doc in self._shown:
+            if top <= pos.y() < top + doc.size().height():
+                return row, doc.documentLayout().anchorAt(QtCore.QPointF(pos.x(), pos.y() - top))
+        return None, ""
+
+    def mousePressEvent(self, event):
+        if event.button() != QtCore.Qt.LeftButton:
+            return QtWidgets.QAbstractScrollArea.mousePressEvent(self, event)
+        self._pressed, _ = self._hit(event.pos())
+        self._selection = None if self._pressed is None else (self._pressed, self._pressed)
+        self.viewport().update()
+
+    def mouseMoveEvent(self, event):
+        row, anchor = self._hit(event.pos())
+        if anchor:
+            self.viewport().setCursor(QtCore.Qt.PointingHandCursor)
+        else:
+            self.viewport().unsetCursor()
+        if event.buttons() & QtCore.Qt.LeftButton and self._pressed is not None and row is not None:
+            self._selection = (min(self._pressed, row), max(self._pressed, row))
+            self.viewport().update()
+
+    def mouseReleaseEvent(self, event):
+        if event.button() != QtCore.Qt.LeftButton:
+            return QtWidgets.QAbstractScrollArea.mouseReleaseEvent(self, event)
+        row, anchor = self._hit(event.pos())
+        if anchor and row == self._pressed:
+            self._selection = None
+            self.viewport().update()
+            self.anchorClicked.emit(QtCore.QUrl(anchor))
+        self._pressed = None
+
+    def resizeEvent(self, event):
+        QtWidgets.QAbstractScrollArea.resizeEvent(self, event)
+        self.viewport().update()
+
+    def selectedText(self):
+        if self._selection is None:
+            return ""
+        first, last = self._selection
+        lines = []
+        for row in range(first, last + 1):
+            doc = QtGui.QTextDocument()
+            doc.setHtml(self.log[row].html())
+            lines.append(" ".join(doc.toPlainText().split()))
+        return "\n".join(lines)
+
+    def copy(self):
+        text = self.selectedText()
+        if text:
+            QtWidgets.QApplication.clipboard().setText(text)
+
+    def find(self, text, backwards=True):
+        """
+        Selects and scrolls to the next line matching text, searching from the selected line on.
+        Returns whether one was found.
+        """
+        if not text or not len(self.log):
+            return False
+        if self._selection is not None:
+            start = self._selection[0] - 1 if backwards else self._selection[1] + 1
+        else:
+            start = self.verticalScrollBar().value()
+        row = self.log.find(text, start, backwards)
+        if row is None:
+            return False
+        self.select(row)
+        return True
@@ -6,7 +6,6 @@ import time
 import urllib.request, urllib.error, urllib.parse
 from fa.replay import replay
 import util
-import client
 from config import Settings
 
 from model.game import GameState
@@ -15,10 +14,11 @@ from model.game import GameState
 A chatter is the representation of a person on IRC, in a channel's nick list.
 There are multiple chatters per channel.
 There can be multiple chatters for every Player in the Client.
+A chatter is a row of its channel's ChatterModel, the parent it's created with.
 """
 
 
-class Chatter(QtWidgets.QTableWidgetItem):
+class Chatter(object):
     SORT_COLUMN = 2
     AVATAR_COLUMN = 1
     RANK_COLUMN = 0
@@ -30,49 +30,63 @@ class Chatter(QtWidgets.QTableWidgetItem):
     RANK_NONPLAYER = 3
     RANK_FOE = 4
 
-    def __init__(self, parent, user, channel, chat_widget, me):
-        QtWidgets.QTableWidgetItem.__init__(self, None)
+    _ALIGNMENT = {
+        SORT_COLUMN: QtCore.Qt.AlignLeft | QtCore.Qt.AlignVCenter,
+        AVATAR_COLUMN: QtCore.Qt.AlignHCenter,
+        RANK_COLUMN: QtCore.Qt.AlignHCenter,
+        STATUS_COLUMN: QtCore.Qt.AlignHCenter,
+    }
 
+    def __init__(self, parent, user, channel, chat_widget, me):
         # TODO: for now, userflags and ranks aren't properly interpreted :-/
         # This is impractical if an operator reconnects too late.
         self.parent = parent
         self.chat_widget = chat_widget
         self.channel = channel
 
+        # Relation changes reach us through the channel's model
         self._me = me
-        self._me.relationsUpdated.connect(self._checkPlayerRelation)
-        self._me.ircRelationsUpdated.connect(self._checkUserRelation)
 
-        self.setFlags(QtCore.Qt.ItemIsEnabled)
-        self.setTextAlignment(QtCore.Qt.AlignLeft | QtCore.Qt.AlignVCenter)
+        self.text = ""
+        self.foreground = QtGui.QColor()
         self.avatarTip = ""
-
-        self.avatarItem = QtWidgets.QTableWidgetItem()
-        self.avatarItem.setFlags(QtCore.Qt.ItemIsEnabled)
-        self.avatarItem.setTextAlignment(QtCore.Qt.AlignHCenter)
-
-        self.rankItem = QtWidgets.QTableWidgetItem()
-        self.rankItem.setFlags(QtCore.Qt.ItemIsEnabled)
-        self.rankItem.setTextAlignment(QtCore.Qt.AlignHCenter)
-
-        self.statusItem = QtWidgets.QTableWidgetItem()
-        self.statusItem.setFlags(QtCore.Qt.ItemIsEnabled)
-        self.statusItem.setTextAlignment(QtCore.Qt.AlignHCenter)
+        # Per column
+        self._icons = [None] * 4
+        self._tips = [None] * 4
 
         self._user = None
         self._user_player = None
         self._user_game = None
-        # This updates the above three and the widget
+        # This updates the above three and the row
         self.user = user
 
-        row = self.parent.rowCount()
-        self.parent.insertRow(row)
-
-        self.parent.setItem(row, Chatter.SORT_COLUMN, self)
-
-        self.parent.setItem(self.row(), Chatter.RANK_COLUMN, self.rankItem)
-        self.parent.setItem(self.row(), Chatter.AVATAR_COLUMN, self.avatarItem)
-        self.parent.setItem(self.row(), Chatter.STATUS_COLUMN, self.statusItem)
+    def data(self, column, role):
+        if role == QtCore.Qt.DisplayRole:
+            return self.text if column == Chatter.SORT_COLUMN else None
+        if role == QtCore.Qt.DecorationRole:
+            return self._icons[column]
+        if role == QtCore.Qt.ToolTipRole:
+            return self._tips[column]
+        if role == QtCore.Qt.ForegroundRole:
+            return self.foreground if column == Chatter.SORT_COLUMN else None
+        if role == QtCore.Qt.TextAlignmentRole:
+            return self._ALIGNMENT[column]
+        return None
+
+    def _setIcon(self, column, icon, tip=None):
+        self._icons[column] = icon
+        self._tips[column] = tip
+
+    def _changed(self):
+        self.parent.chatterChanged(self)
+
+    def detach(self):
+        """
+        Stops following the user, once the chatter left the channel.
+        """
+        self.user_player = None
+        self._user.updated.disconnect(self.updateUser)
+        self._user.newPlayer.disconnect(self._set_user_player)
 
     @property
     def user(self):
@@ -133,18 +147,11 @@ class Chatter(QtWidgets.QTableWidgetItem):
         if self._user_game is not None:
             self._user_game.gameUpdated.connect(self.updateGame)
 
-    def _checkPlayerRelation(self, players):
-        if self.user_player is None:
-            return
-
-        if self.user_player.id in players:
-            self.set_color()
-            self._verifySortOrder()
+    def playerId(self):
+        return -1 if self.user_player is None else self.user_player.id
 
-    def _checkUserRelation(self, users):
-        if self.user.name in users:
-            self.set_color()
-            self._verifySortOrder()
+    def relationsChanged(self):
+        self.set_color()
 
     def isFiltered(self, _filter):
         clan = None if self.user_player is None else self.user_player.clan
@@ -154,37 +161,13 @@ class Chatter(QtWidgets.QTableWidgetItem):
             return True
         return False
 
-    def setVisible(self, visible):
-        if visible:
-            self.tableWidget().showRow(self.row())
-        else:
-            self.tableWidget().hideRow(self.row())
-
-    def __ge__(self, other):
-        """ Comparison operator used for item list sorting """
-        return not self.__lt__(other)
-
-    def __lt__(self, other):
-        """ Comparison operator used for item list sorting """
-        firstStatus = self.getUserRank(self)
-        secondStatus = self.getUserRank(other)
-
-        if self._me.player is not None:
-            if self.user.name == self._me.player.login:
-                return True
-            if other.user.name == self._me.player.login:
-                return False
-
-        # if not same rank sort
-        if firstStatus != secondStatus:
-            return firstStatus < secondStatus
-
-        # Default: Alphabetical
-        return self.user.name.lower() < other.user.name.lower()
-
-    def _verifySortOrder(self):
-        if self.row() != -1:
-            self.channel.verifySortOrder(self)
+    def sortKey(self):
+        """
+        We go first, then by rank, then alphabetical.
+        """
+        me = self._me.player
+        is_me = me is not None and self.user.name == me.login
+        return not is_me, self.getUserRank(self), self.user.name.lower()
 
     def _getIdName(self):
         _id = -1 if self.user_player is None else self.user_player.id
@@ -223,20 +206,19 @@ class Chatter(QtWidgets.QTableWidgetItem):
             avatarPix = util.respix(url)
 
             if avatarPix:
-                self.avatarItem.setIcon(QtGui.QIcon(avatarPix))
-                self.avatarItem.setToolTip(self.avatarTip)
+                self._setIcon(Chatter.AVATAR_COLUMN, QtGui.QIcon(avatarPix), self.avatarTip)
+                self._changed()
             else:
                 if util.addcurDownloadAvatar(url, self):
                     self.chat_widget.nam.get(QNetworkRequest(QtCore.QUrl(url)))
         else:
             # No avatar set.
-            self.avatarItem.setIcon(QtGui.QIcon())
-            self.avatarItem.setToolTip(None)
+            self._setIcon(Chatter.AVATAR_COLUMN, None)
 
     def updateUser(self):
-        self.setText(self.user.name)
+        self.text = self.user.name
         self.set_color()
-        self._verifySortOrder()
+        self._changed()
 
     def updatePlayer(self):
         self.set_color()
@@ -244,47 +226,48 @@ class Chatter(QtWidgets.QTableWidgetItem):
         player = self.user_player
         # Weed out IRC users and those we don't know about early.
         if player is None:
-            self.rankItem.setIcon(util.THEME.icon("chat/rank/civilian.png"))
-            self.rankItem.setToolTip("IRC User")
+            self._setIcon(Chatter.RANK_COLUMN, util.THEME.icon("chat/rank/civilian.png"), "IRC User")
+            self._setIcon(Chatter.SORT_COLUMN, None)
+            self._setIcon(Chatter.AVATAR_COLUMN, None)
+            self.text = self.user.name
+            self._changed()
             return
 
         country = player.country
         if country is not None:
-            self.setIcon(util.THEME.icon("chat/countries/%s.png" % country.lower()))
-            self.setToolTip(country)
+            self._setIcon(Chatter.SORT_COLUMN, util.THEME.icon("chat/countries/%s.png" % country.lower()), country)
 
         self.updateAvatar()
 
         if player.clan is not None:
-            self.setText("[%s]%s" % (player.clan, self.user.name))
+            self.text = "[%s]%s" % (player.clan, self.user.name)
+        else:
+            self.text = self.user.name
 
         rating = player.rating_estimate()
         ladder_rating = player.ladder_estimate()
 
-        # Rating icon choice  (chr(0xB1) = +-)
-        formatting = ("Global Rating: {} ({} Games) [{}\xb1{}]\n"
-                      "Ladder Rating: {} [{}\xb1{}]")
-        self.rankItem.setToolTip(formatting.format(
-            str(int(rating)),
-            str(player.number_of_games),
-            str(int(player.rating_mean)),
-            str(int(player.rating_deviation)),
-            str(int(ladder_rating)),
-            str(int(player.ladder_rating_mean)),
-            str(int(player.ladder_rating_deviation))))
-
         league = player.league
         if league is not None:
             formatting = ("Division : {}\n"
                           "Global Rating: {}")
-            self.rankItem.setToolTip(formatting.format(
-                league["division"],
-                str(int(rating))))
-            self.rankItem.setIcon(util.THEME.icon("chat/rank/%s.png" % league["league"]))
+            self._setIcon(Chatter.RANK_COLUMN,
+                          util.THEME.icon("chat/rank/%s.png" % league["league"]),
+                          formatting.format(league["division"], str(int(rating))))
         else:
-            self.rankItem.setIcon(util.THEME.icon("chat/rank/newplayer.png"))
-
-        self._verifySortOrder()
+            # Rating icon choice  (chr(0xB1) = +-)
+            formatting = ("Global Rating: {} ({} Games) [{}\xb1{}]\n"
+                          "Ladder Rating: {} [{}\xb1{}]")
+            self._setIcon(Chatter.RANK_COLUMN, util.THEME.icon("chat/rank/newplayer.png"), formatting.format(
+                str(int(rating)),
+                str(player.number_of_games),
+                str(int(player.rating_mean)),
+                str(int(player.rating_deviation)),
+                str(int(ladder_rating)),
+                str(int(player.ladder_rating_mean)),
+                str(int(player.ladder_rating_deviation))))
+
+        self._changed()
 
     def updateGame(self):
         # Status icon handling
@@ -293,16 +276,15 @@ class Chatter(QtWidgets.QTableWidgetItem):
         if game is not None and not game.closed():
             url = game.url(player.id)
             if game.state == GameState.OPEN:
-                self.statusItem.setIcon(util.THEME.icon("chat/status/lobby.png"))
-                self.statusItem.setToolTip("In Game Lobby<br/>"+url.toString())
+                self._setIcon(Chatter.STATUS_COLUMN, util.THEME.icon("chat/status/lobby.png"),
+                              "In Game Lobby<br/>" + url.toString())
             elif game.state == GameState.PLAYING:
-                self.statusItem.setIcon(util.THEME.icon("chat/status/playing.png"))
-                self.statusItem.setToolTip("Playing Game<br/>"+url.toString())
+                self._setIcon(Chatter.STATUS_COLUMN, util.THEME.icon("chat/status/playing.png"),
+                              "Playing Game<br/>" + url.toString())
         else:
-            self.statusItem.setIcon(QtGui.QIcon())
-            self.statusItem.setToolTip("Idle")
+            self._setIcon(Chatter.STATUS_COLUMN, None, "Idle")
 
-        self._verifySortOrder()
+        self._changed()
 
     def update(self):
         self.updateUser()
@@ -318,7 +300,7 @@ class Chatter(QtWidgets.QTableWidgetItem):
             color = pcolors.getModColor(elevation, _id, name)
         else:
             color = pcolors.getUserColor(_id, name)
-        self.setForeground(QtGui.QColor(color))
+        self.foreground = QtGui.QColor(color)
 
     def viewAliases(self):
         QtGui.QDesktopServices.openUrl(QUrl("{}?name={}".format(Settings.get("USER_ALIASES_URL"), self.user.name)))
@@ -334,16 +316,16 @@ class Chatter(QtWidgets.QTableWidgetItem):
     def kick(self):
         pass
 
-    def doubleClicked(self, item):
+    def doubleClicked(self, column):
         # filter yourself
         if self._me.player is not None:
             if self._me.player.login == self.user.name:
                 return
         # Chatter name clicked
-        if item == self:
+        if column == Chatter.SORT_COLUMN:
             self.chat_widget.openQuery(self.user, activate=True)  # open and activate query window
 
-        elif item == self.statusItem:
+        elif column == Chatter.STATUS_COLUMN:
             self._interactWithGame()
 
     def _interactWithGame(self):
@@ -357,8 +339,8 @@ class Chatter(QtWidgets.QTableWidgetItem):
         elif game.state == GameState.PLAYING:
             self.viewReplay(url)
 
-    def pressed(self, item):
-        menu = QtWidgets.QMenu(self.parent)
+    def pressed(self, column):
+        menu = QtWidgets.QMenu(self.channel)
 
         def menu_add(action_str, action_connect, separator=False):
             if separator:
@@ -453,7 +435,7 @@ class Chatter(QtWidgets.QTableWidgetItem):
         self.chat_widget.client.mainTabs.setCurrentIndex(self.chat_widget.client.mainTabs.indexOf(self.chat_widget.client.replaysTab))
 
     def joinInGame(self, url):
-        client.instance.joinGameFromURL(url)
+        self.chat_widget.client.joinGameFromURL(url)
 
     def viewReplay(self, url):
         replay(url)
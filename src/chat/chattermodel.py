@@ -0,0 +1,217 @@
+"""
+Model of a channel's nick list.
+
+Rows are kept in order of each chatter's precomputed sort key, so a joining
+user is placed by binary search and a chatter whose key changed is moved on
+its own, instead of the whole list being sorted again through comparisons
+that work out ranks over and over. Relation changes come in through one
+connection per channel, not one per chatter. Joins and parts arriving in
+bulk, like the NAMES listing or a netsplit, go through addMany and
+removeMany, which sort and signal once for the whole batch.
+
+Chatters provide sortKey(), data(column, role), isFiltered(text),
+relationsChanged() to update themselves (the model moves their rows), and
+the player id and name relation changes refer to.
+"""
+import bisect
+
+from PyQt5 import QtCore
+
+# Beyond this many changed chatters, sorting everything once beats moving rows one by one
+RESORT_THRESHOLD = 16
+
+
+class ChatterModel(QtCore.QAbstractTableModel):
+    ChatterRole = QtCore.Qt.UserRole
+    COLUMNS = 4
+
+    def __init__(self, me=None, *args, **kwargs):
+        QtCore.QAbstractTableModel.__init__(self, *args, **kwargs)
+        self._rows = []
+        self._keys = []     # sort keys of _rows, as they were when placed
+        self._placed = {}   # chatter -> its key in _keys
+        if me is not None:
+            me.relationsUpdated.connect(self._atPlayerRelations)
+            me.ircRelationsUpdated.connect(self._atUserRelations)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else self.COLUMNS
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self._rows):
+            return None
+        chatter = self._rows[index.row()]
+        if role == self.ChatterRole:
+            return chatter
+        return chatter.data(index.column(), role)
+
+    def flags(self, index):
+        if not index.isValid():
+            return QtCore.Qt.NoItemFlags
+        return QtCore.Qt.ItemIsEnabled
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, chatter):
+        return chatter in self._placed
+
+    def chatters(self):
+        return list(self._rows)
+
+    def chatterAt(self, row):
+        return self._rows[row]
+
+    def row(self, chatter):
+        key = self._placed[chatter]
+        row = bisect.bisect_left(self._keys, key)
+        while self._rows[row] is not chatter:   # Past others with the same key
+            row += 1
+        return row
+
+    def add(self, chatter):
+        if chatter in self._placed:
+            return
+        key = chatter.sortKey()
+        row = bisect.bisect_right(self._keys, key)
+        self.beginInsertRows(QtCore.QModelIndex(), row, row)
+        self._rows.insert(row, chatter)
+        self._keys.insert(row, key)
+        self._placed[chatter] = key
+        self.endInsertRows()
+
+    def remove(self, chatter):
+        if chatter not in self._placed:
+            return
+        row = self.row(chatter)
+        self.beginRemoveRows(QtCore.QModelIndex(), row, row)
+        del self._rows[row]
+        del self._keys[row]
+        del self._placed[chatter]
+        self.endRemoveRows()
+
+    def addMany(self, chatters):
+        """
+        Adds chatters in one go: appended, then put in place by a single sort.
+        """
+        chatters = [chatter for chatter in dict.fromkeys(chatters) if chatter not in self._placed]
+        if len(chatters) <= RESORT_THRESHOLD:
+            for chatter in chatters:
+                self.add(chatter)
+            return
+        first = len(self._rows)
+        keys = [chatter.sortKey() for chatter in chatters]
+        self.beginInsertRows(QtCore.QModelIndex(), first, first + len(chatters) - 1)
+        self._rows.extend(chatters)
+        self._keys.extend(keys)
+        self._placed.update(zip(chatters, keys))
+        self.endInsertRows()
+        self.resort()
+
+    def removeMany(self, chatters):
+        """
+        Removes chatters in one go: moved past the others, then taken off the end.
+        """
+        gone = {chatter for chatter in chatters if chatter in self._placed}
+        if len(gone) <= RESORT_THRESHOLD:
+            for chatter in gone:
+                self.remove(chatter)
+            return
+        kept = [i for i, chatter in enumerate(self._rows) if chatter not in gone]
+        dropped = [i for i, chatter in enumerate(self._rows) if chatter in gone]
+        order = kept + dropped
+        self._reorder(order, [self._keys[i] for i in order])
+        first = len(kept)
+        self.beginRemoveRows(QtCore.QModelIndex(), first, len(self._rows) - 1)
+        del self._rows[first:]
+        del self._keys[first:]
+        for chatter in gone:
+            del self._placed[chatter]
+        self.endRemoveRows()
+
+    def chatterChanged(self, chatter):
+        """
+        Refreshes the row of chatter, moving it if its sort key changed.
+        """
+        if chatter not in self._placed:
+            return
+        row = self.row(chatter)
+        key = chatter.sortKey()
+        if key != self._placed[chatter]:
+            before = bisect.bisect_right(self._keys, key)    # Where it goes, counting itself
+            target = before - 1 if before > row else before  # and once taken out
+            if target != row:
+                self.beginMoveRows(QtCore.QModelIndex(), row, row, QtCore.QModelIndex(), before)
+                del self._rows[row]
+                del self._keys[row]
+                self._rows.insert(target, chatter)
+                self._keys.insert(target, key)
+                self.endMoveRows()
+                row = target
+            else:
+                self._keys[row] = key
+            self._placed[chatter] = key
+        self.dataChanged.emit(self.index(row, 0), self.index(row, self.COLUMNS - 1))
+
+    def resort(self):
+        """
+        Works out all sort keys again, for changes that affect every chatter.
+        """
+        keyed = sorted(((chatter.sortKey(), i) for i, chatter in enumerate(self._rows)), key=lambda item: item[0])
+        self._reorder([i for _, i in keyed], [key for key, _ in keyed])
+
+    def _reorder(self, order, keys):
+        """
+        Lays the rows out again, order listing their current positions, keys their sort keys.
+        """
+        self.layoutAboutToBeChanged.emit()
+        persistent = self.persistentIndexList()
+        old = [(index.row(), index.column()) for index in persistent]
+        chatters = self._rows
+        self._rows = [chatters[i] for i in order]
+        self._keys = keys
+        self._placed = dict(zip(self._rows, self._keys))
+        moved = {old_row: new_row for new_row, old_row in enumerate(order)}
+        self.changePersistentIndexList(persistent, [self.index(moved[row], column) for row, column in old])
+        self.layoutChanged.emit()
+
+    def _atRelations(self, changed, affected):
+        chatters = [chatter for chatter in self._rows if affected(chatter) in changed]
+        for chatter in chatters:
+            chatter.relationsChanged()
+        if len(chatters) > RESORT_THRESHOLD:
+            self.resort()
+            if self._rows:
+                self.dataChanged.emit(self.index(0, 0), self.index(len(self._rows) - 1, self.COLUMNS - 1))
+        else:
+            for chatter in chatters:
+                self.chatterChanged(chatter)
+
+    @QtCore.pyqtSlot(set)
+    def _atPlayerRelations(self, ids):
+        self._atRelations(ids, lambda chatter: chatter.playerId())
+
+    @QtCore.pyqtSlot(set)
+    def _atUserRelations(self, names):
+        self._atRelations(names, lambda chatter: chatter.user.name)
+
+
+class ChatterFilterModel(QtCore.QSortFilterProxyModel):
+    """
+    Hides the chatters not matching the nick filter. Keeps the source order.
+    """
+    def __init__(self, *args, **kwargs):
+        QtCore.QSortFilterProxyModel.__init__(self, *args, **kwargs)
+        self._filter = ""
+
+    def setFilter(self, text):
+        self._filter = text
+        self.invalidateFilter()
+
+    def filterAcceptsRow(self, row, parent):
+        if not self._filter:
+            return True
+        return self.sourceModel().chatterAt(row).isFiltered(self._filter)
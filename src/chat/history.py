@@ -0,0 +1,386 @@
+"""
+On-disk history of channels and queries.
+
+Every channel or query gets a directory of numbered segments. Lines are
+appended to the newest segment, a plain file of one JSON array per line,
+and once it grows past SEGMENT_SIZE it's gzipped and never written again.
+An SQLite database next to the directories maps line ids to their segment
+and keeps a full text index of them, so paging back and searching read only
+the few segments holding the lines asked for.
+
+Compressed segments are deleted once they're older than RETENTION_DAYS, or
+once those of a log take more than LOG_SIZE_LIMIT bytes, along with their
+lines in the database. The history is only kept once the user turns it on
+with setEnabled().
+"""
+import collections
+import gzip
+import json
+import os
+import sqlite3
+import time
+
+from PyQt5 import QtCore
+
+import util
+from config import Settings
+
+import logging
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION = 2
+SEGMENT_SIZE = 1024 * 1024  # bytes of a segment before it's compressed
+COMMIT_INTERVAL = 5         # seconds from a line being logged to it being committed
+CACHED_SEGMENTS = 4         # compressed segments kept read
+RETENTION_DAYS = 365        # age of the compressed segments deleted
+LOG_SIZE_LIMIT = 32 * 1024 * 1024   # bytes of compressed segments kept per log
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS logs (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    segment INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS lines (
+    id INTEGER PRIMARY KEY,
+    log INTEGER NOT NULL REFERENCES logs(id),
+    segment INTEGER NOT NULL,
+    line INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS lines_log ON lines(log, id);
+"""
+
+# The text lives in the segments. FTS4 reads the words of the lines it deletes from its content table,
+# so that's one holding just the lines being pruned.
+_FTS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pruned (id INTEGER PRIMARY KEY, body TEXT NOT NULL);
+CREATE VIRTUAL TABLE IF NOT EXISTS words USING fts4(content='pruned', body);
+"""
+# For SQLite builds without FTS4
+_PLAIN_SCHEMA = "CREATE TABLE IF NOT EXISTS words (docid INTEGER PRIMARY KEY, body TEXT NOT NULL)"
+
+HistoryLine = collections.namedtuple("HistoryLine", "id time kind name text")
+
+
+def _query(text):
+    """ an FTS query matching lines with all the words in text, the last one as a prefix """
+    words = ['"' + word.replace('"', '""') + '"' for word in text.split()]
+    if words:
+        words[-1] = words[-1][:-1] + '*"'
+    return " ".join(words)
+
+
+class _Log(object):
+    """ the open newest segment of a log """
+    def __init__(self, log_id, directory, segment):
+        self.id = log_id
+        self.directory = directory
+        self.segment = segment
+        os.makedirs(directory, exist_ok=True)
+        self.file = open(self.path(segment), "ab+")
+        self.file.seek(0)
+        data = self.file.read()
+        if data and not data.endswith(b"\n"):   # Cut short, that line stays unreadable
+            self.file.write(b"\n")
+            data += b"\n"
+        self.lines = data.count(b"\n")
+        self.size = len(data)
+
+    def path(self, segment, compressed=False):
+        return os.path.join(self.directory, "%06d.log" % segment + (".gz" if compressed else ""))
+
+
+class ChatHistory(object):
+    """
+    The logs of all channels and queries, kept under directory.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(directory, "history.sqlite"))
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute("PRAGMA synchronous = NORMAL")
+        self._setup()
+        self._logs = {}
+        self._segments = collections.OrderedDict()  # (log id, segment) -> lines, of compressed ones
+        # Lines are committed, and written out of the file buffers, a while after they're logged
+        self._commitTimer = QtCore.QTimer()
+        self._commitTimer.setSingleShot(True)
+        self._commitTimer.setInterval(int(COMMIT_INTERVAL * 1000))
+        self._commitTimer.timeout.connect(self.commit)
+        self.prune()
+
+    def _setup(self):
+        version = self._db.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            self._db.executescript("DROP TABLE IF EXISTS words; DROP TABLE IF EXISTS pruned; "
+                                   "DROP TABLE IF EXISTS lines; DROP TABLE IF EXISTS logs;")
+            self._db.execute("PRAGMA user_version = {}".format(SCHEMA_VERSION))
+        self._db.executescript(_SCHEMA)
+        try:
+            self._db.executescript(_FTS_SCHEMA)
+            self.fulltext = True
+        except sqlite3.OperationalError:
+            logger.info("No FTS4 in this SQLite, chat history search scans the lines")
+            self._db.execute(_PLAIN_SCHEMA)
+            self.fulltext = False
+        self._db.commit()
+
+    def close(self):
+        self.commit()
+        self._commitTimer.stop()
+        for log in self._logs.values():
+            log.file.close()
+        self._logs = {}
+        self._db.close()
+
+    def commit(self):
+        for log in self._logs.values():
+            log.file.flush()
+        self._db.commit()
+        self._commitTimer.stop()
+
+    def _logId(self, name):
+        row = self._db.execute("SELECT id FROM logs WHERE name = ?", (name.lower(),)).fetchone()
+        return row[0] if row else None
+
+    def _open(self, name):
+        key = name.lower()
+        log = self._logs.get(key)
+        if log is None:
+            row = self._db.execute("SELECT id, segment FROM logs WHERE name = ?", (key,)).fetchone()
+            if row is None:
+                log_id = self._db.execute("INSERT INTO logs (name, segment) VALUES (?, 0)", (key,)).lastrowid
+                row = (log_id, 0)
+            log_id, segment = row
+            directory = os.path.join(self.directory, str(log_id))
+            # Finish a rotation cut short
+            while os.path.exists(os.path.join(directory, "%06d.log.gz" % segment)):
+                if os.path.exists(os.path.join(directory, "%06d.log" % segment)):
+                    os.remove(os.path.join(directory, "%06d.log" % segment))
+                segment += 1
+                self._db.execute("UPDATE logs SET segment = ? WHERE id = ?", (segment, log_id))
+            log = self._logs[key] = _Log(log_id, directory, segment)
+        return log
+
+    def append(self, name, kind, source, text, when=None):
+        """
+        Logs a line to the channel or query called name. Returns its id.
+        """
+        log = self._open(name)
+        when = time.time() if when is None else when
+        cursor = self._db.execute("INSERT INTO lines (log, segment, line) VALUES (?, ?, ?)",
+                                  (log.id, log.segment, log.lines))
+        line_id = cursor.lastrowid
+        self._db.execute("INSERT INTO words (docid, body) VALUES (?, ?)", (line_id, source + " " + text))
+        data = (json.dumps([line_id, when, kind, source, text]) + "\n").encode("utf-8")
+        log.file.write(data)
+        log.lines += 1
+        log.size += len(data)
+        if log.size >= SEGMENT_SIZE:
+            self._rotate(log)
+        elif not self._commitTimer.isActive():
+            self._commitTimer.start()
+        return line_id
+
+    def _rotate(self, log):
+        """ compresses the newest segment of log and starts the next one """
+        log.file.seek(0)
+        data = log.file.read()
+        log.file.close()
+        compressed = log.path(log.segment, compressed=True)
+        with gzip.open(compressed + ".tmp", "wb") as fh:
+            fh.write(data)
+        os.replace(compressed + ".tmp", compressed)
+        os.remove(log.path(log.segment))
+        log.segment += 1
+        log.file = open(log.path(log.segment), "ab+")
+        log.lines = 0
+        log.size = 0
+        self._db.execute("UPDATE logs SET segment = ? WHERE id = ?", (log.segment, log.id))
+        self._prune(log.id)
+        self.commit()
+
+    def prune(self):
+        """
+        Deletes the compressed segments of every log past the retention limits.
+        """
+        for (log_id,) in self._db.execute("SELECT id FROM logs").fetchall():
+            self._prune(log_id)
+        self.commit()
+
+    def _prune(self, log_id):
+        directory = os.path.join(self.directory, str(log_id))
+        try:
+            segments = sorted((entry for entry in os.scandir(directory) if entry.name.endswith(".log.gz")),
+                              key=lambda entry: entry.name)
+        except OSError:
+            return
+        expired = time.time() - RETENTION_DAYS * 24 * 60 * 60
+        kept = sum(entry.stat().st_size for entry in segments)
+        last = None
+        for entry in segments:      # Oldest first
+            if kept <= LOG_SIZE_LIMIT and entry.stat().st_mtime >= expired:
+                break
+            kept -= entry.stat().st_size
+            last = int(entry.name[:-len(".log.gz")])
+            self._segments.pop((log_id, last), None)
+            if self.fulltext:
+                self._unindex(log_id, last, entry.path)
+            try:
+                os.remove(entry.path)
+            except OSError:
+                logger.warning("Couldn't delete chat history segment " + entry.path)
+        if last is None:
+            return
+        logger.info("Deleted chat history segments up to " + str(last) + " of " + directory)
+        if not self.fulltext:
+            self._db.execute("DELETE FROM words WHERE docid IN (SELECT id FROM lines WHERE log = ? AND segment <= ?)",
+                             (log_id, last))
+        self._db.execute("DELETE FROM lines WHERE log = ? AND segment <= ?", (log_id, last))
+
+    def _unindex(self, log_id, segment, path):
+        """ drops the words of the lines in the compressed segment at path from the full text index """
+        rows = self._db.execute("SELECT id, line FROM lines WHERE log = ? AND segment = ?", (log_id, segment)).fetchall()
+        try:
+            with gzip.open(path, "rb") as fh:
+                lines = fh.read().split(b"\n")
+        except (OSError, EOFError):
+            logger.warning("Couldn't read chat history segment " + path + ", its words stay in the index")
+            return
+        for line_id, line in rows:
+            try:
+                logged = HistoryLine(*json.loads(lines[line].decode("utf-8")))
+            except (IndexError, ValueError, TypeError):
+                continue    # Never written out, nothing to drop
+            # Deleting words that weren't indexed for that id would corrupt the index
+            if logged.id == line_id:
+                self._db.execute("INSERT INTO pruned (id, body) VALUES (?, ?)", (line_id, logged.name + " " + logged.text))
+        self._db.execute("DELETE FROM words WHERE docid IN (SELECT id FROM pruned)")
+        self._db.execute("DELETE FROM pruned")
+
+    def _segment(self, log_id, segment):
+        key = (log_id, segment)
+        if key in self._segments:
+            self._segments.move_to_end(key)
+            return self._segments[key]
+        directory = os.path.join(self.directory, str(log_id))
+        path = os.path.join(directory, "%06d.log" % segment)
+        try:
+            if os.path.exists(path + ".gz"):
+                with gzip.open(path + ".gz", "rb") as fh:
+                    data = fh.read()
+                cache = True
+            else:
+                for log in self._logs.values():
+                    if log.id == log_id:
+                        log.file.flush()
+                with open(path, "rb") as fh:
+                    data = fh.read()
+                cache = False
+        except OSError:
+            logger.warning("Chat history segment " + path + " is missing")
+            return []
+        lines = data.split(b"\n")[:-1]
+        if cache:
+            self._segments[key] = lines
+            if len(self._segments) > CACHED_SEGMENTS:
+                self._segments.popitem(last=False)
+        return lines
+
+    def _read(self, rows):
+        """ the lines at (id, log, segment, line) rows, oldest first """
+        found = []
+        for line_id, log_id, segment, line in sorted(rows):
+            lines = self._segment(log_id, segment)
+            try:
+                found.append(HistoryLine(*json.loads(lines[line].decode("utf-8"))))
+            except (IndexError, ValueError, TypeError):
+                continue    # Written but not flushed before a crash
+        return found
+
+    def before(self, name, line_id=None, count=100):
+        """
+        Returns up to count lines logged for name before line_id, or the last ones, oldest first.
+        """
+        log_id = self._logId(name)
+        if log_id is None:
+            return []
+        if line_id is None:
+            line_id = 2 ** 62
+        rows = self._db.execute("SELECT id, log, segment, line FROM lines WHERE log = ? AND id < ? "
+                                "ORDER BY id DESC LIMIT ?", (log_id, line_id, count)).fetchall()
+        return self._read(rows)
+
+    def after(self, name, line_id, count=100):
+        """
+        Returns up to count lines logged for name after line_id, oldest first.
+        """
+        log_id = self._logId(name)
+        if log_id is None:
+            return []
+        rows = self._db.execute("SELECT id, log, segment, line FROM lines WHERE log = ? AND id > ? "
+                                "ORDER BY id LIMIT ?", (log_id, line_id, count)).fetchall()
+        return self._read(rows)
+
+    def search(self, name, text, before=None, limit=1):
+        """
+        Returns the ids of up to limit lines logged for name before the line before, newest first,
+        with all the words of text in their text or sender's name.
+        """
+        log_id = self._logId(name)
+        if log_id is None or not text.split():
+            return []
+        if before is None:
+            before = 2 ** 62
+        if self.fulltext:
+            rows = self._db.execute("SELECT lines.id FROM words JOIN lines ON lines.id = words.docid "
+                                    "WHERE words MATCH ? AND lines.log = ? AND lines.id < ? "
+                                    "ORDER BY lines.id DESC LIMIT ?", (_query(text), log_id, before, limit))
+        else:
+            condition = " AND ".join(["words.body LIKE ?"] * len(text.split()))
+            rows = self._db.execute("SELECT lines.id FROM words JOIN lines ON lines.id = words.docid "
+                                    "WHERE " + condition + " AND lines.log = ? AND lines.id < ? "
+                                    "ORDER BY lines.id DESC LIMIT ?",
+                                    ["%" + word + "%" for word in text.split()] + [log_id, before, limit])
+        return [row[0] for row in rows]
+
+
+_history = None
+_failed = False     # The history couldn't be opened, the client goes without
+
+
+def enabled():
+    return Settings.get('chat/history', type=bool, default=False)
+
+
+def setEnabled(enabled):
+    """
+    Turns keeping the chat history on or off, closing it when it's turned off.
+    """
+    global _failed
+    Settings.set('chat/history', enabled)
+    _failed = False
+    if not enabled:
+        close()
+
+
+def history():
+    """
+    The chat history kept in the client's data folder, None if it's turned off or broken.
+    """
+    global _history, _failed
+    if _history is None and not _failed and enabled():
+        try:
+            _history = ChatHistory(os.path.join(util.APPDATA_DIR, "chatlogs"))
+        except (OSError, sqlite3.Error):
+            logger.exception("Couldn't open the chat history, going without")
+            _failed = True
+    return _history
+
+
+def close():
+    global _history
+    if _history is not None:
+        _history.close()
+        _history = None
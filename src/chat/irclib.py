@@ -162,10 +162,14 @@ class IRC:
 
         self.add_global_handler("ping", _ping_ponger, -42)
 
-    def server(self):
-        """Creates and returns a ServerConnection object."""
+    def server(self, connection_class=None):
+        """Creates and returns a ServerConnection object.
 
-        c = ServerConnection(self)
+        connection_class may name a ServerConnection subclass to use
+        instead, e.g. one driven by another main loop.
+        """
+
+        c = (connection_class or ServerConnection)(self)
         self.connections.append(c)
         return c
 
@@ -331,6 +335,7 @@ class IRC:
             self.fn_to_remove_socket(connection._get_socket())
 
 _rfc_1459_command_regexp = re.compile("^(:(?P<prefix>[^ ]+) +)?(?P<command>[^ ]+)( *(?P<argument> .+))?")
+_message_commands = frozenset(["privmsg", "notice"])
 
 
 class Connection:
@@ -367,6 +372,67 @@ class ServerNotConnectedError(ServerConnectionError):
 _linesep_regexp = re.compile(b"\r?\n")
 
 
+class LineBuffer:
+    """Splits a stream of bytes into lines as it comes in.
+
+    Lines end with \n, optionally preceded by \r (see above).  Only
+    the unfinished tail is kept, and data that was already searched is
+    not searched again.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        """Adds data, returns the lines it completed, without line endings."""
+        buf = self._buffer
+        searched = len(buf)
+        buf += data
+        lines = []
+        start = 0
+        end = buf.find(b"\n", searched)
+        while end != -1:
+            stop = end - 1 if end > start and buf[end - 1] == 13 else end
+            lines.append(bytes(buf[start:stop]))
+            start = end + 1
+            end = buf.find(b"\n", start)
+        del buf[:start]
+        return lines
+
+
+class FloodControl:
+    """Token bucket pacing the lines sent to a server.
+
+    Up to burst lines may go out at once, after that one every interval
+    seconds, which keeps a client clear of the server's flood limits.
+    """
+
+    def __init__(self, burst=10, interval=1.0, clock=time.monotonic):
+        self.burst = burst
+        self.interval = interval
+        self._clock = clock
+        self._tokens = float(burst)
+        self._last = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._last) / self.interval)
+        self._last = now
+
+    def take(self):
+        """Returns whether a line may be sent now, counting it if so."""
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    def delay(self):
+        """Returns the seconds until the next line may be sent."""
+        self._refill()
+        return max(0.0, (1 - self._tokens) * self.interval)
+
+
 class ServerConnection(Connection):
     """This class represents an IRC server connection.
 
@@ -413,7 +479,7 @@ class ServerConnection(Connection):
         if self.connected:
             self.disconnect("Changing servers")
 
-        self.previous_buffer = b""
+        self.lines = LineBuffer()
         self.handlers = {}
         self.real_server_name = ""
         self.real_nickname = nickname
@@ -503,110 +569,109 @@ class ServerConnection(Connection):
             self.disconnect("Connection reset by peer")
             return
 
-        lines = _linesep_regexp.split(self.previous_buffer + new_data)
+        for line in self.lines.feed(new_data):
+            self._process_line(line)
 
-        # Save the last, unfinished line.
-        self.previous_buffer = lines.pop()
-
-        for line in lines:
-            if DEBUG:
-                print("FROM SERVER:", line)
-
-            if not line:
-                continue
-
-            try:
-                line = line.decode("utf-8", "replace")   # utf-8 support hacked in by thygrrr (may break in some scenarios - see chardet python package)
-            except:            
-                print("irclib: non-utf-8 line, unexpected encoding error " + line)
-                line = "** encoding error - replaced by irclib.py **"
-                
-            prefix = None
-            command = None
-            arguments = None
-            self._handle_event(Event("all_raw_messages",
-                                     self.get_server_name(),
-                                     None,
-                                     [line]))
-
-            m = _rfc_1459_command_regexp.match(line)
-            if m.group("prefix"):
-                prefix = m.group("prefix")
-                if not self.real_server_name:
-                    self.real_server_name = prefix
-
-            if m.group("command"):
-                command = m.group("command").lower()
-
-            if m.group("argument"):
-                a = m.group("argument").split(" :", 1)
-                arguments = a[0].split()
-                if len(a) == 2:
-                    arguments.append(a[1])
-
-            # Translate numerics into more readable strings.
-            if command in numeric_events:
-                command = numeric_events[command]
-
-            if command == "nick":
-                if nm_to_n(prefix) == self.real_nickname:
-                    self.real_nickname = arguments[0]
-            elif command == "welcome":
-                # Record the nickname in case the client changed nick
-                # in a nicknameinuse callback.
-                self.real_nickname = arguments[0]
+    def _process_line(self, line):
+        """[Internal]"""
+        if DEBUG:
+            print("FROM SERVER:", line)
 
-            if command in ["privmsg", "notice"]:
-                target, message = arguments[0], arguments[1]
-                messages = _ctcp_dequote(message)
+        if not line:
+            return
 
-                if command == "privmsg":
-                    if is_channel(target):
-                        command = "pubmsg"
-                else:
-                    if is_channel(target):
-                        command = "pubnotice"
-                    else:
-                        command = "privnotice"
-
-                for m in messages:
-                    if type(m) is tuple:
-                        if command in ["privmsg", "pubmsg"]:
-                            command = "ctcp"
-                        else:
-                            command = "ctcpreply"
-
-                        m = list(m)
-                        if DEBUG:
-                            print("command: %s, source: %s, target: %s, arguments: %s" % (
-                                command, prefix, target, m))
-                        self._handle_event(Event(command, prefix, target, m))
-                        if command == "ctcp" and m[0] == "ACTION":
-                            self._handle_event(Event("action", prefix, target, m[1:]))
-                    else:
-                        if DEBUG:
-                            print("command: %s, source: %s, target: %s, arguments: %s" % (
-                                command, prefix, target, [m]))
-                        self._handle_event(Event(command, prefix, target, [m]))
+        try:
+            line = line.decode("utf-8", "replace")   # utf-8 support hacked in by thygrrr (may break in some scenarios - see chardet python package)
+        except:            
+            print("irclib: non-utf-8 line, unexpected encoding error " + line)
+            line = "** encoding error - replaced by irclib.py **"
+            
+        prefix = None
+        command = None
+        arguments = None
+        self._handle_event(Event("all_raw_messages",
+                                 self.get_server_name(),
+                                 None,
+                                 [line]))
+
+        m = _rfc_1459_command_regexp.match(line)
+        if m.group("prefix"):
+            prefix = m.group("prefix")
+            if not self.real_server_name:
+                self.real_server_name = prefix
+
+        if m.group("command"):
+            command = m.group("command").lower()
+
+        if m.group("argument"):
+            a = m.group("argument").split(" :", 1)
+            arguments = a[0].split()
+            if len(a) == 2:
+                arguments.append(a[1])
+
+        # Translate numerics into more readable strings.
+        if command in numeric_events:
+            command = numeric_events[command]
+
+        if command == "nick":
+            if nm_to_n(prefix) == self.real_nickname:
+                self.real_nickname = arguments[0]
+        elif command == "welcome":
+            # Record the nickname in case the client changed nick
+            # in a nicknameinuse callback.
+            self.real_nickname = arguments[0]
+
+        if command in _message_commands:
+            target, message = arguments[0], arguments[1]
+            messages = _ctcp_dequote(message)
+
+            if command == "privmsg":
+                if is_channel(target):
+                    command = "pubmsg"
             else:
-                target = None
+                if is_channel(target):
+                    command = "pubnotice"
+                else:
+                    command = "privnotice"
 
-                if command == "quit":
-                    arguments = [arguments[0]]
-                elif command == "ping":
-                    target = arguments[0]
+            for m in messages:
+                if type(m) is tuple:
+                    if command in ["privmsg", "pubmsg"]:
+                        command = "ctcp"
+                    else:
+                        command = "ctcpreply"
+
+                    m = list(m)
+                    if DEBUG:
+                        print("command: %s, source: %s, target: %s, arguments: %s" % (
+                            command, prefix, target, m))
+                    self._handle_event(Event(command, prefix, target, m))
+                    if command == "ctcp" and m[0] == "ACTION":
+                        self._handle_event(Event("action", prefix, target, m[1:]))
                 else:
-                    target = arguments[0]
-                    arguments = arguments[1:]
+                    if DEBUG:
+                        print("command: %s, source: %s, target: %s, arguments: %s" % (
+                            command, prefix, target, [m]))
+                    self._handle_event(Event(command, prefix, target, [m]))
+        else:
+            target = None
 
-                if command == "mode":
-                    if not is_channel(target):
-                        command = "umode"
+            if command == "quit":
+                arguments = [arguments[0]]
+            elif command == "ping":
+                target = arguments[0]
+            else:
+                target = arguments[0]
+                arguments = arguments[1:]
+
+            if command == "mode":
+                if not is_channel(target):
+                    command = "umode"
 
-                if DEBUG:
-                    print("command: %s, source: %s, target: %s, arguments: %s" % (
-                        command, prefix, target, arguments))
-                self._handle_event(Event(command, prefix, target, arguments))
+            if DEBUG:
+                print("command: %s, source: %s, target: %s, arguments: %s" % (
+                    command, prefix, target, arguments))
+            self._handle_event(Event(command, prefix, target, arguments))
 
     def _handle_event(self, event):
         """[Internal]"""
@@ -1049,22 +1114,34 @@ class SimpleIRCClient:
 
         dcc_connections -- A list of DCCConnection instances.
     """
+    connection_class = ServerConnection
+
     def __init__(self):
         self.ircobj = IRC()
-        self.connection = self.ircobj.server()
+        self.connection = self.ircobj.server(self.connection_class)
         self.dcc_connections = []
+        self._handlers = {}
         self.ircobj.add_global_handler("all_events", self._dispatcher, -10)
         self.ircobj.add_global_handler("dcc_disconnect", self._dcc_disconnect, -10)
 
     def _dispatcher(self, c, e):
         """[Internal]"""
-        m = "on_" + e.eventtype()
+        eventtype = e.eventtype()
+        try:
+            handler = self._handlers[eventtype]
+        except KeyError:
+            handler = self._handlers[eventtype] = self._handler(eventtype)
+        if handler is not None:
+            handler(c, e)
+
+    def _handler(self, eventtype):
+        """[Internal] Looks up the method handling eventtype, once per type."""
+        m = "on_" + eventtype
         if hasattr(self, m):
-            getattr(self, m)(c, e)
-        else:
-            if m != "on_all_raw_messages":
-                if hasattr(self, "on_default"):
-                    self.on_default(c, e)
+            return getattr(self, m)
+        if m != "on_all_raw_messages":
+            return getattr(self, "on_default", None)
+        return None
 
     def _dcc_disconnect(self, c, e):
         self.dcc_connections.remove(c)
@@ -0,0 +1,179 @@
+"""
+IRC server connection running on a Qt socket.
+
+irclib's ServerConnection polls its socket with select() and writes with a
+plain send, which stalls the GUI whenever a (TLS) write can't go through
+right away. This one is driven by the Qt event loop instead: lines are read
+as the socket signals readyRead, and written from a queue at the pace of a
+token bucket, so a burst of outgoing lines doesn't trip the server's flood
+limits. Qt buffers what the socket can't take yet, so writing never blocks.
+"""
+import collections
+
+from PyQt5 import QtCore, QtNetwork
+
+from chat.irclib import ServerConnection, ServerConnectionError, ServerNotConnectedError, Event, \
+    LineBuffer, FloodControl
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class QtServerConnection(ServerConnection):
+    FLOOD_BURST = 10        # lines sent right away
+    FLOOD_INTERVAL = 1.0    # seconds between lines after that
+
+    def __init__(self, irclibobj):
+        ServerConnection.__init__(self, irclibobj)
+        self._queue = collections.deque()
+        self._flood = FloodControl(self.FLOOD_BURST, self.FLOOD_INTERVAL)
+        self._ready = False     # Connected (and encrypted), the queue may be written
+        self._closing = set()   # Sockets let go of, kept until they're done writing
+        self._paced = QtCore.QTimer()
+        self._paced.setSingleShot(True)
+        self._paced.timeout.connect(self._flush)
+
+    def connect(self, server, port, nickname, password=None, username=None,
+                ircname=None, localaddress="", localport=0, use_ssl=False, ipv6=False):
+        """Starts connecting to a server, see ServerConnection.connect.
+
+        Returns right away. Lines sent until the connection is made are
+        queued, and a failure to connect triggers the connect_failed event.
+        """
+        if self.connected:
+            self.disconnect("Changing servers")
+
+        self.lines = LineBuffer()
+        self.handlers = {}
+        self.real_server_name = ""
+        self.real_nickname = nickname
+        self.server = server
+        self.port = port
+        self.nickname = nickname
+        self.username = username or nickname
+        self.ircname = ircname or nickname
+        self.password = password
+        self.localaddress = localaddress
+        self.localport = localport
+        self._queue.clear()
+        self._ready = False
+
+        if use_ssl:
+            if not QtNetwork.QSslSocket.supportsSsl():
+                raise ServerConnectionError("TLS is not available")
+            self.socket = QtNetwork.QSslSocket()
+            # Unverified, as with the ssl.wrap_socket defaults used so far
+            self.socket.setPeerVerifyMode(QtNetwork.QSslSocket.VerifyNone)
+            self.socket.encrypted.connect(self._atConnected)
+        else:
+            self.socket = QtNetwork.QTcpSocket()
+            self.socket.connected.connect(self._atConnected)
+        self.socket.readyRead.connect(self._atReadyRead)
+        self.socket.disconnected.connect(self._atDisconnected)
+        self.socket.error.connect(self._atError)
+
+        if localaddress or localport:
+            self.socket.bind(QtNetwork.QHostAddress(localaddress or "0.0.0.0"), localport)
+        protocol = QtNetwork.QAbstractSocket.IPv6Protocol if ipv6 else QtNetwork.QAbstractSocket.IPv4Protocol
+        if use_ssl:
+            self.socket.connectToHostEncrypted(server, port, QtCore.QIODevice.ReadWrite, protocol)
+        else:
+            self.socket.connectToHost(server, port, QtCore.QIODevice.ReadWrite, protocol)
+        self.connected = 1
+
+        # Log on...
+        if self.password:
+            self.pass_(self.password)
+        self.nick(self.nickname)
+        self.user(self.username, self.ircname)
+        return self
+
+    def _get_socket(self):
+        """[Internal] Nothing for select() to poll, Qt tells when there's data."""
+        return None
+
+    def send_raw(self, string):
+        """Queues a raw line for the server, see ServerConnection.send_raw."""
+        if self.socket is None:
+            raise ServerNotConnectedError("Not connected.")
+        self._queue.append((string + "\r\n").encode("utf-8"))
+        self._flush()
+
+    def pong(self, target, target2=""):
+        """Answers a PING ahead of the queued lines, lest the server times us out behind them."""
+        if self.socket is None:
+            raise ServerNotConnectedError("Not connected.")
+        self._queue.appendleft(("PONG %s%s\r\n" % (target, target2 and (" " + target2))).encode("utf-8"))
+        self._flush()
+
+    def queued(self):
+        """Returns the number of lines waiting to be sent."""
+        return len(self._queue)
+
+    def _flush(self):
+        while self._queue and self._ready:
+            if not self._flood.take():
+                self._paced.start(int(self._flood.delay() * 1000) + 1)
+                return
+            self.socket.write(self._queue.popleft())
+
+    def _atConnected(self):
+        self._ready = True
+        self._flush()
+
+    def _atReadyRead(self):
+        socket = self.socket
+        for line in self.lines.feed(bytes(socket.readAll())):
+            self._process_line(line)
+            if self.socket is not socket:   # A handler hung up
+                return
+
+    def _atDisconnected(self):
+        self.disconnect("Connection reset by peer")
+
+    def _atError(self, error):
+        if not self.connected or error == QtNetwork.QAbstractSocket.RemoteHostClosedError:
+            return  # Seen as disconnected
+        if self._ready:
+            self.disconnect("Connection reset by peer")
+            return
+        reason = self.socket.errorString()
+        logger.warning("Couldn't connect to " + self.server + ": " + reason)
+        self.connected = 0
+        socket = self._close()
+        socket.abort()
+        self._closed(socket)
+        self._handle_event(Event("connect_failed", self.server, "", [reason]))
+
+    def _close(self):
+        """[Internal] Lets go of the socket, deleting it once closed."""
+        socket, self.socket = self.socket, None
+        self._paced.stop()
+        self._ready = False
+        socket.disconnect()
+        self._closing.add(socket)
+        socket.disconnected.connect(lambda: self._closed(socket))
+        return socket
+
+    def _closed(self, socket):
+        self._closing.discard(socket)
+        socket.deleteLater()
+
+    def disconnect(self, message=""):
+        """Hangs up once the queued lines and the QUIT are written."""
+        if not self.connected:
+            return
+
+        self.connected = 0
+        ready = self._ready and self.socket.state() == QtNetwork.QAbstractSocket.ConnectedState
+        socket = self._close()
+        if ready:
+            while self._queue:
+                socket.write(self._queue.popleft())
+            socket.write(("QUIT" + (message and (" :" + message)) + "\r\n").encode("utf-8"))
+            socket.disconnectFromHost()
+        else:
+            socket.abort()
+        if socket.state() == QtNetwork.QAbstractSocket.UnconnectedState:
+            self._closed(socket)
+        self._handle_event(Event("disconnect", self.server, "", [message]))
@@ -28,6 +28,7 @@ from fa import GameSession
 from fa.factions import Factions
 from fa.maps import getUserMapsFolder
 from modvault.utils import MODFOLDER
+from vault import install
 from ui.status_logo import StatusLogo
 from client.login import LoginWidget
 from ui.busy_widget import BusyWidget
@@ -362,6 +363,10 @@ class ClientWindow(FormClass, BaseClass):
     def on_actionSavegamelogs_toggled(self, value):
         self.gamelogs = value
 
+    @QtCore.pyqtSlot(bool)
+    def on_actionKeepHistory_toggled(self, value):
+        chat.history.setEnabled(value is True)
+
     @QtCore.pyqtSlot(bool)
     def on_actionAutoDownloadMods_toggled(self, value):
         Settings.set('mods/autodownload', value is True)
@@ -531,6 +536,13 @@ class ClientWindow(FormClass, BaseClass):
         # download manager
         self.downloader = downloadManager.downloadManager(self)
 
+        # Index the installed maps here, the registry's folder watcher needs this thread's event loop
+        fa.maps.registry()
+
+        # Render missing map previews in the background, so the views find them cached
+        self.mapPreviews = fa.mappreviews.PreviewGenerator()
+        self.mapPreviews.scan()
+
         self.loadSettings()
 
         # Initialize chat
@@ -689,12 +701,31 @@ class ClientWindow(FormClass, BaseClass):
             self.replayServer.close()
             self.replayServer = None
 
+        # Stop background replay indexing
+        if self.replays:
+            progress.setLabelText("Stopping local replay indexing")
+            self.replays.stop()
+
+        # Let map and mod installs finish, so nothing is left half unpacked
+        if install.pipeline.pending:
+            progress.setLabelText("Finishing map and mod installs")
+            install.pipeline.stop()
+
+        # Stop background map preview generation
+        if self.mapPreviews:
+            progress.setLabelText("Stopping map preview generation")
+            self.mapPreviews.stop()
+            self.mapPreviews = None
+
         # Clean up Chat
         if self.chat:
             progress.setLabelText("Disconnecting from IRC")
             self.chat.disconnect()
             self.chat = None
 
+        # Write out what's left of the chat history
+        chat.history.close()
+
         # Get rid of the Tray icon
         if self.tray:
             progress.setLabelText("Removing System Tray icon")
@@ -771,6 +802,8 @@ class ClientWindow(FormClass, BaseClass):
         self.actionSaveGamelogs.setChecked(self.gamelogs)
         self.actionColoredNicknames.triggered.connect(self.updateOptions)
         self.actionFriendsOnTop.triggered.connect(self.updateOptions)
+        self.actionKeepChatHistory.toggled.connect(self.on_actionKeepHistory_toggled)
+        self.actionKeepChatHistory.setChecked(chat.history.enabled())
 
         self._menuThemeHandler = ThemeMenu(self.menuTheme)
         self._menuThemeHandler.setup(util.THEME.listThemes())
@@ -787,6 +820,8 @@ class ClientWindow(FormClass, BaseClass):
         self.gamelogs = self.actionSaveGamelogs.isChecked()
         self.player_colors.coloredNicknames = self.actionColoredNicknames.isChecked()
         self.friendsontop = self.actionFriendsOnTop.isChecked()
+        if self.chat:
+            self.chat.resortChatters()
 
         self.saveChat()
 
@@ -4,18 +4,43 @@ import urllib.request, urllib.error, urllib.parse
 import logging
 import os
 import util
+from util import imagecache
 import warnings
 from config import Settings
+from . import bandwidth
 
 logger = logging.getLogger(__name__)
 
 
+# Bandwidth limit for all downloads together, in KiB/s. 0 means unlimited.
+bandwidth.shared.setRate(Settings.get('downloads/bandwidth_limit', 0, type=int) * 1024)
+
+# Network errors worth resuming a download after
+TRANSIENT_ERRORS = (QNetworkReply.RemoteHostClosedError, QNetworkReply.TimeoutError,
+                    QNetworkReply.TemporaryNetworkFailureError, QNetworkReply.NetworkSessionFailedError,
+                    QNetworkReply.UnknownNetworkError, QNetworkReply.ProxyTimeoutError,
+                    QNetworkReply.ServiceUnavailableError, QNetworkReply.InternalServerError)
+
+# Seconds to wait before resuming an interrupted download
+RETRY_DELAY = 2
+
+# Bytes of a reply Qt buffers ahead of us. Past that it stops reading the socket,
+# so a download held back by the bandwidth limit slows down the connection too.
+READ_BUFFER_SIZE = 256 * 1024
+
+
 class FileDownload(object):
     """
     A simple async one-shot file downloader.
+
+    With resume=True, dest must be a binary file object positioned at its end,
+    holding what an earlier attempt downloaded already. The download continues
+    from there with a Range request, and is resumed up to retries times after
+    network errors.
     """
     def __init__(self, nam, addr, dest, destpath=None,
-                 start=lambda _: None, progress=lambda _: None, finished=lambda _: None):
+                 start=lambda _: None, progress=lambda _: None, finished=lambda _: None,
+                 resume=False, retries=0):
         self._nam = nam
         self.addr = addr
         self.dest = dest
@@ -28,7 +53,11 @@ class FileDownload(object):
         self.bytes_total = 0
         self.bytes_progress = 0
 
+        self.resume = resume
+        self.retries = retries
+
         self._dfile = None
+        self._offset = 0
 
         self.cb_start = start
         self.cb_progress = progress
@@ -37,6 +66,9 @@ class FileDownload(object):
         self._reading = False
         self._running = False
         self._sock_finished = False
+        self._throttled = False
+        self._checked = False
+        self._discard = False
 
     def _stop(self):
         ran = self._running
@@ -51,33 +83,82 @@ class FileDownload(object):
     def cancel(self):
         self.canceled = True
         self._stop()
+        if self._dfile is not None:
+            self._dfile.abort()
 
     def _finish(self):
         self.cb_finished(self)
 
     def run(self):
         self._running = True
+        self.cb_start(self)
+        self._request()
+
+    def _request(self):
+        if self._dfile is not None:
+            self._dfile.deleteLater()
+
         req = QNetworkRequest(QtCore.QUrl(self.addr))
         req.setRawHeader(b'User-Agent', b"FAF Client")
         req.setAttribute(QNetworkRequest.FollowRedirectsAttribute, True)
         req.setMaximumRedirectsAllowed(3)
 
-        self.cb_start(self)
+        self._offset = 0
+        if self.resume:
+            self._offset = self.dest.tell()
+            if self._offset:
+                logger.info("Resuming download of {} at {} bytes".format(self.addr, self._offset))
+                req.setRawHeader(b'Range', "bytes={}-".format(self._offset).encode())
 
+        self._sock_finished = False
+        self._checked = False
         self._dfile = self._nam.get(req)
-        self._dfile.error.connect(self._error)
+        self._dfile.setReadBufferSize(READ_BUFFER_SIZE)
         self._dfile.finished.connect(self._atFinished)
         self._dfile.downloadProgress.connect(self._atProgress)
         self._dfile.readyRead.connect(self._kick_read)
         self._kick_read()
 
+    def _retry(self):
+        """
+        Resumes after a failure, returns False if there's nothing left to try.
+        """
+        if not self.resume or self.retries <= 0 or self.canceled:
+            return False
+        self.retries -= 1
+        logger.warning("Download of {} interrupted, retrying in {}s".format(self.addr, RETRY_DELAY))
+        QtCore.QTimer.singleShot(RETRY_DELAY * 1000, self._atRetry)
+        return True
+
+    def _atRetry(self):
+        if self._running:
+            self._request()
+
     def _atFinished(self):
         self._sock_finished = True
         self._kick_read()
 
     def _atProgress(self, recv, total):
-        self.bytes_progress = recv
-        self.bytes_total = total
+        self.bytes_progress = self._offset + recv
+        self.bytes_total = self._offset + total if total >= 0 else total
+
+    def _checkReply(self):
+        """
+        Makes sure a resumed download got the part it asked for, and that error pages are dropped.
+        """
+        self._checked = True
+        status = self._dfile.attribute(QNetworkRequest.HttpStatusCodeAttribute)
+        # Don't let an error page end up in a file that might be resumed later
+        self._discard = status is not None and status >= 400
+        if self._offset and status == 200:
+            # Server ignored the range, start over
+            self._offset = 0
+            self.dest.seek(0)
+            self.dest.truncate()
+
+    def _unthrottle(self):
+        self._throttled = False
+        self._kick_read()
 
     def _kick_read(self):    # Don't run the read loop more than once at a time
         if self._reading:
@@ -87,18 +168,42 @@ class FileDownload(object):
         self._reading = False
 
     def _read(self):
-        while self._dfile.bytesAvailable() > 0 and self._running:
+        while self._dfile.bytesAvailable() > 0 and self._running and not self._throttled:
+            if not self._checked:
+                self._checkReply()
             self._readloop()
-        if self._sock_finished:
+        if self._sock_finished and not self._throttled and self._dfile.bytesAvailable() == 0:
             # Sock can be marked as finished either before read or inside readloop
             # Either way we've read everything after it was marked
+            self._atReplyDone()
+
+    def _atReplyDone(self):
+        if not self._running:
+            return
+        error = self._dfile.error()
+        if self._offset and self._dfile.attribute(QNetworkRequest.HttpStatusCodeAttribute) == 416:
+            # What we have is no prefix of the file (any more), start over
+            self.dest.seek(0)
+            self.dest.truncate()
+            error = QNetworkReply.TemporaryNetworkFailureError
+        if error == QNetworkReply.NoError:
             self._stop()
+        elif error == QNetworkReply.OperationCanceledError or error not in TRANSIENT_ERRORS or not self._retry():
+            self._error()
 
     def _readloop(self):
             bs = self.blocksize if self.blocksize is not None else self._dfile.bytesAvailable()
-            self.dest.write(self._dfile.read(bs))
+            data = self._dfile.read(bs)
+            if self._discard:
+                return
+            self.dest.write(data)
             self.cb_progress(self)
 
+            wait = bandwidth.shared.delay(len(data))
+            if wait > 0:
+                self._throttled = True
+                QtCore.QTimer.singleShot(int(wait * 1000), self._unthrottle)
+
     def succeeded(self):
         return not self.error and not self.canceled
 
@@ -130,10 +235,13 @@ class downloadManager(QtCore.QObject):
         dler.dest.close()
         urlstring = dler.addr
 
-        # Remove '.part'
+        # Remove '.part', unless it's a failed download that would shadow a good preview
         partpath = dler.destpath
         filepath = partpath[:-5]
-        QtCore.QDir().rename(partpath, filepath)
+        if dler.succeeded():
+            QtCore.QDir().rename(partpath, filepath)
+            # Don't keep serving an older image from the same path
+            imagecache.shared.discard(imagecache.cacheKey(filepath))
 
         local_path = False
         filename = os.path.basename(filepath)
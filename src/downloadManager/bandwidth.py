@@ -0,0 +1,57 @@
+"""
+Bandwidth limit shared by all of the client's downloads.
+
+Map, mod and game file downloads all draw from the same token bucket, so
+together they never exceed the configured rate. Worker threads simply block in
+acquire(); code on the GUI thread asks delay() how long to pause reading.
+"""
+import threading
+import time
+
+# How many seconds worth of transfer may be used in one burst
+BURST = 0.5
+
+
+class BandwidthScheduler(object):
+    def __init__(self, rate=0):
+        self._lock = threading.Lock()
+        self._tokens = 0.0
+        self._stamp = time.monotonic()
+        self.rate = 0
+        self.setRate(rate)
+
+    def setRate(self, rate):
+        """
+        Sets the limit in bytes per second, 0 means unlimited.
+        """
+        with self._lock:
+            self.rate = max(int(rate), 0)
+            self._tokens = self.rate * BURST
+            self._stamp = time.monotonic()
+
+    def delay(self, size):
+        """
+        Takes size bytes from the budget, and returns how many seconds the
+        caller should wait before transferring any more.
+        """
+        with self._lock:
+            if not self.rate:
+                return 0.0
+            now = time.monotonic()
+            self._tokens = min(self._tokens + (now - self._stamp) * self.rate, self.rate * BURST)
+            self._stamp = now
+            self._tokens -= size
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self, size):
+        """
+        Blocking version of delay(), for worker threads.
+        """
+        wait = self.delay(size)
+        if wait > 0:
+            time.sleep(wait)
+
+
+shared = BandwidthScheduler()
@@ -20,6 +20,7 @@ from .replay import replay
 
 from . import check
 from . import maps
+from . import mappreviews
 from . import mods
 from . import replayserver
 from . import updater
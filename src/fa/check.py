@@ -3,23 +3,26 @@ import os
 import glob
 import shutil
 import zipfile
-import binascii
 
 from PyQt5 import QtWidgets
 
 import fa
 import config
+from fa import movies
 from fa.mods import checkMods
 from fa.path import writeFAPathLua, validatePath
 from fa.wizards import Wizard
 import util
+from vault import install
 
 logger = logging.getLogger(__name__)
 
 
-def map_(mapname, force=False, silent=False):
+def map_(mapname, force=False, silent=False, background=False):
     """
-    Assures that the map is available in FA, or returns false.
+    Assures that the map is available in FA, or returns false. With background
+    set, the map may still be installing when this returns, see
+    vault.install.pipeline.
     """
     logger.info("Updating FA for map: " + str(mapname))
 
@@ -28,7 +31,7 @@ def map_(mapname, force=False, silent=False):
         return True
 
     if force:
-        return fa.maps.downloadMap(mapname, silent=silent)
+        return fa.maps.downloadMap(mapname, silent=silent, background=background)
 
     auto = config.Settings.get('maps/autodownload', default=False, type=bool)
     if not auto:
@@ -43,7 +46,7 @@ def map_(mapname, force=False, silent=False):
         elif result == QtWidgets.QMessageBox.YesToAll:
             config.Settings.set('maps/autodownload', True)
 
-    return fa.maps.downloadMap(mapname, silent=silent)
+    return fa.maps.downloadMap(mapname, silent=silent, background=background)
 
 
 def featured_mod(featured_mod, version):
@@ -70,13 +73,15 @@ def game(parent):
     return True
 
 
-def crc32(fname):
-    try:
-        with open(fname) as stream:
-            return binascii.crc32(stream.read())
-    except:
-        logger.exception('CRC check fail!')
-        return None
+MOVIE_MANIFEST = os.path.join(util.CACHE_DIR, "movies.json")
+_movieManifest = None
+
+
+def movieManifest():
+    global _movieManifest
+    if _movieManifest is None:
+        _movieManifest = movies.MovieManifest(MOVIE_MANIFEST, fa.updater.hashManifest())
+    return _movieManifest
 
 
 def checkMovies(files):
@@ -93,22 +98,9 @@ def checkMovies(files):
     # construct dirs
     gd = os.path.join(util.APPDATA_DIR, 'gamedata')
 
-    for fname in files:
-        origpath = os.path.join(gd, fname)
-
-        if os.path.exists(origpath) and zipfile.is_zipfile(origpath):
-            try:
-                zf = zipfile.ZipFile(origpath)
-            except:
-                logger.exception('Failed to open Game File {}'.format(origpath))
-                continue
-
-            for zi in zf.infolist():
-                if zi.filename.startswith('movies'):
-                    tgtpath = os.path.join(util.APPDATA_DIR, zi.filename)
-                    # copy only if file is different - check first if file exists, then if size is changed, then crc
-                    if not os.path.exists(tgtpath) or os.stat(tgtpath).st_size != zi.file_size or crc32(tgtpath) != zi.CRC:
-                        zf.extract(zi, util.APPDATA_DIR)
+    archives = [os.path.join(gd, fname) for fname in files]
+    movies.sync([path for path in archives if os.path.exists(path) and zipfile.is_zipfile(path)],
+                util.APPDATA_DIR, movieManifest())
 
 
 def check(featured_mod, mapname=None, version=None, modVersions=None, sim_mods=None, silent=False):
@@ -142,12 +134,20 @@ def check(featured_mod, mapname=None, version=None, modVersions=None, sim_mods=N
         logger.exception('Error checking game files for movies')
         return False
 
-    # Now it's down to having the right map
+    # Now it's down to having the right map, it's unpacked while the mods are updated
     if mapname:
-        if not map_(mapname, silent=silent):
+        if not map_(mapname, silent=silent, background=True):
             return False
 
-    if sim_mods:
-        return checkMods(sim_mods)
+    if sim_mods and not checkMods(sim_mods):
+        install.pipeline.wait()
+        return False
+
+    if not install.pipeline.wait():
+        QtWidgets.QMessageBox.information(
+            None, "Map installation failed",
+            "<b>The map {} could not be installed (please report this map or bug).</b>"
+            .format(", ".join(install.pipeline.failed)))
+        return False
 
     return True
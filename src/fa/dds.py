@@ -0,0 +1,166 @@
+"""
+Decoder for the DDS images SCFA uses as map previews.
+
+Uncompressed 32 bit BGRA data already is QImage's native RGB32 layout on little
+endian machines, so it's handed to Qt in one piece instead of being shuffled
+around pixel by pixel. 24 bit images are handed over as RGB888, with a swap of
+red and blue for BGR, and the DXT1/DXT3/DXT5 compressed formats are decoded
+here, a row of blocks at a time. Alpha is ignored, previews are opaque.
+
+Only QImage is used, so all of this is safe to run on worker threads.
+"""
+import mmap
+import operator
+import struct
+
+from PyQt5 import QtCore, QtGui
+
+HEADER_SIZE = 128
+MAGIC = b"DDS "
+
+DDPF_ALPHAPIXELS = 0x1
+DDPF_FOURCC = 0x4
+DDPF_RGB = 0x40
+
+SMALL_PREVIEW_SIZE = 100
+
+
+class DDSError(IOError):
+    # An IOError, like what reading a broken preview used to raise
+    pass
+
+
+def _header(buf):
+    if len(buf) < HEADER_SIZE or bytes(buf[:4]) != MAGIC:
+        raise DDSError("Not a DDS image")
+    height, width, pitch = struct.unpack_from("<3I", buf, 12)
+    pf_flags, fourcc, bits = struct.unpack_from("<I4sI", buf, 80)
+    rmask, gmask, bmask = struct.unpack_from("<3I", buf, 92)
+    if not width or not height:
+        raise DDSError("Empty DDS image")
+    return width, height, pitch, pf_flags, fourcc, bits, (rmask, gmask, bmask)
+
+
+def _rgb565(color):
+    r = (color >> 11) & 0x1f
+    g = (color >> 5) & 0x3f
+    b = color & 0x1f
+    return (r << 3 | r >> 2), (g << 2 | g >> 4), (b << 3 | b >> 2)
+
+
+def _palette(c0, c1, four_colors):
+    """ The 4 colors of a DXT block, as 16 BGRA byte values """
+    r0, g0, b0 = _rgb565(c0)
+    r1, g1, b1 = _rgb565(c1)
+    if four_colors:
+        return (b0, g0, r0, 255, b1, g1, r1, 255,
+                (2 * b0 + b1) // 3, (2 * g0 + g1) // 3, (2 * r0 + r1) // 3, 255,
+                (b0 + 2 * b1) // 3, (g0 + 2 * g1) // 3, (r0 + 2 * r1) // 3, 255)
+    return (b0, g0, r0, 255, b1, g1, r1, 255,
+            (b0 + b1) // 2, (g0 + g1) // 2, (r0 + r1) // 2, 255,
+            0, 0, 0, 255)
+
+
+# For each byte of 4 color indexes, picks the 4 BGRA pixels they stand for out of a palette
+_ROW_PIXELS = [operator.itemgetter(*[4 * ((indexes >> (2 * x)) & 3) + c for x in range(4) for c in range(4)])
+               for indexes in range(256)]
+
+
+def _decode_dxt(buf, width, height, block_size):
+    """
+    Decodes the color blocks of DXT compressed data into BGRA rows.
+    DXT3 and DXT5 blocks carry 8 bytes of alpha in front, which are skipped.
+
+    Works a row of blocks at a time: the blocks are unpacked in one go, and each
+    pixel row is gathered from the block palettes through _ROW_PIXELS.
+    """
+    blocks_x = (width + 3) // 4
+    blocks_y = (height + 3) // 4
+    if len(buf) < HEADER_SIZE + blocks_x * blocks_y * block_size:
+        raise DDSError("Truncated DDS image")
+
+    block_row = struct.Struct("<" + ("8xHHI" if block_size == 16 else "HHI") * blocks_x)
+    stride = blocks_x * 16
+    out = bytearray(stride * blocks_y * 4)
+    for by in range(blocks_y):
+        fields = block_row.unpack_from(buf, HEADER_SIZE + by * block_row.size)
+        # Only DXT1 has the 3 color mode
+        palettes = [_palette(c0, c1, c0 > c1 or block_size == 16) for c0, c1 in zip(fields[0::3], fields[1::3])]
+        indexes = fields[2::3]
+        for y in range(4):
+            shift = 8 * y
+            row = []
+            for palette, bits in zip(palettes, indexes):
+                row.extend(_ROW_PIXELS[(bits >> shift) & 0xff](palette))
+            start = (by * 4 + y) * stride
+            out[start:start + stride] = bytes(row)
+    return out, stride
+
+
+def to_image(buf):
+    """
+    Decodes a DDS image held in buf (bytes, or a memory map) into a QImage.
+    """
+    width, height, pitch, pf_flags, fourcc, bits, masks = _header(buf)
+
+    if pf_flags & DDPF_FOURCC:
+        block_size = {b"DXT1": 8, b"DXT2": 16, b"DXT3": 16, b"DXT4": 16, b"DXT5": 16}.get(fourcc)
+        if block_size is None:
+            raise DDSError("Unsupported DDS compression {}".format(fourcc))
+        data, stride = _decode_dxt(buf, width, height, block_size)
+        image = QtGui.QImage(bytes(data), width, height, stride, QtGui.QImage.Format_RGB32)
+        return image.copy()
+
+    if not pf_flags & DDPF_RGB or bits not in (24, 32):
+        raise DDSError("Unsupported DDS pixel format")
+    bpp = bits // 8
+    if not pitch or pitch < width * bpp:
+        pitch = width * bpp
+    end = HEADER_SIZE + pitch * (height - 1) + width * bpp
+    if len(buf) < end:
+        raise DDSError("Truncated DDS image")
+    data = bytes(buf[HEADER_SIZE:end])
+
+    if bits == 32:
+        # BGRA in memory is native RGB32, with a mask layout anything else would need conversion
+        image = QtGui.QImage(data, width, height, pitch, QtGui.QImage.Format_RGB32)
+        if masks[0] == 0xff:  # RGBA
+            image = image.rgbSwapped()
+    else:
+        image = QtGui.QImage(data, width, height, pitch, QtGui.QImage.Format_RGB888)
+        if masks[0] != 0xff:  # BGR
+            image = image.rgbSwapped()
+    # Detach from data, which QImage doesn't keep alive
+    return image.copy()
+
+
+def load(path):
+    """
+    Decodes the DDS file at path into a QImage, through a memory map.
+    """
+    with open(path, "rb") as fh:
+        try:
+            buf = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # Empty file
+            raise DDSError("Empty DDS file " + path)
+        try:
+            return to_image(buf)
+        finally:
+            buf.close()
+
+
+def small_preview(image):
+    return image.scaled(SMALL_PREVIEW_SIZE, SMALL_PREVIEW_SIZE, transformMode=QtCore.Qt.SmoothTransformation)
+
+
+def save_previews(source, small=None, large=None):
+    """
+    Decodes the DDS file source once and saves the small and/or large preview PNGs from it.
+    Returns the decoded (large) QImage.
+    """
+    image = load(source)
+    if large is not None and not image.save(large):
+        raise DDSError("Failed to save " + large)
+    if small is not None and not small_preview(image).save(small):
+        raise DDSError("Failed to save " + small)
+    return image
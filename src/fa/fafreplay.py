@@ -0,0 +1,220 @@
+"""
+Streaming codec for .fafreplay files.
+
+A .fafreplay is a single line of JSON metadata, followed by the base64 encoded
+output of Qt's qCompress() on the raw SCFA replay stream: a 4 byte big endian
+length of the uncompressed data, then a zlib stream.
+
+Both directions work on bounded chunks, so even huge replays are never held
+in memory as a whole, let alone in several copies.
+"""
+import base64
+import binascii
+import json
+import os
+import struct
+import zlib
+
+from fa.replayparser import ReplayHeader, ReplayHeaderTruncated
+
+# Size of the chunks read from disk or handed out to the caller
+CHUNK_SIZE = 256 * 1024
+
+_WHITESPACE = b" \t\r\n"
+
+
+class ReplayFormatError(Exception):
+    pass
+
+
+class _Base64Decoder(object):
+    """
+    Incremental base64 decoder, tolerant of whitespace and arbitrary chunk boundaries.
+    """
+    def __init__(self):
+        self._rest = b""
+
+    def decode(self, data):
+        data = self._rest + data.translate(None, _WHITESPACE)
+        cut = len(data) - len(data) % 4
+        self._rest = data[cut:]
+        try:
+            return base64.b64decode(data[:cut], validate=True)
+        except binascii.Error as e:
+            raise ReplayFormatError("Invalid base64 data: {}".format(e))
+
+    def flush(self):
+        if self._rest:
+            raise ReplayFormatError("Truncated base64 data")
+        return b""
+
+
+class _Base64Encoder(object):
+    def __init__(self):
+        self._rest = b""
+
+    def encode(self, data):
+        data = self._rest + data
+        cut = len(data) - len(data) % 3
+        self._rest = data[cut:]
+        return base64.b64encode(data[:cut])
+
+    def flush(self):
+        rest, self._rest = self._rest, b""
+        return base64.b64encode(rest)
+
+
+class ReplayReader(object):
+    """
+    Reads a .fafreplay from a binary file object.
+    The metadata is parsed on construction, the replay stream is read with chunks().
+    """
+    def __init__(self, fileobj):
+        self._file = fileobj
+        try:
+            self.info = json.loads(fileobj.readline().decode("utf-8"))
+        except ValueError as e:
+            raise ReplayFormatError("Invalid replay metadata: {}".format(e))
+        # Uncompressed size as announced by the qCompress header, None until read
+        self.size = None
+
+    def chunks(self, chunk_size=CHUNK_SIZE):
+        """
+        Yields the decompressed replay stream, in chunks of at most chunk_size bytes.
+        """
+        b64 = _Base64Decoder()
+        inflate = zlib.decompressobj()
+        header = b""
+
+        while True:
+            raw = self._file.read(chunk_size)
+            data = b64.decode(raw) if raw else b64.flush()
+
+            if self.size is None:
+                header += data
+                if len(header) < 4 and raw:
+                    continue
+                if len(header) < 4:
+                    raise ReplayFormatError("Missing replay data")
+                self.size = struct.unpack(">I", header[:4])[0]
+                data = header[4:]
+
+            try:
+                while data:
+                    out = inflate.decompress(data, chunk_size)
+                    data = inflate.unconsumed_tail
+                    if out:
+                        yield out
+                if not raw:
+                    out = inflate.flush()
+                    if out:
+                        yield out
+            except zlib.error as e:
+                raise ReplayFormatError("Invalid replay data: {}".format(e))
+
+            if not raw or inflate.eof:
+                break
+
+        if not inflate.eof and self.size != 0:
+            raise ReplayFormatError("Truncated replay data")
+
+
+class ReplayWriter(object):
+    """
+    Writes a .fafreplay to a binary file object.
+    size is the total length of the replay stream, it's needed up front for the qCompress header.
+    """
+    def __init__(self, fileobj, info, size, level=zlib.Z_DEFAULT_COMPRESSION):
+        self._file = fileobj
+        self._b64 = _Base64Encoder()
+        self._deflate = zlib.compressobj(level)
+        self._size = size
+        self.written = 0
+
+        fileobj.write(json.dumps(info).encode("utf-8"))
+        fileobj.write(b"\n")
+        fileobj.write(self._b64.encode(struct.pack(">I", size)))
+
+    def write(self, data):
+        self.written += len(data)
+        self._file.write(self._b64.encode(self._deflate.compress(data)))
+
+    def close(self):
+        if self.written != self._size:
+            raise ReplayFormatError("Announced {} bytes of replay data, got {}".format(self._size, self.written))
+        self._file.write(self._b64.encode(self._deflate.flush()))
+        self._file.write(self._b64.flush())
+
+
+def read_info(path):
+    """
+    Returns the metadata of a .fafreplay without touching the replay stream.
+    """
+    with open(path, "rb") as fh:
+        return ReplayReader(fh).info
+
+
+def read_header(path, chunk_size=64 * 1024):
+    """
+    Returns the metadata and the parsed SCFA ReplayHeader of a .fafreplay.
+    Only as much of the replay stream is decompressed as the header needs.
+    """
+    with open(path, "rb") as fh:
+        reader = ReplayReader(fh)
+        data = bytearray()
+        for chunk in reader.chunks(chunk_size):
+            data += chunk
+            try:
+                return reader.info, ReplayHeader.from_buffer(data)
+            except ReplayHeaderTruncated:
+                continue
+        return reader.info, ReplayHeader.from_buffer(data)
+
+
+def decode_file(source, destination):
+    """
+    Extracts the raw SCFA replay stream of the .fafreplay at source into destination.
+    Returns the metadata and the number of bytes written.
+    """
+    tmp = destination + ".part"
+    written = 0
+    try:
+        with open(source, "rb") as src, open(tmp, "wb") as dst:
+            reader = ReplayReader(src)
+            for chunk in reader.chunks():
+                dst.write(chunk)
+                written += len(chunk)
+    except:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    os.replace(tmp, destination)
+    return reader.info, written
+
+
+def encode_chunks(info, chunks, size, destination):
+    """
+    Writes a .fafreplay to destination from an iterable of replay stream chunks
+    adding up to size bytes. The file only appears once it is complete.
+    """
+    tmp = destination + ".part"
+    try:
+        with open(tmp, "wb") as dst:
+            writer = ReplayWriter(dst, info, size)
+            for chunk in chunks:
+                writer.write(chunk)
+            writer.close()
+    except:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    os.replace(tmp, destination)
+
+
+def encode_file(info, source, destination):
+    """
+    Packs the raw SCFA replay stream in the file source into a .fafreplay at destination.
+    """
+    size = os.path.getsize(source)
+    with open(source, "rb") as src:
+        encode_chunks(info, iter(lambda: src.read(CHUNK_SIZE), b""), size, destination)
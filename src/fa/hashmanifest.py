@@ -0,0 +1,96 @@
+"""
+Persistent cache of game file hashes.
+
+Hashing gigabytes of game data before every launch is wasteful when nothing
+changed. The manifest remembers the MD5 and CRC32 of every file it hashed,
+together with the file's size, mtime and inode, and only hashes a file again
+once any of those differ. Whoever modifies a file (the updater, after
+downloading or patching it) should invalidate() it as well.
+"""
+import binascii
+import hashlib
+import os
+
+from util.jsonstore import JsonStore
+
+MANIFEST_VERSION = 1
+READ_SIZE = 1024 * 1024
+
+
+def _key(path):
+    return os.path.normcase(os.path.abspath(path))
+
+
+def _signature(st):
+    return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+
+class HashManifest(JsonStore):
+    """
+    Thread safe, the hash functions may be called from worker threads. Entries
+    are key -> {'stat': signature, 'md5': ..., 'crc32': ...}.
+    """
+    VERSION = MANIFEST_VERSION
+    KEY = 'files'
+    WHAT = 'hash manifest'
+
+    def invalidate(self, path):
+        with self._lock:
+            if self._entries.pop(_key(path), None) is not None:
+                self._dirty = True
+
+    def _cached(self, path, kind):
+        """
+        Returns (key, signature, cached value or None); signature is None if the file doesn't exist.
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None, None, None
+        if not os.path.isfile(path):
+            return None, None, None
+        key = _key(path)
+        signature = _signature(st)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry['stat'] == signature:
+                return key, signature, entry.get(kind)
+        return key, signature, None
+
+    def _store(self, key, signature, kind, value):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry['stat'] != signature:
+                entry = self._entries[key] = {'stat': signature}
+            entry[kind] = value
+            self._dirty = True
+
+    def md5(self, path):
+        """
+        MD5 hex digest of the file at path, None if there's no such file.
+        """
+        key, signature, value = self._cached(path, 'md5')
+        if signature is None or value is not None:
+            return value
+        m = hashlib.md5()
+        with open(path, "rb") as fh:
+            for data in iter(lambda: fh.read(READ_SIZE), b""):
+                m.update(data)
+        value = m.hexdigest()
+        self._store(key, signature, 'md5', value)
+        return value
+
+    def crc32(self, path):
+        """
+        CRC32 of the file at path as an unsigned int, like zipfile's ZipInfo.CRC. None if there's no such file.
+        """
+        key, signature, value = self._cached(path, 'crc32')
+        if signature is None or value is not None:
+            return value
+        value = 0
+        with open(path, "rb") as fh:
+            for data in iter(lambda: fh.read(READ_SIZE), b""):
+                value = binascii.crc32(data, value)
+        value &= 0xffffffff
+        self._store(key, signature, 'crc32', value)
+        return value
@@ -0,0 +1,222 @@
+import concurrent.futures
+import os
+import queue
+import threading
+
+from PyQt5 import QtCore, QtGui
+
+import util
+from util import imagecache
+from downloadManager import IconCallback
+from fa import maps
+
+import logging
+logger = logging.getLogger(__name__)
+
+GENERATOR_WORKERS = max(2, min(4, os.cpu_count() or 1))
+
+
+class _PreviewThread(QtCore.QThread):
+    """
+    Resolves map names to cached preview paths and decodes them, one at a time, off the GUI thread.
+    """
+    resolved = QtCore.pyqtSignal(str, object, object)
+
+    def __init__(self, *args, **kwargs):
+        QtCore.QThread.__init__(self, *args, **kwargs)
+        self._queue = queue.Queue()
+
+    def request(self, mapname):
+        self._queue.put(mapname)
+
+    def stop(self):
+        self._queue.put(None)
+
+    def run(self):
+        while True:
+            mapname = self._queue.get()
+            if mapname is None:
+                return
+            image = None
+            try:
+                path = maps.previewPath(mapname)
+                if path is not None and imagecache.cacheKey(path) not in imagecache.shared:
+                    image = QtGui.QImage(path)
+            except:
+                logger.exception("Failed to resolve preview for " + mapname)
+                path = None
+            self.resolved.emit(mapname, path, image)
+
+
+class PreviewResolver(QtCore.QObject):
+    """
+    Asynchronously provides map preview icons.
+
+    Previews found in the cache or extracted from local map files are resolved
+    on a worker thread. Anything else is fetched from the vault through the
+    client's download manager. previewReady is emitted once per request, with
+    None if no preview could be found.
+    """
+    previewReady = QtCore.pyqtSignal(str, object)
+
+    def __init__(self, downloader=None, *args, **kwargs):
+        QtCore.QObject.__init__(self, *args, **kwargs)
+        self._downloader = downloader
+        self._pending = set()
+        self._thread = _PreviewThread()
+        self._thread.resolved.connect(self._atResolved)
+        self._thread.start()
+
+    def stop(self):
+        self._thread.stop()
+        self._thread.wait()
+
+    def request(self, mapname):
+        if not mapname or mapname in self._pending:
+            return
+        self._pending.add(mapname)
+        self._thread.request(mapname)
+
+    @QtCore.pyqtSlot(str, object, object)
+    def _atResolved(self, mapname, path, image):
+        if path is not None:
+            self._pending.discard(mapname)
+            if image is not None and not image.isNull():
+                imagecache.shared.loadAsync(path, image=image)
+            self.previewReady.emit(mapname, util.THEME.icon(path, False))
+        elif self._downloader is not None:
+            try:
+                self._downloader.downloadMap(mapname, IconCallback(mapname, self._atDownloaded))
+            except:
+                logger.exception("Failed to download preview of " + mapname)
+                self._atDownloaded(mapname, None)
+        else:
+            self._pending.discard(mapname)
+            self.previewReady.emit(mapname, None)
+
+    def _atDownloaded(self, mapname, icon):
+        # The download manager hands out the unknown map icon when a download
+        # fails, only a preview that made it to the cache counts
+        self._pending.discard(mapname)
+        if not os.path.isfile(os.path.join(util.CACHE_DIR, mapname.lower() + ".png")):
+            icon = None
+        self.previewReady.emit(mapname, icon)
+
+
+class PreviewGenerator(QtCore.QObject):
+    """
+    Pre-generates the cached previews of local maps in the background.
+
+    scan() looks through the user and base map folders for maps whose cached
+    preview is missing or stale, and renders those on a pool of worker threads,
+    so views find them ready in the cache. generate() queues specific map
+    folders, e.g. after a download. progress is emitted with the number of
+    maps done and queued so far, finished once all scans and renders are done.
+    """
+    progress = QtCore.pyqtSignal(int, int)
+    finished = QtCore.pyqtSignal()
+
+    def __init__(self, workers=GENERATOR_WORKERS, *args, **kwargs):
+        QtCore.QObject.__init__(self, *args, **kwargs)
+        self._pool = concurrent.futures.ThreadPoolExecutor(workers)
+        self._lock = threading.Lock()
+        self._batch = 0         # Bumped by cancel(), jobs of older batches are dropped
+        self._queued = set()
+        self._scans = 0
+        self._done = 0
+        self._total = 0
+        self._stopped = False
+
+    def scan(self):
+        """
+        Queues every local map with a missing or stale preview. The folders are read on a worker thread.
+        """
+        if self._stopped:
+            return
+        with self._lock:
+            self._scans += 1
+        self._pool.submit(self._scan, self._batch)
+
+    def generate(self, mapdirs):
+        for mapdir in mapdirs:
+            self._enqueue(self._batch, mapdir)
+
+    def cancel(self):
+        """
+        Drops everything queued. Previews being rendered right now are still finished.
+        """
+        with self._lock:
+            self._batch += 1
+            busy = bool(self._queued or self._scans)
+            self._queued.clear()
+            self._scans = self._done = self._total = 0
+        if busy:
+            self.finished.emit()
+
+    def stop(self):
+        self.cancel()
+        self._stopped = True
+        self._pool.shutdown(wait=True)
+
+    def _scan(self, batch):
+        try:
+            for folder in (maps.getUserMapsFolder(), maps.getBaseMapsFolder()):
+                try:
+                    names = os.listdir(folder)
+                except OSError:
+                    continue
+                for name in names:
+                    if batch != self._batch:
+                        return
+                    mapdir = os.path.join(folder, name)
+                    try:
+                        if os.path.isdir(mapdir) and maps.previewIsStale(mapdir):
+                            self._enqueue(batch, mapdir)
+                    except:
+                        logger.exception("Failed to check preview of " + mapdir)
+        finally:
+            self._jobDone(batch)
+
+    def _enqueue(self, batch, mapdir):
+        if self._stopped:
+            return
+        key = os.path.normcase(os.path.abspath(mapdir))
+        with self._lock:
+            if batch != self._batch or key in self._queued:
+                return
+            self._queued.add(key)
+            self._total += 1
+        self._pool.submit(self._render, batch, key, mapdir)
+
+    def _render(self, batch, key, mapdir):
+        if batch != self._batch:
+            return
+        try:
+            if maps.generatePreview(mapdir) is None:
+                logger.debug("No preview could be generated for " + mapdir)
+        except:
+            logger.exception("Failed to generate preview for " + mapdir)
+        self._jobDone(batch, key)
+
+    def _jobDone(self, batch, key=None):
+        """
+        Counts a finished render of key, or a finished scan if key is None.
+        """
+        with self._lock:
+            if batch != self._batch:
+                return
+            if key is None:
+                self._scans -= 1
+            else:
+                self._queued.discard(key)
+                self._done += 1
+            done, total = self._done, self._total
+            idle = not self._queued and not self._scans
+            if idle:
+                self._done = self._total = 0
+        if key is not None:
+            self.progress.emit(done, total)
+        if idle:
+            if total:
+                logger.info("Generated {} map previews".format(total))
+            self.finished.emit()
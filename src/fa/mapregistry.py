@@ -0,0 +1,206 @@
+"""
+In-memory index of the maps installed in the user and base map folders.
+
+Map folders are listed once and kept in a dict keyed by the case-folded folder
+name, so checking whether a map is available or finding its folder doesn't
+touch the disk. A QFileSystemWatcher on the map folders triggers a rescan when
+maps are added or removed. It lives on the GUI thread, whichever thread
+creates the registry. Scenario metadata is parsed on first request and cached,
+along with the path of the scenario file, until that file changes; once cached,
+it costs a stat. The size comes from the .scmap header for scenarios that lack
+it.
+"""
+import collections
+import os
+
+from PyQt5 import QtCore
+
+from fa import scmap
+from vault import luaparser
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Coalesces the burst of change notifications of e.g. extracting a map archive, in ms
+RESCAN_DELAY = 500
+
+MapEntry = collections.namedtuple("MapEntry", "name folder base")
+# size is (width, height), players the number of armies
+MapInfo = collections.namedtuple("MapInfo", "name size players version")
+
+
+def _scenarioFile(folder):
+    for infile in os.listdir(folder):
+        if infile.lower().endswith("_scenario.lua"):
+            return os.path.join(folder, infile)
+    return None
+
+
+def _mapSize(folder):
+    """
+    The map size from the header of the .scmap in folder, for scenarios that don't tell.
+    """
+    for infile in os.listdir(folder):
+        if infile.lower().endswith(".scmap"):
+            try:
+                header = scmap.header(os.path.join(folder, infile))
+            except IOError:
+                return None
+            return int(header.width), int(header.height)
+    return None
+
+
+def parseScenario(path):
+    """
+    Reads the metadata from the _scenario.lua file at path. Returns a MapInfo, or None.
+    """
+    lua = luaparser.luaParser(path)
+    data = lua.parse({
+        'scenarioinfo>name': 'name', 'size': 'map_size',
+        'count:armies': 'max_players', 'map_version': 'version'
+        }, {'version': '1', 'max_players': 0, 'map_size': None})
+    if lua.error:
+        logger.debug("Failed to parse {}: {}".format(path, lua.errorMsg))
+        return None
+    try:
+        size = tuple(int(float(data['map_size'][key])) for key in ('0', '1'))
+    except (KeyError, TypeError, ValueError):
+        size = None
+    try:
+        version = int(data['version'])
+    except (TypeError, ValueError):
+        version = None
+    return MapInfo(data.get('name'), size, data['max_players'], version)
+
+
+class MapRegistry(QtCore.QObject):
+    """
+    userFolder and baseFolder are functions returning the current map folders,
+    they're looked up again on every rescan. User maps take precedence over
+    base maps of the same name. mapsChanged is emitted after a rescan.
+    """
+    mapsChanged = QtCore.pyqtSignal()
+
+    def __init__(self, userFolder, baseFolder, *args, **kwargs):
+        QtCore.QObject.__init__(self, *args, **kwargs)
+        self._userFolder = userFolder
+        self._baseFolder = baseFolder
+        self._maps = {}
+        self._user = []
+        self._info = {}     # case-folded name -> (scenario file, its mtime, MapInfo)
+        self._watcher = None
+        self._timer = None
+
+        app = QtCore.QCoreApplication.instance()
+        # Without an application there's no event loop to deliver changes, nothing is watched
+        self._watched = app is not None
+        if app is not None and self.thread() != app.thread():
+            # Watch from the GUI thread, whichever thread happened to ask for the registry first
+            self.moveToThread(app.thread())
+        self.refresh()
+
+    @QtCore.pyqtSlot()
+    def _watch(self):
+        """ watches the current map folders, on the thread of the registry """
+        if self._watcher is None:
+            self._watcher = QtCore.QFileSystemWatcher(self)
+            self._watcher.directoryChanged.connect(self._atChanged)
+            self._timer = QtCore.QTimer(self)
+            self._timer.setSingleShot(True)
+            self._timer.setInterval(RESCAN_DELAY)
+            self._timer.timeout.connect(self.refresh)
+        paths = set()
+        for folder in (self._baseFolder(), self._userFolder()):
+            # A folder that doesn't exist yet is noticed through its parent
+            while folder and not os.path.isdir(folder):
+                parent = os.path.dirname(folder)
+                folder = parent if parent != folder else None
+            if folder:
+                paths.add(folder)
+        watched = set(self._watcher.directories())
+        if watched - paths:
+            self._watcher.removePaths(list(watched - paths))
+        if paths - watched:
+            self._watcher.addPaths(list(paths - watched))
+
+    @QtCore.pyqtSlot(str)
+    def _atChanged(self, path):
+        self._timer.start()
+
+    @QtCore.pyqtSlot()
+    def refresh(self):
+        """
+        Lists the map folders again.
+        """
+        folders = [(self._baseFolder(), True), (self._userFolder(), False)]
+        entries = {}
+        user = []
+        for folder, base in folders:
+            try:
+                names = os.listdir(folder)
+            except OSError:
+                continue
+            for name in names:
+                path = os.path.join(folder, name)
+                if not os.path.isdir(path):
+                    continue
+                entries[name.casefold()] = MapEntry(name, path, base)
+                if not base:
+                    user.append(name)
+        # Swapped in whole, readers on other threads see either the old or the new index
+        self._maps = entries
+        self._user = user
+        self._info = {key: info for key, info in self._info.items()
+                      if key in entries and os.path.dirname(info[0]) == entries[key].folder}
+        if self._watched:
+            if QtCore.QThread.currentThread() == self.thread():
+                self._watch()
+            else:   # The watcher belongs to the GUI thread
+                QtCore.QMetaObject.invokeMethod(self, "_watch", QtCore.Qt.QueuedConnection)
+        self.mapsChanged.emit()
+
+    def __contains__(self, mapname):
+        return mapname.casefold() in self._maps
+
+    def __len__(self):
+        return len(self._maps)
+
+    def get(self, mapname):
+        """
+        Returns the MapEntry for mapname in any case, or None.
+        """
+        return self._maps.get(mapname.casefold())
+
+    def names(self):
+        return [entry.name for entry in self._maps.values()]
+
+    def userNames(self):
+        return list(self._user)
+
+    def info(self, mapname):
+        """
+        Returns the MapInfo of an installed map, or None.
+        """
+        entry = self.get(mapname)
+        if entry is None:
+            return None
+        key = mapname.casefold()
+        cached = self._info.get(key)
+        try:
+            scenario = cached[0] if cached is not None else _scenarioFile(entry.folder)
+            if scenario is None:
+                return None
+            stamp = os.stat(scenario).st_mtime_ns
+        except OSError:
+            self._info.pop(key, None)
+            return None
+        if cached is not None and cached[1] == stamp:
+            return cached[2]
+        info = parseScenario(scenario)
+        if info is not None and info.size is None:
+            try:
+                info = info._replace(size=_mapSize(entry.folder))
+            except OSError:
+                pass
+        self._info[key] = (scenario, stamp, info)
+        return info
@@ -8,14 +8,17 @@ import io
 import util
 import os
 import stat
-import struct
 import shutil
 import urllib.request, urllib.error, urllib.parse
 import zipfile
 import tempfile
 import re
+import threading
 # module imports
 import fa
+from fa import dds
+from fa import scmap
+from fa.mapregistry import MapRegistry
 # local imports
 from config import Settings
 from vault.dialogs import downloadVaultAssetNoMsg
@@ -29,7 +32,8 @@ VAULT_COUNTER_ROOT = "{}/faf/vault/map_vault/inc_downloads.php".format(route)
 
 from model.game import OFFICIAL_MAPS as maps
 
-__exist_maps = None
+__registry = None
+__registryLock = threading.Lock()
 
 
 def isBase(mapname):
@@ -39,11 +43,20 @@ def isBase(mapname):
     return mapname in maps
 
 
+def registry():
+    """
+    Returns the MapRegistry of the installed maps, which is created on first use.
+    """
+    global __registry
+    if __registry is None:
+        with __registryLock:
+            if __registry is None:
+                __registry = MapRegistry(getUserMapsFolder, getBaseMapsFolder)
+    return __registry
+
+
 def getUserMaps():
-    maps = []
-    if os.path.isdir(getUserMapsFolder()):
-        maps = os.listdir(getUserMapsFolder())
-    return maps
+    return registry().userNames()
 
 
 def getDisplayName(filename):
@@ -115,32 +128,16 @@ def isMapFolderValid(folder):
 
 
 def existMaps(force=False):
-    global __exist_maps
-    if force or __exist_maps is None:
-
-        __exist_maps = getUserMaps()
-
-        if os.path.isdir(getBaseMapsFolder()):
-            if __exist_maps is None:
-                __exist_maps = os.listdir(getBaseMapsFolder())
-            else:
-                __exist_maps.extend(os.listdir(getBaseMapsFolder()))
-    return __exist_maps
+    if force:
+        registry().refresh()
+    return registry().names()
 
 
 def isMapAvailable(mapname):
     """
     Returns true if the map with the given name is available on the client
     """
-    if isBase(mapname):
-        return True
-
-    if os.path.isdir(getUserMapsFolder()):
-        for infile in os.listdir(getUserMapsFolder()):
-            if infile.lower() == mapname.lower():
-                return True
-
-    return False
+    return isBase(mapname) or mapname in registry()
 
 
 def folderForMap(mapname):
@@ -150,14 +147,20 @@ def folderForMap(mapname):
     if isBase(mapname):
         return os.path.join(getBaseMapsFolder(), mapname)
 
-    if os.path.isdir(getUserMapsFolder()):
-        for infile in os.listdir(getUserMapsFolder()):
-            if infile.lower() == mapname.lower():
-                return os.path.join(getUserMapsFolder(), mapname)
+    entry = registry().get(mapname)
+    if entry is not None:
+        return entry.folder
 
     return None
 
 
+def mapInfo(mapname):
+    """
+    Returns the scenario metadata (name, size, players, version) of an installed map, or None.
+    """
+    return registry().info(mapname)
+
+
 def getBaseMapsFolder():
     """
     Returns the folder containing all the base maps for this client.
@@ -183,34 +186,13 @@ def getUserMapsFolder():
 
 def genPrevFromDDS(sourcename, destname, small=False):
     """
-    this opens supcom's dds file (format: bgra8888) and saves to png
+    this opens supcom's dds file and saves it to png
     """
     try:
-        img = bytearray()
-        buf = bytearray(16)
-        file = open(sourcename, "rb")
-        file.seek(128)  # skip header
-        while file.readinto(buf):
-            img += buf[:3] + buf[4:7] + buf[8:11] + buf[12:15]
-        file.close()
-
-        size = int((len(img)/3) ** (1.0/2))
         if small:
-            imageFile = QtGui.QImage(
-                img,
-                size,
-                size,
-                QtGui.QImage.Format_RGB888).rgbSwapped().scaled(
-                    100,
-                    100,
-                    transformMode=QtCore.Qt.SmoothTransformation)
+            dds.save_previews(sourcename, small=destname)
         else:
-            imageFile = QtGui.QImage(
-                img,
-                size,
-                size,
-                QtGui.QImage.Format_RGB888).rgbSwapped()
-        imageFile.save(destname)
+            dds.save_previews(sourcename, large=destname)
     except IOError:
         logger.debug('IOError exception in genPrevFromDDS', exc_info=True)
         raise
@@ -290,25 +272,14 @@ def __exportPreviewFromMap(mapname, positions=None):
         previews["tozip"].append(previewddsname)
         ddsExists = True
 
+    data = None
     if not ddsExists:
         logger.debug("Extracting preview DDS from .scmap for: " + mapname)
-        mapfile = open(mapfilename, "rb")
-        """
-        magic = struct.unpack('i', mapfile.read(4))[0]
-        version_major = struct.unpack('i', mapfile.read(4))[0]
-        unk_edfe = struct.unpack('i', mapfile.read(4))[0]
-        unk_efbe = struct.unpack('i', mapfile.read(4))[0]
-        width = struct.unpack('f', mapfile.read(4))[0]
-        height = struct.unpack('f', mapfile.read(4))[0]
-        unk_32 = struct.unpack('i', mapfile.read(4))[0]
-        unk_16 = struct.unpack('h', mapfile.read(2))[0]
-        """
-        mapfile.seek(30)  # Shortcut. Maybe want to clean out some of the magic numbers some day
-        size = struct.unpack('i', mapfile.read(4))[0]
-        data = mapfile.read(size)
-        # version_minor = struct.unpack('i', mapfile.read(4))[0]
-        mapfile.close()
-        # logger.debug("SCMAP version %i.%i" % (version_major, version_minor))
+        try:
+            data = scmap.preview(mapfilename)
+        except IOError:
+            logger.debug("Failed to read preview from: " + mapfilename, exc_info=True)
+            return previews
 
         try:
             with open(previewddsname, "wb") as previewfile:
@@ -323,16 +294,23 @@ def __exportPreviewFromMap(mapname, positions=None):
         except IOError:
             pass
 
-    if not smallExists:
-        logger.debug("Making small preview from DDS for: " + mapname)
+    # Decode the DDS only once for both previews
+    image = None
+    if not smallExists or not largeExists:
         try:
-            genPrevFromDDS(previewddsname, previewsmallname, small=True)
-            previews["tozip"].append(previewsmallname)
-            shutil.copyfile(previewsmallname, cachepngname)
-            previews["cache"] = cachepngname
+            image = dds.to_image(data) if data is not None else dds.load(previewddsname)
         except IOError:
+            logger.debug("Failed to decode preview DDS for: " + mapname, exc_info=True)
+            return previews
+
+    if not smallExists:
+        logger.debug("Making small preview from DDS for: " + mapname)
+        if not dds.small_preview(image).save(previewsmallname):
             logger.debug("Failed to make small preview for: " + mapname)
             return previews
+        previews["tozip"].append(previewsmallname)
+        shutil.copyfile(previewsmallname, cachepngname)
+        previews["cache"] = cachepngname
 
     if not largeExists:
         logger.debug("Making large preview from DDS for: " + mapname)
@@ -340,7 +318,7 @@ def __exportPreviewFromMap(mapname, positions=None):
             logger.debug("Icon positions were not passed or they were wrong for: " + mapname)
             return previews
         try:
-            genPrevFromDDS(previewddsname, previewlargename, small=False)
+            image.save(previewlargename)
             mapimage = util.THEME.pixmap(previewlargename)
             armyicon = util.THEME.pixmap("vault/map_icons/army.png").scaled(8, 9, 1, 1)
             massicon = util.THEME.pixmap("vault/map_icons/mass.png").scaled(8, 8, 1, 1)
@@ -385,38 +363,107 @@ def __exportPreviewFromMap(mapname, positions=None):
 iconExtensions = ["png"]  # "jpg" removed to have fewer of those costly 404 misses.
 
 
-def preview(mapname, pixmap=False):
+def previewPath(mapname):
+    """
+    Returns the path of the cached preview image for mapname, generating it
+    from the local map files if needed. Does not touch any GUI objects, so it
+    is safe to call from worker threads.
+    """
+    # Try to load directly from cache
+    for extension in iconExtensions:
+        img = os.path.join(util.CACHE_DIR, mapname + "." + extension)
+        if os.path.isfile(img):
+            logger.log(5, "Using cached preview image for: " + mapname)
+            return img
+
+    # Try to find in local map folder
+    img = __exportPreviewFromMap(mapname)
+
+    if img and 'cache' in img and img['cache'] and os.path.isfile(img['cache']):
+        logger.debug("Using fresh preview image for: " + mapname)
+        return img['cache']
+
+    return None
+
+
+def previewIsStale(mapdir):
+    """
+    Returns true if the cached preview of the map in mapdir is missing, or
+    older than the map files it's made from.
+    """
+    mapname = os.path.basename(mapdir).lower()
+    mapfilename = os.path.join(mapdir, mapname.split(".")[0] + ".scmap")
+    try:
+        mapstamp = os.stat(mapfilename).st_mtime
+    except OSError:
+        return False  # Nothing to make a preview from
+    try:
+        cached = os.stat(os.path.join(util.CACHE_DIR, mapname + ".png")).st_mtime
+    except OSError:
+        return True
+    if mapstamp > cached:
+        return True
     try:
-        # Try to load directly from cache
-        for extension in iconExtensions:
-            img = os.path.join(util.CACHE_DIR, mapname + "." + extension)
-            if os.path.isfile(img):
-                logger.log(5, "Using cached preview image for: " + mapname)
-                return util.THEME.icon(img, False, pixmap)
+        return os.stat(os.path.join(mapdir, mapname + ".small.png")).st_mtime > cached
+    except OSError:
+        return False
 
-        # Try to find in local map folder
-        img = __exportPreviewFromMap(mapname)
 
-        if img and 'cache' in img and img['cache'] and os.path.isfile(img['cache']):
-            logger.debug("Using fresh preview image for: " + mapname)
-            return util.THEME.icon(img['cache'], False, pixmap)
+def _removeStalePreviews(mapdir):
+    """
+    Removes the previews and DDS of the map in mapdir that are older than its .scmap,
+    so they're made from the map again instead of being reused.
+    """
+    mapname = os.path.basename(mapdir).lower()
+    try:
+        mapstamp = os.stat(os.path.join(mapdir, mapname.split(".")[0] + ".scmap")).st_mtime
+    except OSError:
+        return
+    # Next to the map, or in the cache for maps in folders that aren't writable
+    for directory in (mapdir, os.path.join(util.CACHE_DIR, mapname)):
+        for suffix in (".small.png", ".large.png", ".dds"):
+            path = os.path.join(directory, mapname + suffix)
+            try:
+                if os.stat(path).st_mtime < mapstamp:
+                    logger.debug("Removing stale preview " + path)
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+def generatePreview(mapdir):
+    """
+    (Re)generates the cached preview of the map in mapdir from its files.
+    Returns the path of the cached preview, or None. Like previewPath, this
+    is safe to call from worker threads.
+    """
+    _removeStalePreviews(mapdir)
+    return __exportPreviewFromMap(mapdir)["cache"]
 
+
+def preview(mapname, pixmap=False):
+    try:
+        img = previewPath(mapname)
+        if img is not None:
+            return util.THEME.icon(img, False, pixmap)
         return None
     except:
         logger.error("Error raised in maps.preview(...) for " + mapname)
         logger.error("Map Preview Exception", exc_info=sys.exc_info())
 
 
-def downloadMap(name, silent=False):
+def downloadMap(name, silent=False, background=False):
     """
-    Download a map from the vault with the given name
+    Download a map from the vault with the given name. With background set,
+    this returns once the map is downloaded, and it's installed by
+    vault.install.pipeline while the caller goes on.
     """
     link = name2link(name)
-    ret, msg = _doDownloadMap(name, link, silent)
+    ret, msg = _doDownloadMap(name, link, silent, background)
     if not ret:
         name = name.replace(" ", "_")
         link = name2link(name)
-        ret, msg = _doDownloadMap(name, link, silent)
+        ret, msg = _doDownloadMap(name, link, silent, background)
         if not ret:
             msg()
             return ret
@@ -434,11 +481,22 @@ def downloadMap(name, silent=False):
     return True
 
 
-def _doDownloadMap(name, link, silent):
+def _mapInstalled(names):
+    # Don't wait for the file system watcher, callers look the map up right away
+    registry().refresh()
+
+    import client
+    previews = getattr(client.instance, "mapPreviews", None)
+    folders = [folder for folder in map(folderForMap, names) if folder is not None]
+    if previews is not None and folders:
+        previews.generate(folders)
+
+
+def _doDownloadMap(name, link, silent, background=False):
     url = VAULT_DOWNLOAD_ROOT + link
     logger.debug("Getting map from: " + url)
     return downloadVaultAssetNoMsg(url, getUserMapsFolder(), lambda m, d: True,
-                                   name, "map", silent)
+                                   name, "map", silent, background, _mapInstalled)
 
 
 def processMapFolderForUpload(mapDir, positions):
@@ -0,0 +1,142 @@
+"""
+Unpacking of the movies shipped in gamedata archives.
+
+FA can't play movies from inside the gamedata zips, so they're extracted to
+the movies folder. The manifest records, for every extracted movie, the size
+and CRC of the archive member it came from and the size and mtime of the file
+written, so checking for changes only takes the archive's central directory
+and a stat() per movie. A movie the manifest doesn't know, or that changed
+since, is compared by its CRC32 from the game file hash manifest, which keeps
+it across runs. Members that differ are extracted again, streamed in chunks on
+a pool of workers.
+"""
+import concurrent.futures
+import os
+import shutil
+import zipfile
+
+from util.jsonstore import JsonStore
+
+import logging
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+READ_SIZE = 1024 * 1024
+EXTRACT_WORKERS = 4
+MOVIE_FOLDER = "movies"
+
+
+def _key(path):
+    return os.path.normcase(os.path.abspath(path))
+
+
+def _signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+def isMovie(info):
+    name = os.path.normpath(info.filename)
+    return not info.filename.endswith(("/", "\\")) and name.split(os.sep)[0] == MOVIE_FOLDER
+
+
+class MovieManifest(JsonStore):
+    """
+    Thread safe, movies are recorded by the extracting workers. Entries are
+    key -> {'size': member size, 'crc': member CRC, 'stat': signature of the file}.
+    """
+    VERSION = MANIFEST_VERSION
+    KEY = 'movies'
+    WHAT = 'movie manifest'
+
+    def __init__(self, path, hashes):
+        """
+        hashes is the HashManifest the CRCs of movies not extracted by us are taken from.
+        """
+        JsonStore.__init__(self, path)
+        self._hashes = hashes
+
+    def save(self):
+        JsonStore.save(self)
+        self._hashes.save()
+
+    def record(self, info, path):
+        """
+        Notes that the file at path holds the contents of the archive member info.
+        """
+        signature = _signature(path)
+        with self._lock:
+            self._entries[_key(path)] = {'size': info.file_size, 'crc': info.CRC, 'stat': signature}
+            self._dirty = True
+
+    def current(self, info, path):
+        """
+        Returns whether the file at path holds the contents of the archive member info.
+        """
+        signature = _signature(path)
+        if signature is None:
+            return False
+        with self._lock:
+            entry = self._entries.get(_key(path))
+        if entry is not None and entry['stat'] == signature:
+            return entry['size'] == info.file_size and entry['crc'] == info.CRC
+        # Not extracted by us, or modified since: compare the contents, once
+        if signature[0] != info.file_size or self._hashes.crc32(path) != info.CRC:
+            return False
+        self.record(info, path)
+        return True
+
+
+def _sync(archive, info, path, manifest):
+    if manifest.current(info, path):
+        return False
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory, exist_ok=True)
+    tmp = path + ".part"
+    try:
+        with zipfile.ZipFile(archive) as zfile, zfile.open(info) as src, open(tmp, "wb") as dst:
+            shutil.copyfileobj(src, dst, READ_SIZE)
+        os.replace(tmp, path)
+    except:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    manifest.record(info, path)
+    return True
+
+
+def sync(archives, target_dir, manifest, workers=EXTRACT_WORKERS):
+    """
+    Extracts the movies of the zip files in archives into target_dir, unless
+    they're there already. Returns the paths of the movies extracted.
+    """
+    # A movie shipped by several archives comes from the last one, as if they were extracted in turn
+    members = {}    # key -> (archive, info, path)
+    for archive in archives:
+        try:
+            with zipfile.ZipFile(archive) as zfile:
+                infos = [info for info in zfile.infolist() if isMovie(info)]
+        except (OSError, zipfile.BadZipFile):
+            logger.exception("Failed to open Game File " + archive)
+            continue
+        for info in infos:
+            path = os.path.join(target_dir, os.path.normpath(info.filename))
+            members[_key(path)] = (archive, info, path)
+
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        jobs = [(path, pool.submit(_sync, archive, info, path, manifest)) for archive, info, path in members.values()]
+        extracted = []
+        for path, job in jobs:
+            try:
+                if job.result():
+                    extracted.append(path)
+            except:
+                logger.exception("Failed to extract movie " + path)
+    manifest.save()
+    if extracted:
+        logger.info("Extracted movies: {}".format(extracted))
+    return extracted
@@ -1,9 +1,9 @@
-import json
 import os
 from PyQt5 import QtCore, QtWidgets
 import fa
 from fa.check import check
 from fa.replayparser import replayParser
+from fa import fafreplay
 import util
 from . import mods
 
@@ -28,29 +28,24 @@ def replay(source, detach=False):
         if isinstance(source, str):
             if os.path.isfile(source):
                 if source.endswith(".fafreplay"):  # the new way of doing things
-                    replay = open(source, "rt")
-                    info = json.loads(replay.readline())
-
-                    binary = QtCore.qUncompress(QtCore.QByteArray.fromBase64(replay.read().encode('utf-8')))
-                    logger.info("Extracted " + str(binary.size()) + " bytes of binary data from .fafreplay.")
-                    replay.close()
-
-                    if binary.size() == 0:
+                    scfa_replay = os.path.join(util.CACHE_DIR, "temp.scfareplay")
+                    try:
+                        info, size = fafreplay.decode_file(source, scfa_replay)
+                    except (fafreplay.ReplayFormatError, IOError):
+                        logger.exception("Failed to extract replay")
+                        size = 0
+                    logger.info("Extracted " + str(size) + " bytes of binary data from .fafreplay.")
+
+                    if size == 0:
                         logger.info("Invalid replay")
                         QtWidgets.QMessageBox.critical(None, "FA Forever Replay", "Sorry, this replay is corrupted.")
                         return False
 
-                    scfa_replay = QtCore.QFile(os.path.join(util.CACHE_DIR, "temp.scfareplay"))
-                    scfa_replay.open(QtCore.QIODevice.WriteOnly | QtCore.QIODevice.Truncate)
-                    scfa_replay.write(binary)
-                    scfa_replay.flush()
-                    scfa_replay.close()
-
                     mapname = info.get('mapname', None)
                     mod = info['featured_mod']
                     replay_id = info['uid']
                     featured_mod_versions = info.get('featured_mod_versions', None)
-                    arg_string = scfa_replay.fileName()
+                    arg_string = scfa_replay
 
                     parser = replayParser(arg_string)
                     version = parser.getVersion()
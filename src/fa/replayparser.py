@@ -1,39 +1,219 @@
+"""
+Parser for the header of raw SCFA replay streams (.scfareplay).
 
+The header is read straight from a memory map (or any buffer), so only the
+pages that hold it are ever touched, no matter how long the replay is.
+
+Layout, all integers little endian:
+    version string ("Supreme Commander v1.50.3701"), "\\r\\n",
+    "Replay v1.9\\r\\n<map path>", "\\r\\n\\x1a"     (null terminated strings)
+    uint32 size + lua table: active mods
+    uint32 size + lua table: scenario info
+    uint8 count, then count times (name string, uint32 id): command sources
+    uint8: cheats enabled
+    uint8 count, then count times (uint32 size + lua table, uint8 source id
+        [, one padding byte unless the source id is 255]): armies
+    uint32: random seed
+"""
+import mmap
 import struct
 
+LUA_NUMBER = 0
+LUA_STRING = 1
+LUA_NIL = 2
+LUA_BOOL = 3
+LUA_TABLE = 4
+LUA_TABLE_END = 5
+
+NO_SOURCE = 255
+
+
+class ReplayHeaderError(Exception):
+    pass
+
+
+class ReplayHeaderTruncated(ReplayHeaderError):
+    """
+    Raised when the buffer ends before the header does.
+    """
+    pass
+
+
+class _Reader(object):
+    def __init__(self, buf):
+        self._buf = buf
+        self._view = memoryview(buf)
+        self.offset = 0
+
+    def _take(self, n):
+        end = self.offset + n
+        if end > len(self._view):
+            raise ReplayHeaderTruncated("Header ends past offset {}".format(len(self._view)))
+        data = self._view[self.offset:end]
+        self.offset = end
+        return data
+
+    def _unpack(self, fmt):
+        return struct.unpack(fmt, self._take(struct.calcsize(fmt)))[0]
+
+    def u8(self):
+        return self._unpack("<B")
+
+    def u32(self):
+        return self._unpack("<I")
+
+    def f32(self):
+        return self._unpack("<f")
+
+    def string(self):
+        end = self._buf.find(b"\x00", self.offset)
+        if end == -1:
+            raise ReplayHeaderTruncated("Unterminated string at offset {}".format(self.offset))
+        data = self._take(end - self.offset)
+        self.offset += 1
+        return bytes(data).decode("utf-8", errors="replace")
+
+    def lua(self):
+        kind = self.u8()
+        if kind == LUA_NUMBER:
+            return self.f32()
+        elif kind == LUA_STRING:
+            return self.string()
+        elif kind == LUA_NIL:
+            self._take(1)
+            return None
+        elif kind == LUA_BOOL:
+            return self.u8() != 0
+        elif kind == LUA_TABLE:
+            table = {}
+            while self._peek() != LUA_TABLE_END:
+                key = self.lua()
+                table[key] = self.lua()
+            self._take(1)
+            return table
+        raise ReplayHeaderError("Unknown lua type {} at offset {}".format(kind, self.offset - 1))
+
+    def _peek(self):
+        if self.offset >= len(self._view):
+            raise ReplayHeaderTruncated("Header ends inside a lua table")
+        return self._view[self.offset]
+
+    def sized_lua(self):
+        size = self.u32()
+        end = self.offset + size
+        value = self.lua()
+        if self.offset != end:
+            raise ReplayHeaderError("Lua block size mismatch at offset {}".format(self.offset))
+        return value
+
+    def release(self):
+        self._view.release()
+
+
+class ReplayHeader(object):
+    """
+    Structured header of a SCFA replay.
+    """
+    def __init__(self):
+        self.version = None         # e.g. "Supreme Commander v1.50.3701"
+        self.replay_version = None  # e.g. "Replay v1.9"
+        self.map_path = None        # e.g. "/maps/scmp_009/scmp_009.scmap"
+        self.mods = {}
+        self.scenario = {}
+        self.sources = []           # (name, id) of every command source
+        self.cheats_enabled = False
+        self.armies = []            # player options of every army, with the 'source' key added
+        self.seed = None
+        self.size = 0               # header length in bytes
+
+    @property
+    def game_version(self):
+        """
+        The FA build number as a string, like replayParser.getVersion(), or None.
+        """
+        return game_version(self.version)
+
+    @property
+    def mapname(self):
+        parts = [part for part in (self.map_path or "").split("/") if part]
+        return parts[-2] if len(parts) >= 2 else None
+
+    @classmethod
+    def from_buffer(cls, buf):
+        """
+        Parses a header from a buffer holding (at least) the beginning of a
+        replay stream. Raises ReplayHeaderTruncated if it ends too early.
+        """
+        header = cls()
+        reader = _Reader(buf)
+        try:
+            header.version = reader.string()
+            reader.string()
+            replay_version, _, header.map_path = reader.string().partition("\r\n")
+            header.replay_version = replay_version
+            reader.string()
+
+            header.mods = reader.sized_lua()
+            header.scenario = reader.sized_lua()
+
+            for _ in range(reader.u8()):
+                name = reader.string()
+                header.sources.append((name, reader.u32()))
+
+            header.cheats_enabled = reader.u8() != 0
+
+            for _ in range(reader.u8()):
+                army = reader.sized_lua()
+                if not isinstance(army, dict):
+                    raise ReplayHeaderError("Malformed army at offset {}".format(reader.offset))
+                army["source"] = reader.u8()
+                if army["source"] != NO_SOURCE:
+                    reader.u8()
+                header.armies.append(army)
+
+            header.seed = reader.u32()
+            header.size = reader.offset
+        finally:
+            reader.release()
+        return header
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, "rb") as fh:
+            try:
+                buf = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # Empty file
+                raise ReplayHeaderTruncated("Empty replay file")
+            try:
+                return cls.from_buffer(buf)
+            finally:
+                buf.close()
+
+
+def game_version(version):
+    if not version or not version.startswith("Supreme Commander v1"):
+        return None
+    return version.split(".")[-1]
+
+
+def read_version(path):
+    """
+    Reads only the version line of the replay at path.
+    """
+    with open(path, "rb") as fh:
+        line = fh.read(128).split(b"\x00", 1)[0].split(b"\r", 1)[0]
+    try:
+        return line.decode("utf-8")
+    except UnicodeDecodeError:
+        return ""
+
 
 class replayParser:
     def __init__(self, filepath):
         self.file = filepath
 
-    def __readLine(self, offset, bin):
-        line = b''
-        while True:
-
-            char = struct.unpack("s", bin[offset:offset+1])
-
-            offset = offset + 1
-            if char[0] == b'\r':
-                # offset = offset + 2
-                break
-            elif char[0] == b'\x00':
-                # offset = offset + 3
-                break
-            else:
-                line = line + char[0]
-        try:
-            line = line.decode('utf-8')
-        except UnicodeDecodeError:
-            line = ''
-        return offset, line
-
     def getVersion(self):
-        f = open(self.file, 'rb')
-        bin = f.read() 
-        offset = 0
-        offset, supcomVersion = self.__readLine(offset, bin)  
-        f.close()
-        if not supcomVersion.startswith("Supreme Commander v1"):
-            return None
-        else:
-            return supcomVersion.split(".")[-1]
+        return game_version(read_version(self.file))
+
+    def getHeader(self):
+        return ReplayHeader.from_file(self.file)
@@ -0,0 +1,234 @@
+"""
+Non-blocking relay of a live replay stream to the internet replay server.
+
+Data handed to the relay is kept in a bounded ring buffer and written to the
+socket only as fast as it drains, so a slow uplink never stalls the GUI or
+grows memory without bound. Whatever falls out of the ring buffer is read back
+from a backing store (the replay spill file), so nothing is lost while the
+relay connects, lags behind, or reconnects after a transient failure.
+"""
+import time
+
+from PyQt5 import QtCore, QtNetwork
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Bytes of recent replay data kept in memory for the relay
+RING_CAPACITY = 4 * 1024 * 1024
+
+# Don't queue more than this in the socket's own write buffer
+HIGH_WATERMARK = 256 * 1024
+
+# Size of the pieces handed to the socket
+WRITE_CHUNK = 64 * 1024
+
+# Reconnect attempts after a transient failure, and the delay before the first one (doubled every time)
+MAX_RETRIES = 5
+RETRY_DELAY = 1000
+
+# Milliseconds to keep sending after the game ended before giving up
+FINISH_TIMEOUT = 60 * 1000
+
+
+class RingBuffer(object):
+    """
+    Keeps the last capacity bytes of a stream, addressed by stream offset.
+    """
+    def __init__(self, capacity=RING_CAPACITY):
+        self.capacity = capacity
+        self.start = 0      # stream offset of the oldest byte held
+        self._data = bytearray()
+
+    @property
+    def end(self):
+        return self.start + len(self._data)
+
+    def append(self, data):
+        self._data += data
+        excess = len(self._data) - self.capacity
+        if excess > 0:
+            del self._data[:excess]
+            self.start += excess
+
+    def read(self, offset, size):
+        """
+        Returns up to size bytes from offset, or None if they were already evicted.
+        """
+        if offset < self.start:
+            return None
+        first = offset - self.start
+        return bytes(self._data[first:first + size])
+
+
+class ReplayRelay(QtCore.QObject):
+    """
+    Streams replay data to host:port without ever blocking.
+
+    write() appends to the stream, finish() flushes it and closes the connection.
+    backing(offset, size) must return stream data the ring buffer no longer holds.
+
+    The replay server treats every connection as a new stream, so after a
+    reconnect everything is sent again from stream offset 0. finished is
+    emitted exactly once, when the stream is through or the relay gave up.
+    """
+    finished = QtCore.pyqtSignal()
+
+    def __init__(self, host, port, backing=None, capacity=RING_CAPACITY, *args, **kwargs):
+        QtCore.QObject.__init__(self, *args, **kwargs)
+        self._host = host
+        self._port = port
+        self._backing = backing
+        self._ring = RingBuffer(capacity)
+
+        self._sent = 0          # stream offset handed to the socket
+        self._acked = 0         # stream offset written to the network by the socket
+        self._retries = 0
+        self._reconnects = 0
+        self._finishing = False
+        self._done = False
+        self._connected_at = None
+        self._acked_since_connect = 0
+
+        self._socket = QtNetwork.QTcpSocket(self)
+        self._socket.connected.connect(self._atConnected)
+        self._socket.bytesWritten.connect(self._atBytesWritten)
+        self._socket.disconnected.connect(self._atDisconnected)
+        self._socket.error.connect(self._atError)
+
+        self._finishTimer = QtCore.QTimer(self)
+        self._finishTimer.setSingleShot(True)
+        self._finishTimer.timeout.connect(self._atFinishTimeout)
+
+        self._connect()
+
+    @property
+    def total(self):
+        return self._ring.end
+
+    def write(self, data):
+        if self._done or self._finishing:
+            return
+        self._ring.append(data)
+        self._pump()
+
+    def finish(self):
+        """
+        Sends whatever is still queued, then disconnects. Doesn't block.
+        """
+        if self._done or self._finishing:
+            return
+        self._finishing = True
+        logger.info("Finishing replay transmission, " + str(self.total - self._acked) + " bytes to go")
+        self._finishTimer.start(FINISH_TIMEOUT)
+        if self._socket.state() == QtNetwork.QAbstractSocket.ConnectedState:
+            self._pump()
+
+    def abort(self):
+        self._finishing = True
+        self._socket.abort()
+        self._finish()
+
+    def metrics(self):
+        """
+        Relay statistics: bytes queued and delivered, lag behind the game, throughput in bytes/s.
+        """
+        if self._connected_at is not None:
+            elapsed = max(time.time() - self._connected_at, 0.001)
+            throughput = self._acked_since_connect / elapsed
+        else:
+            throughput = 0.0
+        return {
+            'total': self.total,
+            'sent': self._acked,
+            'lag': self.total - self._acked,
+            'buffered': self._socket.bytesToWrite(),
+            'throughput': throughput,
+            'reconnects': self._reconnects,
+        }
+
+    def _connect(self):
+        logger.debug("Connecting to internet replay server " + self._host + ":" + str(self._port))
+        self._socket.connectToHost(self._host, self._port)
+
+    def _read(self, offset, size):
+        data = self._ring.read(offset, size)
+        if data is None and self._backing is not None:
+            data = self._backing(offset, min(size, self._ring.start - offset))
+        return data
+
+    def _pump(self):
+        if self._socket.state() != QtNetwork.QAbstractSocket.ConnectedState:
+            return
+
+        while self._sent < self.total and self._socket.bytesToWrite() < HIGH_WATERMARK:
+            data = self._read(self._sent, WRITE_CHUNK)
+            if not data:
+                logger.error("Replay data at offset " + str(self._sent) + " is gone, can't relay it")
+                self.abort()
+                return
+            written = self._socket.write(data)
+            if written <= 0:
+                return
+            self._sent += written
+
+        if self._finishing and self._acked == self.total:
+            self._socket.disconnectFromHost()
+
+    @QtCore.pyqtSlot()
+    def _atConnected(self):
+        logger.debug("internet replay server " + self._socket.peerName() + ":" + str(self._socket.peerPort()))
+        self._retries = 0
+        self._sent = 0
+        self._acked = 0
+        self._connected_at = time.time()
+        self._acked_since_connect = 0
+        self._pump()
+
+    @QtCore.pyqtSlot("qint64")
+    def _atBytesWritten(self, count):
+        self._acked += count
+        self._acked_since_connect += count
+        self._pump()
+
+    @QtCore.pyqtSlot()
+    def _atDisconnected(self):
+        if self._finishing and self._acked == self.total:
+            self._finish()
+
+    @QtCore.pyqtSlot(QtNetwork.QAbstractSocket.SocketError)
+    def _atError(self, error):
+        if self._done or (self._finishing and self._acked == self.total):
+            return
+        logger.warning("Replay relay error: " + self._socket.errorString())
+
+        if self._retries >= MAX_RETRIES:
+            logger.error("no connection to internet replay server, giving up")
+            self.abort()
+            return
+
+        delay = RETRY_DELAY * 2 ** self._retries
+        self._retries += 1
+        self._reconnects += 1
+        logger.info("Reconnecting to internet replay server in " + str(delay) + " ms")
+        self._socket.abort()
+        QtCore.QTimer.singleShot(delay, self._retry)
+
+    @QtCore.pyqtSlot()
+    def _retry(self):
+        if not self._done:
+            self._connect()
+
+    @QtCore.pyqtSlot()
+    def _atFinishTimeout(self):
+        logger.warning("Replay transmission didn't finish in time, " + str(self.total - self._acked) + " bytes left")
+        self.abort()
+
+    def _finish(self):
+        if self._done:
+            return
+        self._done = True
+        self._finishTimer.stop()
+        logger.info("Replay relay done: " + ", ".join("{}={}".format(key, int(value))
+                                                      for key, value in sorted(self.metrics().items())))
+        self.finished.emit()
@@ -5,7 +5,6 @@ import os
 import logging
 import util
 import fa
-import json
 import time
 
 from config import Settings
@@ -15,11 +14,16 @@ INTERNET_REPLAY_SERVER_PORT = Settings.get('replay_server/port')
 
 from . import DEFAULT_LIVE_REPLAY
 from . import DEFAULT_RECORD_REPLAY
+from . import replayrelay
+from . import replayspill
+
+# Replays being recorded are spilled here until FA disconnects
+SPILL_DIR = os.path.join(util.CACHE_DIR, "replay_spill")
 
 class ReplayRecorder(QtCore.QObject): 
     """
     This is a simple class that takes all the FA replay data input from its inputSocket, writes it to a file,
-    and relays it to an internet server via its relaySocket.
+    and relays it to an internet server via a ReplayRelay.
     """
     __logger = logging.getLogger(__name__)
 
@@ -32,25 +36,24 @@ class ReplayRecorder(QtCore.QObject):
         self.inputSocket.disconnected.connect(self.inputDisconnected)
         self.__logger.info("FA connected locally.")  
 
-        # Create a file to write the replay data into
-        self.replayData = QtCore.QByteArray()
+        # Spill the replay data into a file as it arrives
         self.replayInfo = fa.instance._info
-                 
-        # Open the relay socket to our server
-        self.relaySocket = QtNetwork.QTcpSocket(self.parent)
-        self.relaySocket.connectToHost(INTERNET_REPLAY_SERVER_HOST, INTERNET_REPLAY_SERVER_PORT)
-        
+        self.spill = replayspill.ReplaySpill(SPILL_DIR, self.replayName(), self.replayInfo)
+        self._prefix = b""
+        self._recorded = False  # FA is through and the local replay was written
+        self._written = False   # The local replay was written, the spill isn't needed for recovery
+
+        # Relay the replay to our server, if the user wants that
+        self.relay = None
         if util.settings.value("fa.live_replay", DEFAULT_LIVE_REPLAY, type=bool):
-            if self.relaySocket.waitForConnected(1000):  # Maybe make this asynchronous
-                self.__logger.debug("internet replay server " + self.relaySocket.peerName() + ":" + str(self.relaySocket.peerPort()))
-            else:
-                self.__logger.error("no connection to internet replay server")
+            self.relay = replayrelay.ReplayRelay(INTERNET_REPLAY_SERVER_HOST, INTERNET_REPLAY_SERVER_PORT,
+                                                 self.relayBacking, parent=self)
+            self.relay.finished.connect(self.relayFinished)
 
     def __del__(self):
         # Clean up our socket objects, in accordance to the hint from the Qt docs (recommended practice)
         self.__logger.debug("destructor entered")
         self.inputSocket.deleteLater()
-        self.relaySocket.deleteLater()
 
     def readDatas(self):
         # CAVEAT: readAll() was seemingly truncating data here
@@ -60,26 +63,31 @@ class ReplayRecorder(QtCore.QObject):
             self.__logger.warning("Read failure on inputSocket: " + bytes.decode())
             return
 
-        # Convert data into a bytearray for easier processing
-        data = QtCore.QByteArray(read)
-
         # Record locally
-        if self.replayData.isEmpty():
+        if self.spill.size == 0 and read.startswith(b"P/"):
             # This prefix means "P"osting replay in the livereplay protocol of FA,
             # this needs to be stripped from the local file
-            if data.startsWith(b"P/"):
-                rest = data.indexOf(b"\x00") + 1
-                self.__logger.info("Stripping prefix '" + str(data.left(rest - 1)) + "' from replay.")
-                self.replayData.append(data.right(data.size() - rest))
-            else:
-                self.replayData.append(data)
+            rest = read.find(b"\x00") + 1
+            self.__logger.info("Stripping prefix '" + str(read[:rest - 1]) + "' from replay.")
+            self._prefix = read[:rest]
+            self.spill.append(read[rest:])
         else:
-            # Write to buffer
-            self.replayData.append(data)
+            self.spill.append(read)
 
         # Relay to faforever.com
-        if self.relaySocket.isOpen():
-            self.relaySocket.write(data)
+        if self.relay is not None:
+            self.relay.write(read)
+
+    def relayBacking(self, offset, size):
+        """
+        Relayed data the relay's ring buffer no longer holds: the livereplay prefix, then the spill.
+        """
+        if offset < len(self._prefix):
+            return self._prefix[offset:offset + size]
+        return self.spill.read(offset - len(self._prefix), size)
+
+    def replayName(self):
+        return str(self.replayInfo['uid']) + "-" + self.replayInfo['recorder']
 
     def done(self):
         self.__logger.info("closing replay file")
@@ -94,22 +102,27 @@ class ReplayRecorder(QtCore.QObject):
             self.__logger.info("Relaying remaining bytes:" + str(self.inputSocket.bytesAvailable()))
             self.readDatas()
             
-        # Part of the hardening - ensure successful sending of the rest of the replay to the server
-        if self.relaySocket.bytesToWrite():
-            self.__logger.info("Waiting for replay transmission to finish: " + str(self.relaySocket.bytesToWrite()) + " bytes")
-
-            progress = QtWidgets.QProgressDialog("Finishing Replay Transmission", "Cancel", 0, 0)
-            progress.show()
-
-            while self.relaySocket.bytesToWrite() and progress.isVisible():
-                QtWidgets.QApplication.processEvents()
+        # Write the local replay right away, the relay reads from the spill until it's done
+        self.writeReplayFile()
+        self._recorded = True
 
-            progress.close()
+        if self.relay is not None:
+            self.relay.finish()
+        else:
+            self.relayFinished()
 
-        self.relaySocket.disconnectFromHost()
-        
-        self.writeReplayFile()
-        
+    @QtCore.pyqtSlot()
+    def relayFinished(self):
+        if not self._recorded:
+            # The relay gave up while FA is still playing, go on recording locally
+            self.__logger.warning("Live replay relay gave up, recording locally only")
+            self.relay.deleteLater()
+            self.relay = None
+            return
+        if self._written:
+            self.spill.discard()
+        else:
+            self.spill.close()  # Left to be recovered on the next start
         self.done()
 
     def writeReplayFile(self):
@@ -123,18 +136,40 @@ class ReplayRecorder(QtCore.QObject):
             self.replayInfo = fa.instance._info
                  
         self.replayInfo['game_end'] = time.time()
-        
-        filename = os.path.join(util.REPLAY_DIR, str(self.replayInfo['uid']) + "-" + self.replayInfo['recorder'] + ".fafreplay")
-        self.__logger.info("Writing local replay as " + filename + ", containing " + str(self.replayData.size()) + " bytes of replay data.")
-               
-        replay = QtCore.QFile(filename)
-        replay.open(QtCore.QIODevice.WriteOnly | QtCore.QIODevice.Text)
-        replay.write(json.dumps(self.replayInfo).encode('utf-8'))
-        replay.write(b'\n')
-        replay.write(QtCore.qCompress(self.replayData).toBase64())
-        replay.close()
+
+        # Should writing the replay fail, it's recovered with this info on the next start
+        try:
+            self.spill.writeInfo(self.replayInfo)
+        except (IOError, TypeError, ValueError):
+            self.__logger.exception("Failed to update the info of the spilled replay")
+
+        filename = os.path.join(util.REPLAY_DIR, self.replayName() + ".fafreplay")
+        self.__logger.info("Writing local replay as " + filename + ", containing " + str(self.spill.size) + " bytes of replay data.")
+
+        try:
+            self.spill.export(self.replayInfo, filename)
+            self._written = True
+        except IOError:
+            self.__logger.exception("Failed to write local replay " + filename)
         
 
+class ReplayRecoveryThread(QtCore.QThread):
+    """
+    Recovers the replays of recordings started before a given time.
+    """
+    __logger = logging.getLogger(__name__)
+
+    def __init__(self, before, *args, **kwargs):
+        QtCore.QThread.__init__(self, *args, **kwargs)
+        self._before = before
+
+    def run(self):
+        try:
+            replayspill.recover(SPILL_DIR, util.REPLAY_DIR, self._before)
+        except OSError:
+            self.__logger.exception("Failed to recover interrupted replays")
+
+
 class ReplayServer(QtNetwork.QTcpServer):
     """
     This is a local listening server that FA can send its replay data to.
@@ -148,6 +183,25 @@ class ReplayServer(QtNetwork.QTcpServer):
         self.client = client                
         self.__logger.debug("initializing...")
         self.newConnection.connect(self.acceptConnection)
+        self._recovery = None
+        self.recoverReplays()
+
+    def recoverReplays(self):
+        """
+        Rebuilds the replays of recordings that were cut short by a client crash, on a
+        worker thread. Recordings started in the meantime are left alone.
+        """
+        if self._recovery is not None and self._recovery.isRunning():
+            return
+        self._recovery = ReplayRecoveryThread(time.time())
+        self._recovery.start()
+
+    def close(self):
+        QtNetwork.QTcpServer.close(self)
+        # Don't leave a replay half rebuilt
+        if self._recovery is not None:
+            self._recovery.wait()
+            self._recovery = None
 
     def doListen(self,local_port):
         while not self.isListening():
@@ -0,0 +1,140 @@
+"""
+Append-only on-disk buffer for replays being recorded.
+
+Replay data goes straight to a spill file as it arrives instead of piling up
+in memory. The spill file is fsynced periodically, and its replay info is kept
+in a JSON sidecar, so a replay interrupted by a client crash can be rebuilt
+from the leftovers on the next start.
+"""
+import json
+import os
+import time
+
+from fa import fafreplay
+
+import logging
+logger = logging.getLogger(__name__)
+
+SPILL_EXTENSION = ".spill"
+INFO_EXTENSION = ".spill.json"
+
+# Seconds between fsync checkpoints of a growing spill file
+CHECKPOINT_INTERVAL = 30
+
+
+class ReplaySpill(object):
+    def __init__(self, directory, name, info, checkpoint_interval=CHECKPOINT_INTERVAL):
+        self.path = os.path.join(directory, name + SPILL_EXTENSION)
+        self.info_path = os.path.join(directory, name + INFO_EXTENSION)
+        self.size = 0
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self._checkpoint_interval = checkpoint_interval
+        self._last_checkpoint = time.time()
+        self._file = open(self.path, "wb")
+        self._reader = None
+        self.writeInfo(info)
+
+    def writeInfo(self, info):
+        tmp = self.info_path + ".tmp"
+        with open(tmp, "w") as fh:
+            json.dump(info, fh)
+        os.replace(tmp, self.info_path)
+
+    def append(self, data):
+        self._file.write(data)
+        self.size += len(data)
+        if time.time() - self._last_checkpoint > self._checkpoint_interval:
+            self.checkpoint()
+
+    def read(self, offset, size):
+        """
+        Reads back up to size bytes of spilled data from offset.
+        """
+        if not self._file.closed:
+            self._file.flush()
+        if self._reader is None:
+            self._reader = open(self.path, "rb")
+        self._reader.seek(offset)
+        return self._reader.read(size)
+
+    def checkpoint(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._last_checkpoint = time.time()
+
+    def close(self):
+        if not self._file.closed:
+            self.checkpoint()
+            self._file.close()
+
+    def export(self, info, destination):
+        """
+        Compresses the spilled data into a .fafreplay at destination.
+        The spill file stays readable, but won't be recovered any more.
+        """
+        self.close()
+        fafreplay.encode_file(info, self.path, destination)
+        if os.path.exists(self.info_path):
+            os.remove(self.info_path)
+
+    def finalize(self, info, destination):
+        """
+        Compresses the spilled data into a .fafreplay at destination and removes the spill.
+        """
+        self.export(info, destination)
+        self.discard()
+
+    def discard(self):
+        self.close()
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+        for path in (self.path, self.info_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def recover(directory, destination_dir, before=None):
+    """
+    Rebuilds .fafreplay files in destination_dir from the spill files left in
+    directory by recordings that never finished. Returns the recovered paths.
+    With before set, spill files written to since that time are left alone.
+    """
+    recovered = []
+    if not os.path.isdir(directory):
+        return recovered
+
+    for entry in os.scandir(directory):
+        if not entry.name.endswith(SPILL_EXTENSION):
+            continue
+        if before is not None and entry.stat().st_mtime >= before:
+            continue    # Still being recorded
+        name = entry.name[:-len(SPILL_EXTENSION)]
+        info_path = os.path.join(directory, name + INFO_EXTENSION)
+        try:
+            with open(info_path) as fh:
+                info = json.load(fh)
+        except (IOError, ValueError):
+            logger.warning("Discarding spilled replay without info: " + entry.path)
+            os.remove(entry.path)
+            continue
+
+        if entry.stat().st_size == 0:
+            logger.info("Discarding empty spilled replay: " + entry.path)
+        else:
+            info.setdefault('game_end', entry.stat().st_mtime)
+            destination = os.path.join(destination_dir, name + ".fafreplay")
+            try:
+                fafreplay.encode_file(info, entry.path, destination)
+            except IOError:
+                logger.exception("Failed to recover spilled replay: " + entry.path)
+                continue
+            logger.info("Recovered interrupted replay as " + destination)
+            recovered.append(destination)
+
+        os.remove(entry.path)
+        os.remove(info_path)
+    return recovered
@@ -0,0 +1,205 @@
+"""
+Reader for SCFA's .scmap files.
+
+The file is memory mapped and each section is parsed when it's first asked
+for, so reading the size of a map touches the first page only, and getting
+its preview doesn't read the heightmap. The layout, all little endian:
+
+    header      magic "Map\\x1a", major version, two unknown ints, width and
+                height as floats, an unknown int and short
+    preview     int length, then that many bytes of DDS image
+    version     int minor version, 53 for the original maps, 56 and 60 later
+    heightmap   int width, int height, float scale, (width + 1) * (height + 1)
+                unsigned shorts
+    terrain     from version 56 on an unknown byte, then the zero terminated
+                terrain shader, background texture and sky cubemap paths,
+                followed by the environment cubemaps (version 56 on: an int
+                count of name and path pairs, before: a single path)
+
+Markers aren't part of the .scmap, they're in the map's _save.lua.
+
+An Scmap keeps nothing but its own memory map, so maps can be read on any
+thread, as long as each thread opens its own.
+"""
+import array
+import collections
+import mmap
+import struct
+import sys
+
+from fa import dds
+
+MAGIC = b"Map\x1a"
+HEADER = struct.Struct("<4siiiffih")
+PREVIEW_OFFSET = HEADER.size
+
+Header = collections.namedtuple("Header", "major width height")
+Heightmap = collections.namedtuple("Heightmap", "width height scale offset")
+Terrain = collections.namedtuple("Terrain", "shader background sky cubemaps")
+
+
+class ScmapError(IOError):
+    pass
+
+
+class Scmap(object):
+    """
+    A memory mapped .scmap file. Use as a context manager, or close() it.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._header = None
+        self._preview = None    # (offset, length)
+        self._version = None
+        self._heightmap = None
+        self._terrain = None
+        with open(path, "rb") as fh:
+            try:
+                self._buf = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # Empty file
+                raise ScmapError("Empty map file " + path)
+        if self._buf[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ScmapError("Not a map file: " + path)
+
+    def close(self):
+        if self._buf is not None:
+            self._buf.close()
+            self._buf = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _unpack(self, fmt, offset):
+        try:
+            return struct.unpack_from(fmt, self._buf, offset)
+        except struct.error:
+            raise ScmapError("Truncated map file: " + self.path)
+
+    def _string(self, offset):
+        """
+        Returns the zero terminated string at offset and the offset after it.
+        """
+        end = self._buf.find(b"\0", offset)
+        if end < 0:
+            raise ScmapError("Truncated map file: " + self.path)
+        return self._buf[offset:end].decode("latin-1"), end + 1
+
+    @property
+    def header(self):
+        if self._header is None:
+            if len(self._buf) < HEADER.size:
+                raise ScmapError("Truncated map file: " + self.path)
+            _, major, _, _, width, height, _, _ = HEADER.unpack_from(self._buf)
+            self._header = Header(major, width, height)
+        return self._header
+
+    def _previewSpan(self):
+        if self._preview is None:
+            length, = self._unpack("<i", PREVIEW_OFFSET)
+            offset = PREVIEW_OFFSET + 4
+            if length < 0 or offset + length > len(self._buf):
+                raise ScmapError("Bad preview length in " + self.path)
+            self._preview = (offset, length)
+        return self._preview
+
+    def preview(self):
+        """
+        Returns the preview DDS image as bytes.
+        """
+        offset, length = self._previewSpan()
+        return self._buf[offset:offset + length]
+
+    def previewImage(self):
+        """
+        Returns the preview decoded into a QImage.
+        """
+        offset, length = self._previewSpan()
+        view = memoryview(self._buf)[offset:offset + length]
+        try:
+            return dds.to_image(view)
+        finally:
+            view.release()
+
+    @property
+    def version(self):
+        """
+        The minor version, the one that tells the layouts apart.
+        """
+        if self._version is None:
+            offset, length = self._previewSpan()
+            self._version, = self._unpack("<i", offset + length)
+        return self._version
+
+    @property
+    def heightmap(self):
+        """
+        Dimensions and scale of the heightmap. Its samples are read by heights().
+        """
+        if self._heightmap is None:
+            offset, length = self._previewSpan()
+            offset += length + 4
+            width, height, scale = self._unpack("<iif", offset)
+            offset += 12
+            if width < 0 or height < 0 or offset + (width + 1) * (height + 1) * 2 > len(self._buf):
+                raise ScmapError("Bad heightmap size in " + self.path)
+            self._heightmap = Heightmap(width, height, scale, offset)
+        return self._heightmap
+
+    def heights(self):
+        """
+        Returns the heightmap samples, row by row, as an array of unsigned shorts.
+        Multiply by heightmap.scale for the height in game units.
+        """
+        hm = self.heightmap
+        count = (hm.width + 1) * (hm.height + 1)
+        samples = array.array("H", self._buf[hm.offset:hm.offset + count * 2])
+        if sys.byteorder != "little":
+            samples.byteswap()
+        return samples
+
+    @property
+    def terrain(self):
+        """
+        The terrain shader, background and sky textures and environment cubemaps ((name, path) pairs).
+        """
+        if self._terrain is None:
+            hm = self.heightmap
+            offset = hm.offset + (hm.width + 1) * (hm.height + 1) * 2
+            if self.version >= 56:
+                offset += 1
+            shader, offset = self._string(offset)
+            background, offset = self._string(offset)
+            sky, offset = self._string(offset)
+            cubemaps = []
+            if self.version >= 56:
+                count, = self._unpack("<i", offset)
+                offset += 4
+                for _ in range(count):
+                    name, offset = self._string(offset)
+                    path, offset = self._string(offset)
+                    cubemaps.append((name, path))
+            else:
+                path, offset = self._string(offset)
+                cubemaps.append(("<default>", path))
+            self._terrain = Terrain(shader, background, sky, cubemaps)
+        return self._terrain
+
+
+def header(path):
+    """
+    Reads just the header of the .scmap at path.
+    """
+    with Scmap(path) as scmap:
+        return scmap.header
+
+
+def preview(path):
+    """
+    Reads just the preview DDS of the .scmap at path, as bytes.
+    """
+    with Scmap(path) as scmap:
+        return scmap.preview()
@@ -0,0 +1,312 @@
+"""
+Pipelined file transfers for the FA updater.
+
+Hashing, downloading and patching each run on their own worker threads, so
+the updater can keep its requests to the update server flowing while earlier
+files are still in transit: local files are hashed in parallel, several HTTP
+downloads share a pool of keep-alive connections, and patches are applied as
+soon as they arrive while other downloads carry on.
+
+Workers never touch the GUI or the update connection. They report back through
+a queue which the updater drains from its wait loop with poll().
+"""
+import collections
+import concurrent.futures
+import glob
+import hashlib
+import http.client
+import os
+import queue
+import socket
+import tempfile
+import threading
+import time
+import urllib.parse
+
+
+import logging
+logger = logging.getLogger(__name__)
+
+HASH_WORKERS = 4
+DOWNLOAD_WORKERS = 4
+PATCH_WORKERS = 2
+
+# Network timeout for a single HTTP request, in seconds
+HTTP_TIMEOUT = 20
+MAX_REDIRECTS = 5
+
+# Attempts to resume an interrupted download, and the pause before the first one in seconds
+RETRIES = 3
+RETRY_DELAY = 1
+READ_SIZE = 64 * 1024
+USER_AGENT = "FAF Client"
+
+HASHED = "hashed"
+DOWNLOADED = "downloaded"
+PATCHED = "patched"
+
+# name is the file name the update server knows the file by; error is None on success
+Completion = collections.namedtuple("Completion", "kind name value error")
+
+
+class PipelineCancelled(Exception):
+    pass
+
+
+class HttpError(http.client.HTTPException):
+    def __init__(self, status, message):
+        http.client.HTTPException.__init__(self, message)
+        self.status = status
+
+
+class HttpFetcher(object):
+    """
+    Downloads files over HTTP(S), keeping one persistent connection per host and thread.
+    scheduler is an optional downloadManager.bandwidth.BandwidthScheduler to throttle with.
+    """
+    def __init__(self, timeout=HTTP_TIMEOUT, scheduler=None):
+        self._timeout = timeout
+        self._scheduler = scheduler
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+        self.cancelled = False
+        self.received = 0   # bytes downloaded by all threads together
+
+    def _connection(self, parts):
+        connections = getattr(self._local, "connections", None)
+        if connections is None:
+            connections = self._local.connections = {}
+        key = (parts.scheme, parts.netloc)
+        if key not in connections:
+            if parts.scheme == "https":
+                conn = http.client.HTTPSConnection(parts.netloc, timeout=self._timeout)
+            elif parts.scheme == "http":
+                conn = http.client.HTTPConnection(parts.netloc, timeout=self._timeout)
+            else:
+                raise IOError("Unsupported URL: " + urllib.parse.urlunsplit(parts))
+            connections[key] = conn
+            with self._lock:
+                self._connections.append(conn)
+        return connections[key]
+
+    def _drop(self, parts):
+        conn = self._local.connections.pop((parts.scheme, parts.netloc), None)
+        if conn is not None:
+            conn.close()
+
+    def _request(self, parts, headers):
+        target = parts.path or "/"
+        if parts.query:
+            target += "?" + parts.query
+        headers = dict(headers, **{'User-Agent': USER_AGENT})
+        try:
+            conn = self._connection(parts)
+            conn.request("GET", target, headers=headers)
+            return conn.getresponse()
+        except (http.client.HTTPException, ConnectionError):
+            # The server may have closed an idle keep-alive connection, try once more on a fresh one
+            self._drop(parts)
+            conn = self._connection(parts)
+            conn.request("GET", target, headers=headers)
+            return conn.getresponse()
+
+    def _get(self, url, headers):
+        """
+        Sends a GET request, following redirects. Returns the url it ended up at and the response.
+        """
+        for _ in range(MAX_REDIRECTS):
+            parts = urllib.parse.urlsplit(url)
+            response = self._request(parts, headers)
+            if response.status in (301, 302, 303, 307, 308):
+                response.read()
+                url = urllib.parse.urljoin(url, response.getheader("Location"))
+                continue
+            return url, response
+        raise IOError("Too many redirects for " + url)
+
+    @staticmethod
+    def partPath(url, destination):
+        # Keyed by url, so a resumed download never mixes up two versions of a file
+        return "{}.{}.part".format(destination, hashlib.md5(url.encode("utf-8")).hexdigest()[:8])
+
+    def fetch(self, url, destination):
+        """
+        Downloads url into destination. The file only appears there once it's complete.
+
+        Data is collected in a .part file next to destination. Interrupted
+        transfers are resumed from it with a Range request, both when retrying
+        here and when the same url is fetched again later.
+        """
+        part = self.partPath(url, destination)
+        for stale in glob.glob(glob.escape(destination) + ".*.part"):
+            if stale != part:
+                os.remove(stale)
+
+        try:
+            for attempt in range(RETRIES + 1):
+                try:
+                    self._fetchPart(url, part)
+                    break
+                except (ConnectionError, socket.timeout, http.client.HTTPException) as e:
+                    if isinstance(e, HttpError) and e.status < 500 or attempt == RETRIES:
+                        raise
+                    logger.warning("Download of {} interrupted ({}), resuming".format(url, e))
+                    time.sleep(RETRY_DELAY * (attempt + 1))
+        except:
+            if os.path.exists(part) and os.path.getsize(part) == 0:
+                os.remove(part)
+            raise
+        os.replace(part, destination)
+
+    def _fetchPart(self, url, part):
+        with open(part, "r+b" if os.path.exists(part) else "w+b") as fh:
+            offset = fh.seek(0, os.SEEK_END)
+
+            headers = {'Range': "bytes={}-".format(offset)} if offset else {}
+            real_url, response = self._get(url, headers)
+            if response.status == 416:
+                # What we have is no prefix of the file (any more), start over
+                response.read()
+                offset, headers = 0, {}
+                real_url, response = self._get(url, headers)
+
+            if response.status == 200:
+                offset = 0
+            elif response.status != 206 or not response.getheader("Content-Range", "").startswith(
+                    "bytes {}-".format(offset)):
+                response.read()
+                raise HttpError(response.status, "HTTP {} {} for {}".format(response.status, response.reason, url))
+
+            fh.seek(offset)
+            fh.truncate()
+            try:
+                self._save(response, fh)
+            except:
+                response.close()
+                self._drop(urllib.parse.urlsplit(real_url))
+                raise
+
+    def _save(self, response, fh):
+        expected = response.getheader("Content-Length")
+        size = 0
+        while True:
+            if self.cancelled:
+                raise PipelineCancelled("Download cancelled")
+            data = response.read(READ_SIZE)
+            if not data:
+                break
+            fh.write(data)
+            size += len(data)
+            with self._lock:
+                self.received += len(data)
+            if self._scheduler is not None:
+                self._scheduler.acquire(len(data))
+        if expected is not None and size != int(expected):
+            raise http.client.IncompleteRead(b"", int(expected) - size)
+
+    def close(self):
+        self.cancelled = True
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+
+
+class UpdatePipeline(object):
+    """
+    Runs the hashing, downloading and patching for an update concurrently.
+
+    hasher(path) returns the MD5 of a local file (or None if it doesn't exist),
+    patcher(original, patch) patches original in place and removes patch.
+    Downloaded patches are kept in patchdir until they're applied, downloads
+    are throttled by scheduler if given.
+    """
+    def __init__(self, hasher, patcher, patchdir=None, scheduler=None,
+                 hash_workers=HASH_WORKERS, download_workers=DOWNLOAD_WORKERS):
+        self._hasher = hasher
+        self._patcher = patcher
+        self._patchdir = patchdir
+        self._fetcher = HttpFetcher(scheduler=scheduler)
+        self._hashPool = concurrent.futures.ThreadPoolExecutor(hash_workers)
+        self._downloadPool = concurrent.futures.ThreadPoolExecutor(download_workers)
+        self._patchPool = concurrent.futures.ThreadPoolExecutor(PATCH_WORKERS)
+        self._completions = queue.Queue()
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._closed = False
+
+    @property
+    def pending(self):
+        """
+        Number of jobs that haven't been reported through poll() yet.
+        """
+        with self._lock:
+            return self._pending
+
+    @property
+    def received(self):
+        return self._fetcher.received
+
+    def _submit(self, pool, fn, *args):
+        with self._lock:
+            self._pending += 1
+        pool.submit(fn, *args)
+
+    def _run(self, kind, name, fn, *args):
+        try:
+            if self._closed:
+                raise PipelineCancelled("Update cancelled")
+            self._completions.put(Completion(kind, name, fn(*args), None))
+        except Exception as e:
+            if not isinstance(e, PipelineCancelled):
+                logger.exception("Update job failed: {} {}".format(kind, name))
+            self._completions.put(Completion(kind, name, None, e))
+
+    def hash(self, name, path):
+        self._submit(self._hashPool, self._run, HASHED, name, self._hasher, path)
+
+    def download(self, name, url, destination):
+        self._submit(self._downloadPool, self._run, DOWNLOADED, name, self._fetcher.fetch, url, destination)
+
+    def patch(self, name, url, original):
+        """
+        Downloads the patch at url, then applies it to original while the next downloads are running.
+        """
+        self._submit(self._downloadPool, self._fetchPatch, name, url, original)
+
+    def _fetchPatch(self, name, url, original):
+        # Named after the url, so an interrupted patch download is picked up again by the next update
+        patch = os.path.join(self._patchdir or tempfile.gettempdir(),
+                             hashlib.md5(url.encode("utf-8")).hexdigest() + ".patch")
+        try:
+            if self._closed:
+                raise PipelineCancelled("Update cancelled")
+            self._fetcher.fetch(url, patch)
+        except Exception as e:
+            if not isinstance(e, PipelineCancelled):
+                logger.exception("Failed to download patch for " + name)
+            self._completions.put(Completion(PATCHED, name, None, e))
+            return
+        # Reported by the patch job, once the patch is applied
+        self._patchPool.submit(self._run, PATCHED, name, self._patcher, original, patch)
+
+    def poll(self):
+        """
+        Returns the Completions of all jobs that finished since the last call.
+        """
+        done = []
+        while True:
+            try:
+                done.append(self._completions.get_nowait())
+            except queue.Empty:
+                break
+        with self._lock:
+            self._pending -= len(done)
+        return done
+
+    def close(self):
+        self._closed = True
+        self._fetcher.close()
+        for pool in (self._hashPool, self._downloadPool, self._patchPool):
+            pool.shutdown(wait=True)
@@ -13,7 +13,6 @@ import subprocess
 import time
 import shutil
 import logging
-import urllib.request, urllib.error, urllib.parse
 import sys
 import tempfile
 import json
@@ -27,6 +26,10 @@ from PyQt5 import QtWidgets, QtCore, QtNetwork
 
 import util
 import modvault
+from downloadManager import bandwidth
+from fa import hashmanifest
+from fa import updatepipeline
+from fa import vcdiff
 
 
 logger = logging.getLogger(__name__)
@@ -34,6 +37,17 @@ logger = logging.getLogger(__name__)
 # This contains a complete dump of everything that was supplied to logOutput
 debugLog = []
 
+# Hashes of the game files, so unchanged files aren't hashed again on every launch
+HASH_MANIFEST = os.path.join(util.CACHE_DIR, "gamefiles.json")
+_hashManifest = None
+
+
+def hashManifest():
+    global _hashManifest
+    if _hashManifest is None:
+        _hashManifest = hashmanifest.HashManifest(HASH_MANIFEST)
+    return _hashManifest
+
 
 # Interface for the user of a connection.
 class ConnectionHandler(object):
@@ -191,6 +205,25 @@ class UpdaterProgressDialog(FormClass, BaseClass):
         self.done(QtWidgets.QDialog.Accepted)  # equivalent to self.accept(), but clearer
 
 
+class _LogCollector(QtCore.QObject):
+    """
+    Collects the update log on the GUI thread. Patches are applied on worker
+    threads, whose lines arrive through the queued line signal.
+    """
+    line = QtCore.pyqtSignal(str)
+
+    def __init__(self, *args, **kwargs):
+        QtCore.QObject.__init__(self, *args, **kwargs)
+        self.line.connect(self.append)
+
+    @QtCore.pyqtSlot(str)
+    def append(self, text):
+        debugLog.append(text)
+
+
+_collector = _LogCollector()
+
+
 def clearLog():
     global debugLog
     debugLog = []
@@ -198,7 +231,7 @@ def clearLog():
 
 def log(string):
     logger.debug(string)
-    debugLog.append(str(string))
+    _collector.line.emit(str(string))
 
 
 def dumpPlainText():
@@ -262,6 +295,9 @@ class Updater(QtCore.QObject, ConnectionHandler):
         self.result = self.RESULT_NONE
 
         self.destination = None
+        self.filegroup = None
+        self.pipeline = None
+        self.manifest = hashManifest()
 
         self.silent = silent
         self.progress = QtWidgets.QProgressDialog()
@@ -308,69 +344,6 @@ class Updater(QtCore.QObject, ConnectionHandler):
         log("Update finished at " + timestamp())
         return self.result
 
-    def fetchFile(self, url, toFile):
-        try:
-            logger.info('Updater: Downloading {}'.format(url))
-            progress = QtWidgets.QProgressDialog()
-            progress.setCancelButtonText("Cancel")
-            progress.setWindowFlags(QtCore.Qt.CustomizeWindowHint | QtCore.Qt.WindowTitleHint)
-            progress.setAutoClose(True)
-            progress.setAutoReset(False)
-
-            req = urllib.request.Request(url, headers={'User-Agent': "FAF Client"})
-            downloadedfile = urllib.request.urlopen(req)
-            meta = downloadedfile.info()
-
-            # Fix for #241, sometimes the server sends an error and no content-length.
-            file_size = int(meta.get_all("Content-Length")[0])
-            progress.setMinimum(0)
-            progress.setMaximum(file_size)
-            progress.setModal(1)
-            progress.setWindowTitle("Downloading Update")
-            label = QtWidgets.QLabel()
-            label.setOpenExternalLinks(True)
-            progress.setLabel(label)
-            progress.setLabelText('Downloading FA file : <a href="' + url + '">' + url + '</a><br/>File size: ' + str(
-                int(file_size / 1024 / 1024)) + ' MiB')
-            progress.show()
-
-            # Download the file as a series of up to 4 KiB chunks, then uncompress it.
-
-            output = tempfile.NamedTemporaryFile(mode='w+b', delete=False)
-
-            file_size_dl = 0
-            block_sz = 4096
-
-            while progress.isVisible():
-                QtWidgets.QApplication.processEvents()
-                if not progress.isVisible():
-                    break
-                read_buffer = downloadedfile.read(block_sz)
-                if not read_buffer:
-                    break
-                file_size_dl += len(read_buffer)
-                output.write(read_buffer)
-                progress.setValue(file_size_dl)
-
-            output.flush()
-            os.fsync(output.fileno())
-            output.close()
-
-            shutil.move(output.name, toFile)
-
-            if (progress.value() == file_size) or progress.value() == -1:
-                logger.debug("File downloaded successfully.")
-                return True
-            else:
-                QtWidgets.QMessageBox.information(None, "Aborted", "Download not complete.")
-                logger.warning("File download not complete.")
-                return False
-        except:
-            logger.error("Updater error: ", exc_info=sys.exc_info())
-            QtWidgets.QMessageBox.information(None, "Download Failed", "The file wasn't properly sent by the server. "
-                                                                       "<br/><b>Try again later.</b>")
-            return False
-
     def updateFiles(self, destination, filegroup):
         """
         Updates the files in a given file group, in the destination subdirectory of the Forged Alliance path.
@@ -381,6 +354,7 @@ class Updater(QtCore.QObject, ConnectionHandler):
 
         self.progress.setLabelText("Updating files: " + filegroup)
         self.destination = destination
+        self.filegroup = filegroup
 
         self.connection.writeToServer("GET_FILES_TO_UPDATE", filegroup)
         self.waitForFileList()
@@ -392,32 +366,83 @@ class Updater(QtCore.QObject, ConnectionHandler):
         if not os.path.exists(targetdir):
             os.makedirs(targetdir)
 
+        # Hash the local files in parallel, their requests go out as the hashes come in
         for fileToUpdate in self.filesToUpdate:
-            md5File = util.md5(os.path.join(util.APPDATA_DIR, destination, fileToUpdate))
-            if md5File is None:
-                if self.version:
-                    if self.featured_mod == "faf" or self.featured_mod == "ladder1v1" or \
-                                    filegroup == "FAF" or filegroup == "FAFGAMEDATA":
-                        self.connection.writeToServer("REQUEST_VERSION", destination, fileToUpdate, str(self.version))
-                    else:
-                        self.connection.writeToServer("REQUEST_MOD_VERSION", destination, fileToUpdate,
-                                           json.dumps(self.modversions))
-                else:
+            self.pipeline.hash(fileToUpdate, os.path.join(util.APPDATA_DIR, destination, fileToUpdate))
+
+        self.waitUntilFilesAreUpdated()
 
-                    self.connection.writeToServer("REQUEST_PATH", destination, fileToUpdate)
+    def requestFile(self, fileToUpdate, md5File):
+        """
+        Asks the server for a file, or a patch to bring the local copy (with hash md5File) up to date.
+        """
+        destination = self.destination
+        filegroup = self.filegroup
+        if md5File is None:
+            if self.version:
+                if self.featured_mod == "faf" or self.featured_mod == "ladder1v1" or \
+                                filegroup == "FAF" or filegroup == "FAFGAMEDATA":
+                    self.connection.writeToServer("REQUEST_VERSION", destination, fileToUpdate, str(self.version))
+                else:
+                    self.connection.writeToServer("REQUEST_MOD_VERSION", destination, fileToUpdate,
+                                       json.dumps(self.modversions))
             else:
-                if self.version:
-                    if self.featured_mod == "faf" or self.featured_mod == "ladder1v1" or \
-                                    filegroup == "FAF" or filegroup == "FAFGAMEDATA":
-                        self.connection.writeToServer("PATCH_TO", destination, fileToUpdate, md5File, str(self.version))
-                    else:
-
-                        self.connection.writeToServer("MOD_PATCH_TO", destination, fileToUpdate, md5File,
-                                           json.dumps(self.modversions))
+                self.connection.writeToServer("REQUEST_PATH", destination, fileToUpdate)
+        else:
+            if self.version:
+                if self.featured_mod == "faf" or self.featured_mod == "ladder1v1" or \
+                                filegroup == "FAF" or filegroup == "FAFGAMEDATA":
+                    self.connection.writeToServer("PATCH_TO", destination, fileToUpdate, md5File, str(self.version))
                 else:
-                    self.connection.writeToServer("UPDATE", destination, fileToUpdate, md5File)
+                    self.connection.writeToServer("MOD_PATCH_TO", destination, fileToUpdate, md5File,
+                                       json.dumps(self.modversions))
+            else:
+                self.connection.writeToServer("UPDATE", destination, fileToUpdate, md5File)
 
-        self.waitUntilFilesAreUpdated()
+    def processPipeline(self):
+        """
+        Acts upon the hashing, download and patch jobs that finished in the background.
+        A file that fails is reported and left as it is, the others are updated regardless.
+        """
+        for completion in self.pipeline.poll():
+            if completion.kind == updatepipeline.HASHED:
+                md5File = completion.value
+                if completion.error is not None:
+                    # Better to fetch the whole file again than to give up on it
+                    log("Failed to hash %s: %s" % (completion.name, completion.error))
+                    md5File = None
+                self.requestFile(completion.name, md5File)
+                continue
+
+            if completion.name in self.filesToUpdate:
+                self.filesToUpdate.remove(completion.name)
+
+            if isinstance(completion.error, updatepipeline.PipelineCancelled):
+                continue
+            elif completion.error is not None:
+                log("Failed to update file %s: %s" % (completion.name, completion.error))
+                if completion.kind == updatepipeline.DOWNLOADED:
+                    QtWidgets.QMessageBox.information(None, "Download Failed",
+                                                      "The file wasn't properly sent by the server. "
+                                                      "<br/><b>Try again later.</b>")
+                else:
+                    QtWidgets.QMessageBox.information(None, "Patch Failed",
+                                                      "%s couldn't be patched.<br/><b>Try again later.</b>"
+                                                      % completion.name)
+                continue
+            elif completion.kind == updatepipeline.PATCHED:
+                log("%s/%s is patched." % (self.destination, completion.name))
+            else:
+                log("%s is downloaded." % completion.name)
+            self.updatedFiles.append(completion.name)
+
+        if self.pipeline.pending:
+            # Transfers in progress count as activity, the HTTP requests have their own timeout
+            self.lastData = time.time()
+            received = self.pipeline.received
+            if received:
+                self.progress.setLabelText("Updating files: %s (%.1f MiB downloaded)" %
+                                           (self.filegroup, received / 1024.0 / 1024.0))
 
     def waitForSimModPath(self):
         """
@@ -476,6 +501,8 @@ class Updater(QtCore.QObject, ConnectionHandler):
         self.progress.setMaximum(0)
 
         while len(self.filesToUpdate) > 0:
+            self.processPipeline()
+
             if self.progress.wasCanceled():
                 raise UpdaterCancellation("Operation aborted while waiting for data.")
 
@@ -518,6 +545,8 @@ class Updater(QtCore.QObject, ConnectionHandler):
 
     def doUpdate(self):
         """ The core function that does most of the actual update work."""
+        self.pipeline = updatepipeline.UpdatePipeline(self.manifest.md5, self.applyPatch, util.CACHE_DIR,
+                                                      bandwidth.shared)
         try:
             if self.sim:
                 self.connection.writeToServer("REQUEST_SIM_PATH", self.featured_mod)
@@ -553,6 +582,8 @@ class Updater(QtCore.QObject, ConnectionHandler):
         else:
             self.result = self.RESULT_SUCCESS
         finally:
+            self.pipeline.close()
+            self.manifest.save()
             self.connection.disconnect()
 
         # Hide progress dialog if it's still showing.
@@ -650,9 +681,8 @@ class Updater(QtCore.QObject, ConnectionHandler):
             url = stream.readQString()
 
             toFile = os.path.join(util.APPDATA_DIR, str(path), str(fileToCopy))
-            self.fetchFile(url, toFile)
-            self.filesToUpdate.remove(str(fileToCopy))
-            self.updatedFiles.append(str(fileToCopy))
+            self.manifest.invalidate(toFile)
+            self.pipeline.download(str(fileToCopy), url, toFile)
 
         elif action == "SEND_FILE":
             path = stream.readQString()
@@ -671,6 +701,7 @@ class Updater(QtCore.QObject, ConnectionHandler):
             if writeFile.open(QtCore.QIODevice.WriteOnly):
                 writeFile.write(fileDatas)
                 writeFile.close()
+                self.manifest.invalidate(toFile)
             else:
                 logger.warning("%s is not writeable in in %s. Skipping." % (
                 fileToCopy, path))  # This may or may not be desirable behavior
@@ -684,32 +715,40 @@ class Updater(QtCore.QObject, ConnectionHandler):
             fileToUpdate = str(stream.readQString())
             url = str(stream.readQString())
 
-            toFile = os.path.join(util.CACHE_DIR, "temp.patch")
-            #
-            if self.fetchFile(url, toFile):
-                completePath = os.path.join(util.APPDATA_DIR, destination, fileToUpdate)
-                self.applyPatch(completePath, toFile)
-
-                log("%s/%s is patched." % (destination, fileToUpdate))
-                self.filesToUpdate.remove(str(fileToUpdate))
-                self.updatedFiles.append(str(fileToUpdate))
-            else:
-                log("Failed to update file :'(")
+            completePath = os.path.join(util.APPDATA_DIR, destination, fileToUpdate)
+            self.pipeline.patch(fileToUpdate, url, completePath)
         else:
             log("Unexpected server command received: " + action)
             self.result = self.RESULT_FAILURE
 
     def applyPatch(self, original, patch):
-        toFile = os.path.join(util.CACHE_DIR, "patchedFile")
-        # applying delta
+        """
+        Applies the delta in patch to original in place, and removes patch.
+        Runs on the update pipeline's patch workers, possibly several at once.
+        """
+        try:
+            vcdiff.decode(original, patch, original)
+        except vcdiff.VcdiffUnsupported as e:
+            log("%s, patching %s with xdelta3" % (e, original))
+            self.applyPatchXdelta(original, patch)
+        finally:
+            os.remove(patch)
+            self.manifest.invalidate(original)
+
+    def applyPatchXdelta(self, original, patch):
         if sys.platform == 'win32':
             xdelta = os.path.join(fafpath.get_libdir(), "xdelta3.exe")
         else:
             xdelta = "xdelta3"
-        subprocess.call([xdelta, '-d', '-f', '-s', original, patch, toFile], stdout=subprocess.PIPE)
-        shutil.copy(toFile, original)
-        os.remove(toFile)
-        os.remove(patch)
+        fd, toFile = tempfile.mkstemp(suffix=".patched", dir=os.path.dirname(original))
+        os.close(fd)
+        try:
+            subprocess.check_call([xdelta, '-d', '-f', '-s', original, patch, toFile], stdout=subprocess.PIPE)
+            shutil.copymode(original, toFile)
+            os.replace(toFile, original)
+        except:
+            os.remove(toFile)
+            raise
 
     # Connection handler methods start here
 
@@ -0,0 +1,272 @@
+"""
+Decoder for VCDIFF (RFC 3284) deltas, as produced by xdelta3.
+
+The source file and the patch are memory mapped, and the result is written
+window by window into a temporary file next to the target, which then replaces
+the target in one go. Besides plain RFC 3284 this understands the extensions
+xdelta3 emits by default: the application header and per-window Adler-32
+checksums. Secondary compression and custom code tables aren't supported,
+decode() raises VcdiffUnsupported for those.
+"""
+import mmap
+import os
+import shutil
+import tempfile
+import zlib
+
+MAGIC = b"\xd6\xc3\xc4"
+
+# Header indicator
+VCD_DECOMPRESS = 0x01
+VCD_CODETABLE = 0x02
+VCD_APPHEADER = 0x04
+
+# Window indicator
+VCD_SOURCE = 0x01
+VCD_TARGET = 0x02
+VCD_ADLER32 = 0x04
+
+NOOP, ADD, RUN, COPY = range(4)
+
+NEAR_SIZE = 4
+SAME_SIZE = 3
+
+
+class VcdiffError(Exception):
+    pass
+
+
+class VcdiffUnsupported(VcdiffError):
+    pass
+
+
+def _default_code_table():
+    """
+    The default instruction code table of RFC 3284, section 5.6: (type1, size1, mode1, type2, size2, mode2) per opcode.
+    """
+    table = [(RUN, 0, 0, NOOP, 0, 0)]
+    table += [(ADD, size, 0, NOOP, 0, 0) for size in range(18)]
+    for mode in range(9):
+        table.append((COPY, 0, mode, NOOP, 0, 0))
+        table += [(COPY, size, mode, NOOP, 0, 0) for size in range(4, 19)]
+    for mode in range(6):
+        table += [(ADD, add, 0, COPY, copy, mode) for add in range(1, 5) for copy in range(4, 7)]
+    for mode in range(6, 9):
+        table += [(ADD, add, 0, COPY, 4, mode) for add in range(1, 5)]
+    table += [(COPY, 4, mode, ADD, 1, 0) for mode in range(9)]
+    return table
+
+
+CODE_TABLE = _default_code_table()
+
+
+class _Reader(object):
+    def __init__(self, buf, offset=0, end=None):
+        self.buf = buf
+        self.offset = offset
+        self.end = len(buf) if end is None else end
+
+    def byte(self):
+        if self.offset >= self.end:
+            raise VcdiffError("Unexpected end of delta at offset {}".format(self.offset))
+        value = self.buf[self.offset]
+        self.offset += 1
+        return value
+
+    def integer(self):
+        value = 0
+        for _ in range(10):
+            byte = self.byte()
+            value = (value << 7) | (byte & 0x7f)
+            if not byte & 0x80:
+                return value
+        raise VcdiffError("Integer overflow at offset {}".format(self.offset))
+
+    def take(self, n):
+        end = self.offset + n
+        if end > self.end:
+            raise VcdiffError("Unexpected end of delta at offset {}".format(self.offset))
+        data = self.buf[self.offset:end]
+        self.offset = end
+        return data
+
+    def done(self):
+        return self.offset >= self.end
+
+
+class _AddressCache(object):
+    def __init__(self):
+        self.near = [0] * NEAR_SIZE
+        self.next_slot = 0
+        self.same = [0] * (SAME_SIZE * 256)
+
+    def decode(self, here, mode, addrs):
+        if mode == 0:
+            addr = addrs.integer()
+        elif mode == 1:
+            addr = here - addrs.integer()
+        elif mode < 2 + NEAR_SIZE:
+            addr = self.near[mode - 2] + addrs.integer()
+        else:
+            addr = self.same[(mode - 2 - NEAR_SIZE) * 256 + addrs.byte()]
+        self.near[self.next_slot] = addr
+        self.next_slot = (self.next_slot + 1) % NEAR_SIZE
+        self.same[addr % (SAME_SIZE * 256)] = addr
+        return addr
+
+
+def _map(fh):
+    try:
+        return mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:  # Empty file
+        return b""
+
+
+def _decode_window(delta, source, length):
+    """
+    Executes the instructions of one window and returns the target window.
+    source is the source segment the window's COPYs refer to.
+    """
+    data_length = delta.integer()
+    inst_length = delta.integer()
+    addr_length = delta.integer()
+    checksum = None
+    if delta.window_indicator & VCD_ADLER32:
+        checksum = int.from_bytes(delta.take(4), "big")
+
+    data = _Reader(delta.buf, delta.offset, delta.offset + data_length)
+    insts = _Reader(delta.buf, data.end, data.end + inst_length)
+    addrs = _Reader(delta.buf, insts.end, insts.end + addr_length)
+    if addrs.end > delta.end:
+        raise VcdiffError("Window sections exceed the delta")
+    delta.offset = addrs.end
+
+    target = bytearray()
+    cache = _AddressCache()
+    source_length = len(source)
+
+    while not insts.done():
+        opcode = insts.byte()
+        for kind, size, mode in (CODE_TABLE[opcode][:3], CODE_TABLE[opcode][3:]):
+            if kind == NOOP:
+                continue
+            if size == 0:
+                size = insts.integer()
+
+            if kind == ADD:
+                target += data.take(size)
+            elif kind == RUN:
+                target += data.take(1) * size
+            else:
+                addr = cache.decode(source_length + len(target), mode, addrs)
+                if addr + size <= source_length:
+                    target += source[addr:addr + size]
+                    continue
+                if addr < source_length:
+                    # Straddles the end of the source segment
+                    head = source_length - addr
+                    target += source[addr:]
+                    addr, size = source_length, size - head
+                # From the target window itself, possibly overlapping what's being written
+                start = addr - source_length
+                if start >= len(target):
+                    raise VcdiffError("COPY from beyond the target window")
+                while size > 0:
+                    chunk = target[start:min(start + size, len(target))]
+                    target += chunk
+                    start += len(chunk)
+                    size -= len(chunk)
+
+    if len(target) != length:
+        raise VcdiffError("Window decoded to {} bytes instead of {}".format(len(target), length))
+    if checksum is not None and zlib.adler32(bytes(target)) != checksum:
+        raise VcdiffError("Window checksum mismatch")
+    return target
+
+
+class _Delta(_Reader):
+    window_indicator = 0
+
+
+def _decode(source, patch, out):
+    delta = _Delta(patch)
+    if bytes(delta.take(3)) != MAGIC:
+        raise VcdiffError("Not a VCDIFF delta")
+    delta.byte()  # Version
+    indicator = delta.byte()
+    if indicator & VCD_DECOMPRESS:
+        raise VcdiffUnsupported("Secondary compression isn't supported")
+    if indicator & VCD_CODETABLE:
+        raise VcdiffUnsupported("Custom code tables aren't supported")
+    if indicator & VCD_APPHEADER:
+        delta.take(delta.integer())
+
+    written = 0
+    while not delta.done():
+        delta.window_indicator = delta.byte()
+        segment = b""
+        if delta.window_indicator & (VCD_SOURCE | VCD_TARGET):
+            segment_length = delta.integer()
+            segment_position = delta.integer()
+            if delta.window_indicator & VCD_SOURCE:
+                if segment_position + segment_length > len(source):
+                    raise VcdiffError("Source segment exceeds the source file")
+                # A view, so the segment isn't copied out of the memory map
+                segment = memoryview(source)[segment_position:segment_position + segment_length]
+            else:
+                if segment_position + segment_length > written:
+                    raise VcdiffError("Target segment exceeds the decoded data")
+                out.flush()
+                out.seek(segment_position)
+                segment = out.read(segment_length)
+                out.seek(written)
+
+        delta_length = delta.integer()
+        window_end = delta.offset + delta_length
+        target_length = delta.integer()
+        if delta.byte() != 0:
+            raise VcdiffUnsupported("Secondary compression isn't supported")
+
+        end, delta.end = delta.end, window_end
+        try:
+            target = _decode_window(delta, segment, target_length)
+        finally:
+            if isinstance(segment, memoryview):
+                segment.release()
+        delta.end = end
+        if delta.offset != window_end:
+            raise VcdiffError("Window length mismatch")
+
+        out.write(target)
+        written += len(target)
+    return written
+
+
+def decode(source, patch, destination):
+    """
+    Applies the VCDIFF delta in the file patch to the file source, and atomically
+    writes the result to destination (which may be source itself).
+    Returns the size of the result.
+    """
+    directory = os.path.dirname(os.path.abspath(destination))
+    fd, tmp = tempfile.mkstemp(prefix=os.path.basename(destination) + ".", suffix=".patching", dir=directory)
+    try:
+        with open(source, "rb") as src, open(patch, "rb") as pfh, os.fdopen(fd, "w+b") as out:
+            source_map = _map(src)
+            patch_map = _map(pfh)
+            try:
+                written = _decode(source_map, patch_map, out)
+            finally:
+                for buf in (source_map, patch_map):
+                    if isinstance(buf, mmap.mmap):
+                        buf.close()
+            out.flush()
+            os.fsync(out.fileno())
+        if os.path.exists(destination):
+            shutil.copymode(destination, tmp)
+        os.replace(tmp, destination)
+    except:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return written
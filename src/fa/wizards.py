@@ -1,5 +1,6 @@
 from PyQt5 import QtWidgets, QtCore
 from fa.path import validatePath, typicalSupComPaths, typicalForgedAlliancePaths
+from fa import maps
 
 import util
 
@@ -167,6 +168,7 @@ class Wizard(QtWidgets.QWizard):
 
     def accept(self):
         util.settings.setValue("ForgedAlliance/app/path", self.upgrade.comboBox.currentText())
+        maps.registry().refresh()  # The base maps folder moved along
         QtWidgets.QWizard.accept(self)
 
 
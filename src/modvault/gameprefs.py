@@ -0,0 +1,103 @@
+"""
+Reading and writing the active mods in FA's game.prefs.
+
+game.prefs easily grows to tens of thousands of lines, but all the client
+cares about is its active_mods table. The lua parser finds that table once
+per change of the file (noticed by its size and mtime), skipping over the
+rest, and setting the active mods replaces just its source text. The result is written to a temporary
+file and renamed over game.prefs, so FA never sees it half written.
+"""
+import os
+
+from vault import luaparser
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def _signature(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+def findActiveMods(text):
+    """
+    Locates the top level active_mods table in the lua source text. Returns
+    its (start, end) span, from the name to the closing brace, and the keys
+    set to true in it. The span is None if there's no such table.
+    """
+    span, table = luaparser.findAssignment(text, "active_mods")
+    if not isinstance(table, dict) or not text.endswith("}", 0, span[1]):
+        return None, []     # Not a table, or an unterminated one, leave it be
+    return span, [uid for uid, active in table.items() if active == "true"]
+
+
+def formatActiveMods(uids):
+    s = "active_mods = {\n"
+    for uid in uids:
+        s += "['%s'] = true,\n" % str(uid)
+    s += "}"
+    return s
+
+
+class GamePrefs(object):
+    """
+    The active mods of the game.prefs file at path, cached until it changes.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._stamp = None
+        self._text = None
+        self._encoding = None
+        self._span = None
+        self._uids = []
+
+    def _load(self):
+        stamp = _signature(self.path)
+        if stamp == self._stamp:
+            return
+        with open(self.path, "rb") as fh:
+            data = fh.read()
+        try:
+            self._text, self._encoding = data.decode("utf-8"), "utf-8"
+        except UnicodeDecodeError:
+            self._text, self._encoding = data.decode("latin-1"), "latin-1"
+        self._span, self._uids = findActiveMods(self._text)
+        self._stamp = stamp
+
+    def activeMods(self):
+        """
+        Returns the uids of the active mods, [] if there's no game.prefs.
+        """
+        try:
+            self._load()
+        except FileNotFoundError:
+            return []
+        return list(self._uids)
+
+    def setActiveMods(self, uids):
+        """
+        Replaces the active mods with uids. Raises IOError if game.prefs can't be read or written.
+        """
+        self._load()
+        table = formatActiveMods(uids)
+        if self._span is not None:
+            start, end = self._span
+            text = self._text[:start] + table + self._text[end:]
+        else:
+            start = len(self._text) + 1
+            text = self._text + "\n" + table
+
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "wb") as fh:
+                fh.write(text.encode(self._encoding, "replace"))
+            os.replace(tmp, self.path)
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self._text = text
+        self._span = (start, start + len(table))
+        self._uids = [str(uid) for uid in uids]
+        self._stamp = _signature(self.path)
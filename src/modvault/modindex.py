@@ -0,0 +1,61 @@
+"""
+Persistent index of the installed mods' mod_info.lua contents.
+
+Parsing every mod_info.lua (and opening every zipped mod) whenever the mod
+list is needed gets slow with many mods installed. The index remembers the
+parsed info of each mod folder or archive, together with the size and mtime of
+the file it was read from, so only mods that changed since are parsed again.
+"""
+import os
+
+from util.jsonstore import JsonStore
+
+INDEX_VERSION = 1
+
+
+def signature(path):
+    """
+    What identifies a version of the file at path, None if it doesn't exist.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+class ModIndex(JsonStore):
+    """
+    Entries are mod folder or zip name -> {'stat': signature, 'info': ModInfo arguments}.
+    """
+    VERSION = INDEX_VERSION
+    KEY = 'mods'
+    WHAT = 'mod index'
+
+    def __contains__(self, name):
+        return name in self._entries
+
+    def get(self, name, stamp, default=None):
+        """
+        Returns the info stored for name if it was read from the same version of the file, else default.
+        The info of a mod that couldn't be read is None.
+        """
+        entry = self._entries.get(name)
+        if entry is None or stamp is None or entry['stat'] != stamp:
+            return default
+        return entry['info']
+
+    def put(self, name, stamp, info):
+        self._entries[name] = {'stat': stamp, 'info': info}
+        self._dirty = True
+
+    def discard(self, name):
+        if self._entries.pop(name, None) is not None:
+            self._dirty = True
+
+    def prune(self, names):
+        """
+        Forgets all mods but those in names.
+        """
+        for name in set(self._entries) - set(names):
+            self.discard(name)
@@ -10,6 +10,7 @@ from util import PREFSFILENAME
 import util
 import logging
 from vault import luaparser
+from modvault import gameprefs, modindex
 import warnings
 
 import io
@@ -72,7 +73,8 @@ def getAllModFolders():  # returns a list of names of installed mods
 
 def getInstalledMods():
     installedMods[:] = []
-    for f in getAllModFolders():
+    folders = getAllModFolders()
+    for f in folders:
         m = None
         if os.path.isdir(os.path.join(MODFOLDER, f)):
             try:
@@ -86,6 +88,8 @@ def getInstalledMods():
                 continue
         if m:
             installedMods.append(m)
+    modIndex().prune(folders)
+    modIndex().save()
     logger.debug("getting installed mods. Count: %d" % len(installedMods))
     return installedMods
 
@@ -150,60 +154,95 @@ def parseModInfo(folder):
     modinfofile = luaparser.luaParser(os.path.join(folder,"mod_info.lua"))
     return getModInfo(modinfofile)
 
+# ModInfos read this session, keyed by folder or zip name, with the signature they were read from
 modCache = {}
 
+MOD_INDEX = os.path.join(util.CACHE_DIR, "mods.json")
+_modIndex = None
+_gamePrefs = None
 
-def getModInfoFromZip(zfile):
-    """get the mod info from a zip file"""
-    if zfile in modCache:
-        return modCache[zfile]
-
-    r = None
-    if zipfile.is_zipfile(os.path.join(MODFOLDER, zfile)):
-        zip = zipfile.ZipFile(os.path.join(MODFOLDER,zfile), "r", zipfile.ZIP_DEFLATED)
-        if zip.testzip() is None:
-            for member in zip.namelist():
-                filename = os.path.basename(member)
-                if not filename:
-                    continue
-                if filename == "mod_info.lua":
-                    modinfofile = luaparser.luaParser("mod_info.lua")
-                    modinfofile.iszip = True
-                    modinfofile.zip = zip
-                    r = getModInfo(modinfofile)
-    if r is None:
-        logger.debug("mod_info.lua not found in zip file %s" % zfile)
-        return None
-    f, info = r
-    if f.error:
-        logger.debug("Error in parsing mod_info.lua in %s" % zfile)
-        return None
-    m = ModInfo(**info)
-    m.setFolder(zfile)
-    m.update()
-    modCache[zfile] = m
-    return m
+# What the index returns for mods it doesn't know (None means known to be broken)
+_UNKNOWN = object()
 
 
-def getModInfoFromFolder(modfolder):  # modfolder must be local to MODFOLDER
-    if modfolder in modCache:
-        return modCache[modfolder]
+def gamePrefs():
+    global _gamePrefs
+    if _gamePrefs is None:
+        _gamePrefs = gameprefs.GamePrefs(PREFSFILENAME)
+    return _gamePrefs
+
+
+def modIndex():
+    global _modIndex
+    if _modIndex is None:
+        _modIndex = modindex.ModIndex(MOD_INDEX)
+    return _modIndex
+
 
+def _modInfoFromZip(zfile):
+    try:
+        zip = zipfile.ZipFile(os.path.join(MODFOLDER, zfile), "r")
+    except zipfile.BadZipFile:
+        return None
+    with zip:
+        # Only mod_info.lua itself is read, the rest of the archive isn't decompressed
+        for member in zip.namelist():
+            if os.path.basename(member) == "mod_info.lua":
+                modinfofile = luaparser.luaParser("mod_info.lua")
+                modinfofile.iszip = True
+                modinfofile.zip = zip
+                return getModInfo(modinfofile)
+    logger.debug("mod_info.lua not found in zip file %s" % zfile)
+    return None
+
+
+def _modInfoFromFolder(modfolder):
     r = parseModInfo(os.path.join(MODFOLDER, modfolder))
     if r is None:
         logger.debug("mod_info.lua not found in %s folder" % modfolder)
+    return r
+
+
+def _getModInfo(name, stamp, parse):
+    """
+    Returns the ModInfo for the mod folder or zip name, from the session cache,
+    the mod index, or parse(name) if it changed since it was last read.
+    """
+    cached = modCache.get(name)
+    if cached is not None and stamp is not None and cached[0] == stamp:
+        return cached[1]
+
+    info = modIndex().get(name, stamp, _UNKNOWN)
+    if info is _UNKNOWN:
+        info = None
+        r = parse(name)
+        if r is not None:
+            f, info = r
+            if f.error:
+                logger.debug("Error in parsing mod_info.lua of %s" % name)
+                info = None
+        if stamp is not None:
+            modIndex().put(name, stamp, info)
+    if info is None:
         return None
-    f, info = r
-    if f.error:
-        logger.debug("Error in parsing %s/mod_info.lua" % modfolder)
-        return None
+
     m = ModInfo(**info)
-    m.setFolder(modfolder)
+    m.setFolder(name)
     m.update()
-    modCache[modfolder] = m
+    modCache[name] = (stamp, m)
     return m
 
 
+def getModInfoFromZip(zfile):
+    """get the mod info from a zip file"""
+    return _getModInfo(zfile, modindex.signature(os.path.join(MODFOLDER, zfile)), _modInfoFromZip)
+
+
+def getModInfoFromFolder(modfolder):  # modfolder must be local to MODFOLDER
+    stamp = modindex.signature(os.path.join(MODFOLDER, modfolder, "mod_info.lua"))
+    return _getModInfo(modfolder, stamp, _modInfoFromFolder)
+
+
 def getActiveMods(uimods=None, temporary=True):  # returns a list of ModInfo's containing information of the mods
     """uimods:
         None - return all active mods
@@ -218,13 +257,11 @@ def getActiveMods(uimods=None, temporary=True):  # returns a list of ModInfo's c
             logger.info("No game.prefs file found")
             return []
         if temporary:
-            l = luaparser.luaParser(PREFSFILENAME)
-            l.loweringKeys = False
-            modlist = l.parse({"active_mods":"active_mods"}, {"active_mods": {}})["active_mods"]
-            if l.error:
+            try:
+                uids = gamePrefs().activeMods()
+            except IOError:
                 logger.info("Error in reading the game.prefs file")
                 return []
-            uids = [uid for uid,b in list(modlist.items()) if b == 'true']
             #logger.debug("Active mods detected: %s" % str(uids))
         else:
             uids = selectedMods[:]
@@ -256,10 +293,6 @@ def setActiveMods(mods, keepuimods=True, temporary=True):  # uimods works the sa
         keepTheseMods = []
     allmods = keepTheseMods + mods
     logger.debug('setting active Mods: {}'.format([mod.uid for mod in allmods]))
-    s = "active_mods = {\n"
-    for mod in allmods:
-        s += "['%s'] = true,\n" % str(mod.uid)
-    s += "}"
 
     if not temporary:
         global selectedMods
@@ -270,27 +303,10 @@ def setActiveMods(mods, keepuimods=True, temporary=True):  # uimods works the sa
         logger.debug('selectedMods written: {}'.format(Settings.get('play/mods')))
 
     try:
-        f = open(PREFSFILENAME, 'r')
-        data = f.read()
-    except:
-        logger.info("Couldn't read the game.prefs file")
-        return False
-    else:
-        f.close()
-
-    if re.search("active_mods\s*=\s*{.*?}", data, re.S):
-        data = re.sub("active_mods\s*=\s*{.*?}", s, data, 1, re.S)
-    else:
-        data += "\n" + s
-
-    try:
-        f = open(PREFSFILENAME, 'w')
-        f.write(data)
-    except:
+        gamePrefs().setActiveMods([mod.uid for mod in allmods])
+    except IOError:
         logger.info("Cound't write to the game.prefs file")
         return False
-    else:
-        f.close()
 
     return True
 
@@ -399,6 +415,7 @@ def removeMod(mod):
     shutil.rmtree(real.absfolder)
     if real.localfolder in modCache:
         del modCache[real.localfolder]
+    modIndex().discard(real.localfolder)
     installedMods.remove(real)
     return True
     # we don't update the installed mods, because the operating system takes
@@ -7,7 +7,6 @@ import os
 import fa
 import time
 import client
-import json
 
 import logging
 logger = logging.getLogger(__name__)
@@ -19,6 +18,8 @@ LIVEREPLAY_DELAY_QTIMER = LIVEREPLAY_DELAY * 60000  # livereplay delay for Qtime
 from replays.replayitem import ReplayItem, ReplayItemDelegate
 from model.game import GameState
 from replays.connection import ReplaysConnection
+from replays.localreplaysmodel import LocalReplaysModel
+from fa.mappreviews import PreviewResolver
 
 # Replays uses the new Inheritance Based UI creation pattern
 # This allows us to do all sorts of awesome stuff by overriding methods etc.
@@ -225,23 +226,31 @@ class LiveReplaysWidgetHandler(object):
 
 
 class LocalReplaysWidgetHandler(object):
-    def __init__(self, myTree):
+    def __init__(self, myTree, client):
+        # Superseded by the replay catalog
+        legacy_cache = os.path.join(util.CACHE_DIR, "local_replays_metadata")
+        if os.path.exists(legacy_cache):
+            os.remove(legacy_cache)
+
+        self.previews = PreviewResolver(client.downloader)
+        self.model = LocalReplaysModel(os.path.join(util.CACHE_DIR, "local_replays.sqlite"),
+                                       util.REPLAY_DIR, self.previews)
+
         self.myTree = myTree
-        self.myTree.itemDoubleClicked.connect(self.myTreeDoubleClicked)
-        self.myTree.itemPressed.connect(self.myTreePressed)
+        self.myTree.setModel(self.model)
+        self.myTree.doubleClicked.connect(self.myTreeDoubleClicked)
+        self.myTree.pressed.connect(self.myTreePressed)
         self.myTree.header().setSectionResizeMode(0, QtWidgets.QHeaderView.ResizeToContents)
         self.myTree.header().setSectionResizeMode(1, QtWidgets.QHeaderView.ResizeToContents)
         self.myTree.header().setSectionResizeMode(2, QtWidgets.QHeaderView.Stretch)
         self.myTree.header().setSectionResizeMode(3, QtWidgets.QHeaderView.ResizeToContents)
 
-    def myTreePressed(self, item):
+    def myTreePressed(self, index):
         if QtWidgets.QApplication.mouseButtons() != QtCore.Qt.RightButton:
             return
 
-        if item.isDisabled():
-            return
-
-        if self.myTree.indexOfTopLevelItem(item) != -1:
+        entry = self.model.entry(index)
+        if entry is None:
             return
 
         menu = QtWidgets.QMenu(self.myTree)
@@ -255,157 +264,23 @@ class LocalReplaysWidgetHandler(object):
         menu.addAction(actionExplorer)
 
         # Triggers
-        actionReplay.triggered.connect(lambda: self.myTreeDoubleClicked(item))
-        actionExplorer.triggered.connect(lambda: util.showFileInFileBrowser(item.filename))
-
-        # Adding to menu
-        menu.addAction(actionReplay)
-        menu.addAction(actionExplorer)
+        actionReplay.triggered.connect(lambda: self.myTreeDoubleClicked(index))
+        actionExplorer.triggered.connect(lambda: util.showFileInFileBrowser(entry.filename))
 
         # Finally: Show the popup
         menu.popup(QtGui.QCursor.pos())
 
-    def myTreeDoubleClicked(self, item):
-        if item.isDisabled():
-            return
-
-        if self.myTree.indexOfTopLevelItem(item) == -1:
-            replay(item.filename)
+    def myTreeDoubleClicked(self, index):
+        entry = self.model.entry(index)
+        if entry is not None:
+            replay(entry.filename)
 
     def updatemyTree(self):
-        self.myTree.clear()
-
-        # We put the replays into buckets by day first, then we add them to the treewidget.
-        buckets = {}
+        self.model.refresh()
 
-        cache = self.loadLocalCache()
-        cache_add = {}
-        cache_hit = {}
-        # Iterate
-        for infile in os.listdir(util.REPLAY_DIR):
-            if infile.endswith(".scfareplay"):
-                bucket = buckets.setdefault("legacy", [])
-
-                item = QtWidgets.QTreeWidgetItem()
-                item.setText(1, infile)
-                item.filename = os.path.join(util.REPLAY_DIR, infile)
-                item.setIcon(0, util.THEME.icon("replays/replay.png"))
-                item.setForeground(0, QtGui.QColor(client.instance.player_colors.getColor("default")))
-
-                bucket.append(item)
-
-            elif infile.endswith(".fafreplay"):
-                item = QtWidgets.QTreeWidgetItem()
-                try:
-                    item.filename = os.path.join(util.REPLAY_DIR, infile)
-                    basename = os.path.basename(item.filename)
-                    if basename in cache:
-                        oneline = cache[basename]
-                        cache_hit[basename] = oneline
-                    else:
-                        with open(item.filename, "rt") as fh:
-                            oneline = fh.readline()
-                            cache_add[basename] = oneline
-
-                    item.info = json.loads(oneline)
-
-                    # Parse replayinfo into data
-                    if item.info.get('complete', False):
-                        t = time.localtime(item.info.get('launched_at', item.info.get('game_time', time.time())))
-                        game_date = time.strftime("%Y-%m-%d", t)
-                        game_hour = time.strftime("%H:%M", t)
-
-                        bucket = buckets.setdefault(game_date, [])
-
-                        icon = fa.maps.preview(item.info['mapname'])
-                        if icon:
-                            item.setIcon(0, icon)
-                        else:
-                            client.instance.downloader.downloadMap(item.info['mapname'], item, True)
-                            item.setIcon(0, util.THEME.icon("games/unknown_map.png"))
-                        item.setToolTip(0, fa.maps.getDisplayName(item.info['mapname']))
-                        item.setText(0, game_hour)
-                        item.setForeground(0, QtGui.QColor(client.instance.player_colors.getColor("default")))
-
-                        item.setText(1, item.info['title'])
-                        item.setToolTip(1, infile)
-
-                        # Hacky way to quickly assemble a list of all the players, but including the observers
-                        playerlist = []
-                        for _, players in list(item.info['teams'].items()):
-                            playerlist.extend(players)
-                        item.setText(2, ", ".join(playerlist))
-                        item.setToolTip(2, ", ".join(playerlist))
-
-                        # Add additional info
-                        item.setText(3, item.info['featured_mod'])
-                        item.setTextAlignment(3, QtCore.Qt.AlignCenter)
-                    else:
-                        bucket = buckets.setdefault("incomplete", [])
-                        item.setIcon(0, util.THEME.icon("replays/replay.png"))
-                        item.setText(1, infile)
-                        item.setText(2, "(replay doesn't have complete metadata)")
-                        item.setForeground(1, QtGui.QColor("yellow"))  # FIXME: Needs to come from theme
-
-                except Exception as ex:
-                    bucket = buckets.setdefault("broken", [])
-                    item.setIcon(0, util.THEME.icon("replays/broken.png"))
-                    item.setText(1, infile)
-                    item.setForeground(1, QtGui.QColor("red"))   # FIXME: Needs to come from theme
-                    item.setText(2, "(replay parse error)")
-                    item.setForeground(2, QtGui.QColor("gray"))  # FIXME: Needs to come from theme
-                    logger.exception("Exception parsing replay {}: {}".format(infile, ex))
-
-                bucket.append(item)
-
-        if len(cache_add) > 10 or len(cache) - len(cache_hit) > 10:
-            self.saveLocalCache(cache_hit, cache_add)
-        # Now, create a top level treewidgetitem for every bucket, and put the bucket's contents into them
-        for bucket in buckets.keys():
-            bucket_item = QtWidgets.QTreeWidgetItem()
-
-            if bucket == "broken":
-                bucket_item.setForeground(0, QtGui.QColor("red"))  # FIXME: Needs to come from theme
-                bucket_item.setText(1, "(not watchable)")
-                bucket_item.setForeground(1, QtGui.QColor(client.instance.player_colors.getColor("default")))
-            elif bucket == "incomplete":
-                bucket_item.setForeground(0, QtGui.QColor("yellow"))  # FIXME: Needs to come from theme
-                bucket_item.setText(1, "(watchable)")
-                bucket_item.setForeground(1, QtGui.QColor(client.instance.player_colors.getColor("default")))
-            elif bucket == "legacy":
-                bucket_item.setForeground(0, QtGui.QColor(client.instance.player_colors.getColor("default")))
-                bucket_item.setForeground(1, QtGui.QColor(client.instance.player_colors.getColor("default")))
-                bucket_item.setText(1, "(old replay system)")
-            else:
-                bucket_item.setForeground(0, QtGui.QColor(client.instance.player_colors.getColor("player")))
-
-            bucket_item.setIcon(0, util.THEME.icon("replays/bucket.png"))
-            bucket_item.setText(0, bucket)
-            bucket_item.setText(3, str(len(buckets[bucket])) + " replays")
-            bucket_item.setForeground(3, QtGui.QColor(client.instance.player_colors.getColor("default")))
-
-            self.myTree.addTopLevelItem(bucket_item)
-            #self.myTree.setFirstItemColumnSpanned(bucket_item, True)
-
-            for replay in buckets[bucket]:
-                bucket_item.addChild(replay)
-
-    def loadLocalCache(self):
-        cache_fname = os.path.join(util.CACHE_DIR, "local_replays_metadata")
-        cache = {}
-        if os.path.exists(cache_fname):
-            with open(cache_fname, "rt") as fh:
-                for line in fh:
-                    filename, metadata = line.split(':', 1)
-                    cache[filename] = metadata
-        return cache
-
-    def saveLocalCache(self, cache_hit, cache_add):
-        with open(os.path.join(util.CACHE_DIR, "local_replays_metadata"), "wt") as fh:
-            for filename, metadata in cache_hit.items():
-                fh.write(filename + ":" + metadata)
-            for filename, metadata in cache_add.items():
-                fh.write(filename + ":" + metadata)
+    def stop(self):
+        self.model.stop()
+        self.previews.stop()
 
 
 class ReplayVaultWidgetHandler(object):
@@ -628,12 +503,15 @@ class ReplaysWidget(BaseClass, FormClass):
 
         self.liveManager = LiveReplaysWidgetHandler(self.liveTree, self.client,
                                                     gameset)
-        self.localManager = LocalReplaysWidgetHandler(self.myTree)
+        self.localManager = LocalReplaysWidgetHandler(self.myTree, self.client)
         self.vaultManager = ReplayVaultWidgetHandler(self, dispatcher, client,
                                                      playerset)
 
         logger.info("Replays Widget instantiated.")
 
+    def stop(self):
+        self.localManager.stop()
+
     def focusEvent(self, event):
         self.localManager.updatemyTree()
         self.vaultManager.reloadView()
@@ -0,0 +1,339 @@
+from PyQt5 import QtCore, QtGui
+from PyQt5.QtCore import Qt, QModelIndex
+
+import util
+import client
+import fa
+from replays.replaycatalog import LocalReplayCatalog, BUCKET_BROKEN, BUCKET_INCOMPLETE, BUCKET_LEGACY
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Number of replays loaded from the catalog at once when a bucket is expanded
+FETCH_CHUNK = 100
+
+
+class CatalogRefreshThread(QtCore.QThread):
+    """
+    Brings the replay catalog up to date off the GUI thread.
+    SQLite connections can't be shared between threads, so this uses its own.
+    """
+    refreshed = QtCore.pyqtSignal(list)
+
+    def __init__(self, dbpath, directory, *args, **kwargs):
+        QtCore.QThread.__init__(self, *args, **kwargs)
+        self._dbpath = dbpath
+        self._directory = directory
+
+    def run(self):
+        try:
+            catalog = LocalReplayCatalog(self._dbpath, self._directory)
+            try:
+                catalog.refresh()
+                buckets = _signedBuckets(catalog)
+            finally:
+                catalog.close()
+        except:
+            logger.exception("Failed to refresh the local replay catalog")
+            return
+        self.refreshed.emit(buckets)
+
+
+def _signedBuckets(catalog):
+    """ (bucket, replay count, signature) of the buckets in catalog """
+    signatures = catalog.signatures()
+    return [(name, count, signatures.get(name)) for name, count in catalog.buckets()]
+
+
+class _Bucket(object):
+    def __init__(self, name, count, signature):
+        self.name = name
+        self.count = count
+        self.signature = signature  # Changes with the replays in the bucket
+        self.entries = []
+
+
+class LocalReplaysModel(QtCore.QAbstractItemModel):
+    """
+    Two-level model of the local replays: day buckets, and the replays in them.
+
+    Bucket children are only read from the catalog when the view asks for them
+    (i.e. when a bucket gets expanded), FETCH_CHUNK at a time. Map previews are
+    resolved asynchronously and filled in as they arrive, previews that couldn't
+    be found are asked for again after the next refresh.
+    """
+    COLUMNS = 4
+
+    def __init__(self, dbpath, directory, previews, *args, **kwargs):
+        QtCore.QAbstractItemModel.__init__(self, *args, **kwargs)
+        self._dbpath = dbpath
+        self._directory = directory
+        self._catalog = LocalReplayCatalog(dbpath, directory)
+        # Show whatever we catalogued last time right away, refresh() catches up later
+        self._buckets = [_Bucket(*bucket) for bucket in _signedBuckets(self._catalog)]
+
+        self._previews = previews
+        self._previews.previewReady.connect(self._atPreviewReady)
+        self._icons = {}
+        self._failedIcons = set()
+        self._iconRows = {}     # mapname: {(bucket, row)} of the loaded replays on that map
+
+        self._refreshThread = None
+
+    def refresh(self):
+        """
+        Rescans the replay folder in the background. The model is updated
+        once the scan is done, and only if something changed.
+        """
+        if self._refreshThread is not None:
+            return
+        self._refreshThread = CatalogRefreshThread(self._dbpath, self._directory)
+        self._refreshThread.refreshed.connect(self._atRefreshed)
+        self._refreshThread.finished.connect(self._atRefreshFinished)
+        self._refreshThread.start()
+
+    def stop(self):
+        if self._refreshThread is not None:
+            self._refreshThread.wait()
+        self._catalog.close()
+
+    @QtCore.pyqtSlot()
+    def _atRefreshFinished(self):
+        self._refreshThread = None
+
+    @QtCore.pyqtSlot(list)
+    def _atRefreshed(self, buckets):
+        """
+        Applies the refreshed buckets row by row, so buckets that didn't change
+        stay expanded and the view keeps its place.
+        """
+        # Maps whose previews failed get another try
+        for mapname in self._failedIcons:
+            self._icons.pop(mapname, None)
+        self._failedIcons.clear()
+
+        names = {name for name, _, _ in buckets}
+        for row in reversed(range(len(self._buckets))):
+            if self._buckets[row].name not in names:
+                self.beginRemoveRows(QModelIndex(), row, row)
+                self._forget(self._buckets.pop(row))
+                self.endRemoveRows()
+
+        for row, (name, count, signature) in enumerate(buckets):
+            current = [b.name for b in self._buckets]
+            if row < len(current) and current[row] == name:
+                self._update(row, count, signature)
+                continue
+            if name in current:
+                # Moved, take it out and put it back in place
+                old = current.index(name)
+                self.beginRemoveRows(QModelIndex(), old, old)
+                self._forget(self._buckets.pop(old))
+                self.endRemoveRows()
+            self.beginInsertRows(QModelIndex(), row, row)
+            self._buckets.insert(row, _Bucket(name, count, signature))
+            self.endInsertRows()
+
+    def _update(self, row, count, signature):
+        bucket = self._buckets[row]
+        if bucket.signature == signature:
+            return
+        parent = self.index(row, 0)
+        loaded = len(bucket.entries)
+        if loaded:
+            self.beginRemoveRows(parent, 0, loaded - 1)
+            self._forget(bucket)
+            bucket.entries = []
+            self.endRemoveRows()
+        bucket.count = count
+        bucket.signature = signature
+        self.dataChanged.emit(parent, self.index(row, self.COLUMNS - 1))
+        if loaded:
+            # It's expanded, show its replays again
+            self.fetchMore(parent)
+
+    def _forget(self, bucket):
+        """ Drops the loaded replays of bucket from the preview lookup """
+        for row, entry in enumerate(bucket.entries):
+            rows = self._iconRows.get(entry.mapname)
+            if rows is not None:
+                rows.discard((bucket, row))
+
+    def entry(self, index):
+        """
+        Returns the LocalReplayEntry at index, or None for buckets.
+        """
+        if not index.isValid():
+            return None
+        bucket = index.internalPointer()
+        if bucket is None:
+            return None
+        return bucket.entries[index.row()]
+
+    def isBucket(self, index):
+        return index.isValid() and index.internalPointer() is None
+
+    # QAbstractItemModel interface
+
+    def index(self, row, column, parent=QModelIndex()):
+        if not self.hasIndex(row, column, parent):
+            return QModelIndex()
+        if not parent.isValid():
+            return self.createIndex(row, column, None)
+        return self.createIndex(row, column, self._buckets[parent.row()])
+
+    def parent(self, index):
+        if not index.isValid():
+            return QModelIndex()
+        bucket = index.internalPointer()
+        if bucket is None:
+            return QModelIndex()
+        return self.createIndex(self._buckets.index(bucket), 0, None)
+
+    def rowCount(self, parent=QModelIndex()):
+        if not parent.isValid():
+            return len(self._buckets)
+        if self.isBucket(parent) and parent.column() == 0:
+            return len(self._buckets[parent.row()].entries)
+        return 0
+
+    def columnCount(self, parent=QModelIndex()):
+        return self.COLUMNS
+
+    def hasChildren(self, parent=QModelIndex()):
+        if not parent.isValid():
+            return len(self._buckets) > 0
+        if self.isBucket(parent) and parent.column() == 0:
+            return self._buckets[parent.row()].count > 0
+        return False
+
+    def canFetchMore(self, parent):
+        if not self.isBucket(parent):
+            return False
+        bucket = self._buckets[parent.row()]
+        return len(bucket.entries) < bucket.count
+
+    def fetchMore(self, parent):
+        if not self.canFetchMore(parent):
+            return
+        bucket = self._buckets[parent.row()]
+        entries = self._catalog.bucket(bucket.name, len(bucket.entries), FETCH_CHUNK)
+        if not entries:
+            # Catalog changed under us, a refresh will fix it
+            bucket.count = len(bucket.entries)
+            return
+        first = len(bucket.entries)
+        self.beginInsertRows(parent, first, first + len(entries) - 1)
+        bucket.entries.extend(entries)
+        for row, entry in enumerate(entries, first):
+            self._iconRows.setdefault(entry.mapname, set()).add((bucket, row))
+        self.endInsertRows()
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.NoItemFlags
+        return Qt.ItemIsEnabled
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        bucket = index.internalPointer()
+        if bucket is None:
+            return self._bucketData(self._buckets[index.row()], index.column(), role)
+        return self._entryData(bucket.entries[index.row()], index.column(), role)
+
+    def _color(self, name):
+        return QtGui.QColor(client.instance.player_colors.getColor(name))
+
+    def _bucketData(self, bucket, column, role):
+        if role == Qt.DisplayRole:
+            if column == 0:
+                return bucket.name
+            elif column == 1:
+                return {BUCKET_BROKEN: "(not watchable)",
+                        BUCKET_INCOMPLETE: "(watchable)",
+                        BUCKET_LEGACY: "(old replay system)"}.get(bucket.name)
+            elif column == 3:
+                return str(bucket.count) + " replays"
+        elif role == Qt.DecorationRole and column == 0:
+            return util.THEME.icon("replays/bucket.png")
+        elif role == Qt.ForegroundRole:
+            if column == 0:
+                if bucket.name == BUCKET_BROKEN:
+                    return QtGui.QColor("red")  # FIXME: Needs to come from theme
+                elif bucket.name == BUCKET_INCOMPLETE:
+                    return QtGui.QColor("yellow")  # FIXME: Needs to come from theme
+                elif bucket.name == BUCKET_LEGACY:
+                    return self._color("default")
+                return self._color("player")
+            return self._color("default")
+        return None
+
+    def _entryData(self, entry, column, role):
+        if entry.bucket == BUCKET_LEGACY:
+            if role == Qt.DisplayRole and column == 1:
+                return entry.basename
+            elif role == Qt.DecorationRole and column == 0:
+                return util.THEME.icon("replays/replay.png")
+            elif role == Qt.ForegroundRole and column == 0:
+                return self._color("default")
+
+        elif entry.bucket == BUCKET_BROKEN:
+            if role == Qt.DisplayRole:
+                return {1: entry.basename, 2: "(replay parse error)"}.get(column)
+            elif role == Qt.DecorationRole and column == 0:
+                return util.THEME.icon("replays/broken.png")
+            elif role == Qt.ForegroundRole:
+                # FIXME: Needs to come from theme
+                return {1: QtGui.QColor("red"), 2: QtGui.QColor("gray")}.get(column)
+
+        elif entry.bucket == BUCKET_INCOMPLETE:
+            if role == Qt.DisplayRole:
+                return {1: entry.basename, 2: "(replay doesn't have complete metadata)"}.get(column)
+            elif role == Qt.DecorationRole and column == 0:
+                return util.THEME.icon("replays/replay.png")
+            elif role == Qt.ForegroundRole and column == 1:
+                return QtGui.QColor("yellow")  # FIXME: Needs to come from theme
+
+        else:
+            if role == Qt.DisplayRole:
+                if column == 0:
+                    return entry.game_hour
+                elif column == 1:
+                    return entry.title
+                elif column == 2:
+                    return ", ".join(entry.players)
+                elif column == 3:
+                    return entry.featured_mod
+            elif role == Qt.ToolTipRole:
+                if column == 0:
+                    return fa.maps.getDisplayName(entry.mapname)
+                elif column == 1:
+                    return entry.basename
+                elif column == 2:
+                    return ", ".join(entry.players)
+            elif role == Qt.DecorationRole and column == 0:
+                return self._mapIcon(entry.mapname)
+            elif role == Qt.ForegroundRole and column == 0:
+                return self._color("default")
+            elif role == Qt.TextAlignmentRole and column == 3:
+                return Qt.AlignCenter
+        return None
+
+    def _mapIcon(self, mapname):
+        icon = self._icons.get(mapname)
+        if icon is None:
+            self._previews.request(mapname)
+            return util.THEME.icon("games/unknown_map.png")
+        return icon
+
+    @QtCore.pyqtSlot(str, object)
+    def _atPreviewReady(self, mapname, icon):
+        if icon is None:
+            # Shown as unknown until the next refresh
+            icon = util.THEME.icon("games/unknown_map.png")
+            self._failedIcons.add(mapname)
+        self._icons[mapname] = icon
+        for bucket, row in self._iconRows.get(mapname, ()):
+            index = self.createIndex(row, 0, bucket)
+            self.dataChanged.emit(index, index, [Qt.DecorationRole])
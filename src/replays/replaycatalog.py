@@ -0,0 +1,243 @@
+"""
+Persistent, indexed catalog of the replays stored in the local replay folder.
+
+Every replay file is keyed by filename, and only re-read when its mtime or size
+changes. Bucketing by day and searching by map, player or featured mod are done
+with indexed queries instead of rescanning the folder.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+import logging
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION = 1
+
+# Special buckets for replays without a usable date
+BUCKET_LEGACY = "legacy"
+BUCKET_INCOMPLETE = "incomplete"
+BUCKET_BROKEN = "broken"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS replays (
+    filename TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    bucket TEXT NOT NULL,
+    launched_at REAL,
+    mapname TEXT,
+    title TEXT,
+    featured_mod TEXT,
+    players TEXT,
+    info TEXT
+);
+CREATE TABLE IF NOT EXISTS players (
+    filename TEXT NOT NULL REFERENCES replays(filename) ON DELETE CASCADE,
+    name TEXT NOT NULL COLLATE NOCASE
+);
+CREATE INDEX IF NOT EXISTS replays_bucket ON replays(bucket, launched_at);
+CREATE INDEX IF NOT EXISTS replays_mapname ON replays(mapname COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS replays_featured_mod ON replays(featured_mod);
+CREATE INDEX IF NOT EXISTS players_name ON players(name);
+CREATE INDEX IF NOT EXISTS players_filename ON players(filename);
+"""
+
+
+class LocalReplayEntry(object):
+    """
+    A single catalogued replay, as stored in the database.
+    """
+    def __init__(self, directory, row):
+        (self.basename, self.mtime, self.size, self.bucket, self.launched_at,
+         self.mapname, self.title, self.featured_mod, players, info) = row
+        self.filename = os.path.join(directory, self.basename)
+        self.players = players.split("\x00") if players else []
+        self._info = info
+
+    @property
+    def info(self):
+        return json.loads(self._info) if self._info else None
+
+    @property
+    def game_hour(self):
+        return time.strftime("%H:%M", time.localtime(self.launched_at))
+
+
+def parse_replay_metadata(basename, header):
+    """
+    Turns the first line of a .fafreplay into the column values of the catalog.
+    Returns a dict, with bucket set to BUCKET_BROKEN if the header is unusable.
+    """
+    entry = dict(bucket=BUCKET_BROKEN, launched_at=None, mapname=None, title=None,
+                 featured_mod=None, players=[], info=None)
+    if basename.endswith(".scfareplay"):
+        entry["bucket"] = BUCKET_LEGACY
+        return entry
+
+    try:
+        info = json.loads(header)
+    except ValueError:
+        logger.warning("Exception parsing replay {}".format(basename))
+        return entry
+
+    entry["info"] = header.strip()
+    if not info.get('complete', False):
+        entry["bucket"] = BUCKET_INCOMPLETE
+        return entry
+
+    try:
+        launched_at = info.get('launched_at', info.get('game_time', time.time()))
+        # Hacky way to quickly assemble a list of all the players, but including the observers
+        players = []
+        for _, team in list(info['teams'].items()):
+            players.extend(team)
+        entry.update(bucket=time.strftime("%Y-%m-%d", time.localtime(launched_at)),
+                     launched_at=launched_at,
+                     mapname=info['mapname'],
+                     title=info['title'],
+                     featured_mod=info['featured_mod'],
+                     players=players)
+    except (KeyError, TypeError, ValueError, AttributeError):
+        logger.warning("Replay {} has malformed metadata".format(basename))
+        entry["bucket"] = BUCKET_BROKEN
+    return entry
+
+
+class LocalReplayCatalog(object):
+    """
+    SQLite backed index of a replay directory.
+    """
+    def __init__(self, dbpath, directory):
+        self.directory = directory
+        self._db = sqlite3.connect(dbpath)
+        self._db.execute("PRAGMA foreign_keys = ON")
+        # The catalog is refreshed and read from different threads
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute("PRAGMA synchronous = NORMAL")
+        self._setup()
+
+    def _setup(self):
+        version = self._db.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            logger.info("Rebuilding local replay catalog (schema {} -> {})".format(version, SCHEMA_VERSION))
+            self._db.executescript("DROP TABLE IF EXISTS players; DROP TABLE IF EXISTS replays;")
+            self._db.execute("PRAGMA user_version = {}".format(SCHEMA_VERSION))
+        self._db.executescript(_SCHEMA)
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+    def _scan(self):
+        on_disk = {}
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if not entry.name.endswith((".fafreplay", ".scfareplay")):
+                        continue
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    on_disk[entry.name] = (st.st_mtime, st.st_size)
+        except OSError:
+            logger.warning("Can't list replay folder {}".format(self.directory))
+        return on_disk
+
+    def _read_header(self, basename):
+        if basename.endswith(".scfareplay"):
+            return ""
+        try:
+            with open(os.path.join(self.directory, basename), "rt") as fh:
+                return fh.readline()
+        except (OSError, UnicodeDecodeError):
+            return ""
+
+    def refresh(self):
+        """
+        Brings the catalog up to date with the replay folder.
+        Only files that are new or whose mtime or size changed are read.
+        Returns a tuple (added_or_changed, removed).
+        """
+        on_disk = self._scan()
+        known = {name: (mtime, size) for name, mtime, size
+                 in self._db.execute("SELECT filename, mtime, size FROM replays")}
+
+        removed = [name for name in known if name not in on_disk]
+        changed = [name for name, stamp in on_disk.items() if known.get(name) != stamp]
+
+        with self._db:
+            self._db.executemany("DELETE FROM replays WHERE filename = ?", ((n,) for n in removed))
+            for name in changed:
+                mtime, size = on_disk[name]
+                self._store(name, mtime, size, parse_replay_metadata(name, self._read_header(name)))
+
+        if changed or removed:
+            logger.info("Local replay catalog: {} new or changed, {} removed".format(len(changed), len(removed)))
+        return len(changed), len(removed)
+
+    def _store(self, name, mtime, size, entry):
+        self._db.execute("DELETE FROM replays WHERE filename = ?", (name,))
+        self._db.execute("INSERT INTO replays VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                         (name, mtime, size, entry["bucket"], entry["launched_at"], entry["mapname"],
+                          entry["title"], entry["featured_mod"], "\x00".join(entry["players"]),
+                          entry["info"]))
+        self._db.executemany("INSERT INTO players VALUES (?, ?)",
+                             ((name, player) for player in entry["players"]))
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM replays").fetchone()[0]
+
+    def buckets(self):
+        """
+        Returns a list of (bucket, replay count) tuples, most recent day first.
+        """
+        return self._db.execute("SELECT bucket, COUNT(*) FROM replays GROUP BY bucket "
+                                "ORDER BY bucket DESC").fetchall()
+
+    def signatures(self):
+        """
+        Returns {bucket: signature}, a bucket's signature changing whenever one of its replays
+        is added, removed or changed.
+        """
+        digests = {}
+        for bucket, filename, mtime, size in self._db.execute("SELECT bucket, filename, mtime, size FROM replays "
+                                                              "ORDER BY bucket, filename"):
+            digest = digests.get(bucket)
+            if digest is None:
+                digest = digests[bucket] = hashlib.md5()
+            digest.update("{}\0{!r}\0{}\0".format(filename, mtime, size).encode("utf-8"))
+        return {bucket: digest.hexdigest() for bucket, digest in digests.items()}
+
+    def bucket(self, bucket, offset=0, limit=-1):
+        """
+        Returns the entries in a bucket, ordered by launch time.
+        """
+        rows = self._db.execute("SELECT * FROM replays WHERE bucket = ? "
+                                "ORDER BY launched_at, filename LIMIT ? OFFSET ?",
+                                (bucket, limit, offset))
+        return [LocalReplayEntry(self.directory, row) for row in rows]
+
+    def search(self, player=None, mapname=None, featured_mod=None, limit=-1):
+        """
+        Returns complete replays matching all of the given criteria, most recent first.
+        Player and map names are matched case-insensitively.
+        """
+        clauses = ["launched_at IS NOT NULL"]
+        args = []
+        if player:
+            clauses.append("filename IN (SELECT filename FROM players WHERE name = ?)")
+            args.append(player)
+        if mapname:
+            clauses.append("mapname = ? COLLATE NOCASE")
+            args.append(mapname)
+        if featured_mod:
+            clauses.append("featured_mod = ?")
+            args.append(featured_mod)
+        args.append(limit)
+        rows = self._db.execute("SELECT * FROM replays WHERE " + " AND ".join(clauses) +
+                                " ORDER BY launched_at DESC LIMIT ?", args)
+        return [LocalReplayEntry(self.directory, row) for row in rows]
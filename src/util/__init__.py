@@ -11,6 +11,7 @@ import subprocess
 
 from semantic_version import Version
 from util.theme import Theme, ThemeSet
+from util import imagecache
 
 from config import Settings
 from PyQt5.QtCore import QStandardPaths
@@ -95,9 +96,11 @@ PREFSFILENAME = os.path.join(LOCALFOLDER, "game.prefs")
 if not os.path.exists(PREFSFILENAME):
     PREFSFILENAME = os.path.join(LOCALFOLDER, "Game.prefs")
 
-DOWNLOADED_RES_PIX = {}
 DOWNLOADING_RES_PIX = {}
 
+# Memory for decoded icons, map previews and avatars, in MiB
+imagecache.shared.setBudget(Settings.get('images/cache_budget', 64, type=int) * 1024 * 1024)
+
 PERSONAL_DIR = str(QStandardPaths.standardLocations(QStandardPaths.DocumentsLocation)[0])
 logger.info('PERSONAL_DIR initial: ' + PERSONAL_DIR)
 try:
@@ -237,13 +240,12 @@ def addcurDownloadAvatar(url, caller):
 
 
 def addrespix(url, pixmap):
-    DOWNLOADED_RES_PIX[url] = pixmap
+    # Avatars live in the shared image cache, an evicted one is simply downloaded again
+    imagecache.shared.put((url, None, False), pixmap)
 
 
 def respix(url):
-    if url in DOWNLOADED_RES_PIX:
-        return DOWNLOADED_RES_PIX[url]
-    return None
+    return imagecache.shared.get((url, None, False))
 
 
 def __downloadPreviewFromWeb(unitname):
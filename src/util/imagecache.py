@@ -0,0 +1,170 @@
+"""
+Bounded cache for the pixmaps the client shows: theme icons, map previews and avatars.
+
+Entries are kept in least recently used order and evicted once their combined
+size exceeds the byte budget. Files can be decoded off the GUI thread with
+loadAsync(): the QImage is read on a worker, and only the conversion to a
+QPixmap (which Qt allows on the GUI thread alone) happens on delivery.
+"""
+import collections
+import concurrent.futures
+import os
+
+from PyQt5 import QtCore, QtGui
+
+import logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUDGET = 64 * 1024 * 1024
+DECODE_WORKERS = 2
+
+# What a cached "file doesn't exist" costs, so those are bounded as well
+MISSING_COST = 64
+
+
+def cacheKey(path, size=None, themed=False):
+    return (os.path.normcase(os.path.abspath(path)) if path is not None else None, size, themed)
+
+
+def _cost(pixmap):
+    if pixmap is None:
+        return MISSING_COST
+    return max(pixmap.width() * pixmap.height() * pixmap.depth() // 8, MISSING_COST)
+
+
+def _decode(path, size):
+    image = QtGui.QImage(path)
+    if image.isNull():
+        return None
+    if size is not None:
+        image = image.scaled(size[0], size[1], QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation)
+    return image
+
+
+class ImageCache(QtCore.QObject):
+    """
+    Maps keys, (path, size, themed) tuples for files, to QPixmaps or None for
+    missing files. size is None for the image as is, or (width, height) to
+    scale it into. loaded is emitted with the key once loadAsync() has put an
+    image into the cache.
+    """
+    loaded = QtCore.pyqtSignal(object)
+    _decoded = QtCore.pyqtSignal(object, object)
+
+    def __init__(self, budget=DEFAULT_BUDGET, *args, **kwargs):
+        QtCore.QObject.__init__(self, *args, **kwargs)
+        self.budget = budget
+        self.cost = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._decoding = set()
+        self._pool = None
+        self._decoded.connect(self._atDecoded, QtCore.Qt.QueuedConnection)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def stats(self):
+        return {'entries': len(self._entries), 'cost': self.cost, 'budget': self.budget,
+                'hits': self.hits, 'misses': self.misses}
+
+    def setBudget(self, budget):
+        self.budget = budget
+        self._evict()
+
+    def get(self, key, default=None):
+        """
+        Returns the cached pixmap for key and marks it as recently used, or default if it isn't cached.
+        """
+        try:
+            pixmap = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return pixmap
+
+    def put(self, key, pixmap):
+        """
+        Caches pixmap (a QPixmap, a QImage to be converted, or None for a missing file) under key.
+        Returns the cached object.
+        """
+        if isinstance(pixmap, QtGui.QImage):
+            pixmap = QtGui.QPixmap.fromImage(pixmap)
+        self.discard(key)
+        self._entries[key] = pixmap
+        self.cost += _cost(pixmap)
+        self._evict(keep=key)
+        return pixmap
+
+    def discard(self, key):
+        if key in self._entries:
+            self.cost -= _cost(self._entries.pop(key))
+
+    def clear(self):
+        self._entries.clear()
+        self.cost = 0
+
+    def _evict(self, keep=None):
+        while self.cost > self.budget and self._entries:
+            key = next(iter(self._entries))
+            if key == keep:     # A single entry over budget stays until the next one comes in
+                break
+            self.discard(key)
+
+    def load(self, path, size=None, themed=False):
+        """
+        Returns the pixmap of the image file at path, decoding it if it isn't cached. None if there's no such file.
+        """
+        key = cacheKey(path, size, themed)
+        pixmap = self.get(key, self)
+        if pixmap is not self:
+            return pixmap
+        image = _decode(path, size) if os.path.isfile(path) else None
+        return self.put(key, image)
+
+    def loadAsync(self, path, size=None, themed=False, image=None):
+        """
+        Makes sure the image file at path gets cached, decoding it on a worker thread.
+        Returns the key loaded will be emitted with, immediately if it's already cached.
+        An image already decoded elsewhere (off the GUI thread) can be handed in instead.
+        """
+        key = cacheKey(path, size, themed)
+        if key in self._entries:
+            self.loaded.emit(key)
+        elif image is not None:
+            self.put(key, image)
+            self.loaded.emit(key)
+        elif key not in self._decoding:
+            if self._pool is None:
+                self._pool = concurrent.futures.ThreadPoolExecutor(DECODE_WORKERS)
+            self._decoding.add(key)
+            self._pool.submit(self._decode, key, path, size)
+        return key
+
+    def _decode(self, key, path, size):
+        try:
+            image = _decode(path, size) if os.path.isfile(path) else None
+        except:
+            logger.exception("Failed to decode " + path)
+            image = None
+        self._decoded.emit(key, image)
+
+    @QtCore.pyqtSlot(object, object)
+    def _atDecoded(self, key, image):
+        self._decoding.discard(key)
+        self.put(key, image)
+        self.loaded.emit(key)
+
+    def stop(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+
+shared = ImageCache()
@@ -0,0 +1,70 @@
+"""
+Base for the indexes and manifests the client keeps between runs.
+
+Each is a dict of entries saved as a JSON object together with a version
+number. A file of another version, or one that can't be read, is ignored and
+the entries are built anew. Saving writes a temporary file next to the store
+and moves it over the old one, so a crash never leaves half a file behind.
+"""
+import json
+import os
+import threading
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class JsonStore(object):
+    """
+    Subclasses set VERSION, bumped whenever the entries change shape, KEY, the
+    field of the file holding the entries, and WHAT, how they're called in the
+    log. Subclasses that are used from several threads take self._lock around
+    their entries; save() does as well.
+    """
+    VERSION = 1
+    KEY = 'entries'
+    WHAT = 'store'
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as fh:
+                data = json.load(fh)
+        except FileNotFoundError:
+            return
+        except (IOError, ValueError):
+            logger.warning("Ignoring unreadable " + self.WHAT + " " + self.path)
+            return
+        if isinstance(data, dict) and data.get('version') == self.VERSION:
+            self._entries = data.get(self.KEY, {})
+
+    def save(self):
+        """
+        Writes the entries out, if they changed since they were last saved.
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            data = json.dumps({'version': self.VERSION, self.KEY: self._entries})
+            self._dirty = False
+        try:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w") as fh:
+                fh.write(data)
+            os.replace(tmp, self.path)
+        except OSError:
+            logger.exception("Failed to save " + self.WHAT + " " + self.path)
+            with self._lock:
+                self._dirty = True
+
+    def __len__(self):
+        return len(self._entries)
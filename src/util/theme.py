@@ -2,6 +2,8 @@ from PyQt5 import QtGui, QtWidgets, QtCore, QtMultimedia, uic
 from semantic_version import Version
 import os
 
+from util import imagecache
+
 import logging
 logger = logging.getLogger(__name__)
 
@@ -16,7 +18,6 @@ class Theme():
         """
         self._themedir = themedir
         self.name = name
-        self._pixmapcache = {}
 
     def __str__(self):
         return str(self.name)
@@ -51,18 +52,15 @@ class Theme():
     def pixmap(self, filename):
         """
         This function loads a pixmap from a themed directory, or anywhere.
-        It also stores them in a cache dictionary (may or may not be necessary depending on how Qt works under the hood)
+        Pixmaps are kept in the client's shared, size limited image cache.
+        Returns None if there's no such file, and a (null) pixmap for any file there is.
         """
-        try:
-            return self._pixmapcache[filename]
-        except KeyError:
-            if os.path.isfile(self._themepath(filename)):
-                pix = QtGui.QPixmap(self._themepath(filename))
-            else:
-                pix = None
-
-        self._pixmapcache[filename] = pix
-        return pix
+        path = self._themepath(filename)
+        key = imagecache.cacheKey(path, themed=self._themedir is not None)
+        pix = imagecache.shared.get(key, imagecache.shared)
+        if pix is not imagecache.shared:
+            return pix
+        return imagecache.shared.put(key, QtGui.QPixmap(path) if os.path.isfile(path) else None)
 
     @_noneIfNoFile
     def loadUi(self, filename):
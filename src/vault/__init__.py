@@ -196,7 +196,6 @@ class MapVault(QtCore.QObject, BusyWidget):
             avail_name = alt_name
         if avail_name is None:
             maps.downloadMap(name)
-            maps.existMaps(True)
         else:
             show = QtWidgets.QMessageBox.question(
                 self.client,
@@ -2,7 +2,9 @@ from downloadManager import FileDownload
 from PyQt5 import QtCore, QtNetwork, QtWidgets
 import zipfile
 import os
-import io
+
+import util
+from vault import install
 
 import logging
 logger = logging.getLogger(__name__)
@@ -74,19 +76,32 @@ class VaultDownloadDialog(object):
 # FIXME - one day we'll do it properly
 _global_nam = QtNetwork.QNetworkAccessManager()
 
+# Times an interrupted vault download is resumed before giving up
+RETRIES = 5
+
 
 def downloadVaultAssetNoMsg(url, target_dir, exist_handler, name, category,
-                            silent):
+                            silent, background=False, on_success=None):
     """
     Download and unpack a zip from the vault, interacting with the user and
-    logging things.
+    logging things. The archive is unpacked by the install pipeline, with
+    on_success(names) called once it's in place. If background is set, this
+    returns as soon as the download is done and the install queued, failures
+    are then reported by install.pipeline.wait().
     """
     global _global_nam
     msg = None
-    output = io.BytesIO()
     capitCat = category[0].upper() + category[1:]
 
-    dler = FileDownload(_global_nam, url, output)
+    # Downloads go to a file named after the url, so an interrupted one is resumed next time
+    partdir = os.path.join(util.CACHE_DIR, "downloads")
+    if not os.path.isdir(partdir):
+        os.makedirs(partdir)
+    partpath = os.path.join(partdir, util.md5text(url) + ".part")
+    output = open(partpath, "r+b" if os.path.exists(partpath) else "w+b")
+    output.seek(0, os.SEEK_END)
+
+    dler = FileDownload(_global_nam, url, output, partpath, resume=True, retries=RETRIES)
     ddialog = VaultDownloadDialog(dler, "Downloading {}".format(category), name, silent)
     result = ddialog.run()
 
@@ -101,29 +116,45 @@ def downloadVaultAssetNoMsg(url, target_dir, exist_handler, name, category,
              "You need to get it from somewhere else in order to use it.")
             .format(category))
     if result != VaultDownloadDialog.SUCCESS:
+        empty = output.tell() == 0
+        output.close()
+        if empty:
+            os.remove(partpath)
         return False, msg
 
     try:
         zfile = zipfile.ZipFile(output)
-        # FIXME - nothing in python 2.7 that can do that
-        dirname = zfile.namelist()[0].split(os.path.sep, 1)[0]
-
-        if os.path.exists(os.path.join(target_dir, dirname)):
-            proceed = exist_handler(target_dir, dirname)
-            if not proceed:
-                return False
-        zfile.extractall(target_dir)
-        logger.debug("Successfully downloaded and extracted {} from: {}".format(category, url))
+        dirname = install.topLevel(zfile)
+    except:
+        logger.exception("Broken {} archive from: {}".format(category, url))
+        output.close()
+        os.remove(partpath)
+        return False, _installFailed(category)
+    output.close()
+
+    if os.path.exists(os.path.join(target_dir, dirname)):
+        proceed = exist_handler(target_dir, dirname)
+        if not proceed:
+            os.remove(partpath)
+            return False, msg
+
+    future = install.pipeline.submit(partpath, target_dir, on_success, remove=True,
+                                     background=name if background else None)
+    if background:
         return True, msg
+    if not install.pipeline.wait([future]):
+        return False, _installFailed(category)
+    logger.debug("Successfully downloaded and extracted {} from: {}".format(category, url))
+    return True, msg
 
-    except:
-        logger.error("Extract error")
-        msg = lambda: QtWidgets.QMessageBox.information(
-            None,
-            "{} installation failed".format(capitCat),
-            "<b>This {} could not be installed (please report this {} or bug).</b>"
-                .format(category, category))
-        return False, msg
+
+def _installFailed(category):
+    capitCat = category[0].upper() + category[1:]
+    return lambda: QtWidgets.QMessageBox.information(
+        None,
+        "{} installation failed".format(capitCat),
+        "<b>This {} could not be installed (please report this {} or bug).</b>"
+            .format(category, category))
 
 
 def downloadVaultAsset(url, target_dir, exist_handler, name, category, silent):
@@ -0,0 +1,227 @@
+"""
+Installation of map and mod archives downloaded from the vault.
+
+Archives are checked before anything is written: members escaping the target
+folder, an absurd number of members, a total size beyond MAX_TOTAL_SIZE and
+suspicious compression ratios (zip bombs) are refused. The members are then
+unpacked by a pool of workers, each with its own handle on the archive, into a
+staging folder beside the target folder (inside it, it would be taken for a
+map or mod), and moved into place once all of them are complete, so a failed
+install leaves nothing half written behind. Like extracting in place would,
+an install is merged into an existing folder of the same name: files the
+archive brings are replaced, other files the user put there are kept.
+
+The pipeline runs installs in the background, so the next download can start
+while an archive is still being unpacked. Finishing touches that need the GUI
+thread (refreshing registries, queueing previews) are passed as callbacks.
+"""
+import concurrent.futures
+import os
+import shutil
+import tempfile
+import zipfile
+
+from PyQt5 import QtCore
+
+import logging
+logger = logging.getLogger(__name__)
+
+EXTRACT_WORKERS = 4
+INSTALL_WORKERS = 2
+READ_SIZE = 256 * 1024
+
+MAX_TOTAL_SIZE = 4 * 1024 * 1024 * 1024
+MAX_MEMBERS = 50000
+# Members compressed better than this are taken for zip bombs, unless they're small
+MAX_RATIO = 200
+RATIO_MIN_SIZE = 1024 * 1024
+
+
+class UnsafeArchive(Exception):
+    pass
+
+
+def members(zfile):
+    """
+    Checks the members of the open ZipFile zfile against the limits, and returns their ZipInfos.
+    """
+    infos = zfile.infolist()
+    if len(infos) > MAX_MEMBERS:
+        raise UnsafeArchive("{} members".format(len(infos)))
+    total = 0
+    for info in infos:
+        name = os.path.normpath(info.filename)
+        if os.path.isabs(name) or os.path.splitdrive(name)[0] or name.split(os.sep)[0] == "..":
+            raise UnsafeArchive("Member outside of the archive folder: " + info.filename)
+        if info.file_size > RATIO_MIN_SIZE and info.compress_size * MAX_RATIO < info.file_size:
+            raise UnsafeArchive("Suspicious compression ratio for " + info.filename)
+        total += info.file_size
+        if total > MAX_TOTAL_SIZE:
+            raise UnsafeArchive("Uncompressed size exceeds {} bytes".format(MAX_TOTAL_SIZE))
+    return infos
+
+
+def topLevel(zfile):
+    """
+    Returns the name of the folder (or file) the first member of zfile is in.
+    """
+    return zfile.namelist()[0].replace("\\", "/").split("/", 1)[0]
+
+
+def _extractMembers(archive, infos, staging):
+    with zipfile.ZipFile(archive) as zfile:
+        for info in infos:
+            destination = os.path.join(staging, os.path.normpath(info.filename))
+            written = 0
+            with zfile.open(info) as src, open(destination, "wb") as dst:
+                while True:
+                    data = src.read(READ_SIZE)
+                    if not data:
+                        break
+                    written += len(data)
+                    if written > info.file_size:  # The header lied about the size
+                        raise UnsafeArchive("Member larger than announced: " + info.filename)
+                    dst.write(data)
+
+
+def _merge(source, destination):
+    """
+    Moves source to destination, merging it into a folder already there.
+    """
+    if os.path.isdir(destination) and not os.path.islink(destination):
+        if os.path.isdir(source):
+            for name in os.listdir(source):
+                _merge(os.path.join(source, name), os.path.join(destination, name))
+            return
+        shutil.rmtree(destination)
+    elif os.path.lexists(destination) and os.path.isdir(source):
+        os.remove(destination)
+    os.replace(source, destination)
+
+
+def extract(archive, target_dir, workers=EXTRACT_WORKERS):
+    """
+    Unpacks the zip file archive into target_dir, merging it into top level
+    folders of the same name. Returns the names of the installed top level entries.
+    """
+    if not os.path.isdir(target_dir):
+        os.makedirs(target_dir)
+    staging = tempfile.mkdtemp(prefix=".install-", dir=os.path.dirname(os.path.abspath(target_dir)))
+    try:
+        with zipfile.ZipFile(archive) as zfile:
+            infos = members(zfile)
+
+        files = []
+        for info in infos:
+            path = os.path.join(staging, os.path.normpath(info.filename))
+            if info.filename.endswith(("/", "\\")):
+                os.makedirs(path, exist_ok=True)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                files.append(info)
+
+        # Spread the members so every worker gets about the same amount of data
+        groups = [[] for _ in range(max(1, min(workers, len(files))))]
+        sizes = [0] * len(groups)
+        for info in sorted(files, key=lambda i: i.file_size, reverse=True):
+            smallest = sizes.index(min(sizes))
+            groups[smallest].append(info)
+            sizes[smallest] += info.file_size
+        with concurrent.futures.ThreadPoolExecutor(len(groups)) as pool:
+            for job in [pool.submit(_extractMembers, archive, group, staging) for group in groups]:
+                job.result()
+
+        installed = os.listdir(staging)
+        for name in installed:
+            _merge(os.path.join(staging, name), os.path.join(target_dir, name))
+        return installed
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+class InstallPipeline(QtCore.QObject):
+    """
+    Installs archives on worker threads. finished is emitted on the GUI thread
+    with the archive and the installed names, or the exception that stopped it.
+    """
+    finished = QtCore.pyqtSignal(str, object)
+    _done = QtCore.pyqtSignal(object)
+
+    def __init__(self, workers=INSTALL_WORKERS, *args, **kwargs):
+        QtCore.QObject.__init__(self, *args, **kwargs)
+        self._pool = concurrent.futures.ThreadPoolExecutor(workers)
+        self._pending = {}  # future -> (archive, on_success, remove, name of a background install)
+        self._failed = []   # names of the background installs that failed since the last wait()
+        self.failed = []    # those reported by the last wait() without futures
+        self._done.connect(self._atDone, QtCore.Qt.QueuedConnection)
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    def submit(self, archive, target_dir, on_success=None, remove=False, background=None):
+        """
+        Queues archive to be unpacked into target_dir. on_success(names) is
+        called on the GUI thread once it's installed, the archive is deleted
+        afterwards if remove is set. background is the name of what's installed
+        if nobody waits for this install: its failure is then reported by the
+        next wait() without futures. Returns a Future.
+        """
+        future = self._pool.submit(extract, archive, target_dir)
+        self._pending[future] = (archive, on_success, remove, background)
+        future.add_done_callback(self._done.emit)
+        return future
+
+    @QtCore.pyqtSlot(object)
+    def _atDone(self, future):
+        if future not in self._pending:
+            return
+        archive, on_success, remove, background = self._pending.pop(future)
+        if remove:
+            try:
+                os.remove(archive)
+            except OSError:
+                logger.warning("Couldn't remove " + archive)
+        error = future.exception()
+        if error is not None:
+            if background is not None:
+                self._failed.append(background)
+            logger.error("Failed to install {}: {}".format(archive, error))
+            self.finished.emit(archive, error)
+            return
+        names = future.result()
+        logger.debug("Installed {} from {}".format(", ".join(names), archive))
+        if on_success is not None:
+            try:
+                on_success(names)
+            except:
+                logger.exception("Error finishing the install of " + archive)
+        self.finished.emit(archive, names)
+
+    def wait(self, futures=None):
+        """
+        Keeps the GUI responsive until the given installs are done, and returns
+        whether all of them succeeded. Without futures, waits for everything
+        pending and returns whether no background install failed since the last
+        such call; the names of those that did are left in failed.
+        """
+        everything = futures is None
+        if everything:
+            futures = list(self._pending)
+        loop = QtCore.QEventLoop()
+        self.finished.connect(loop.quit)
+        try:
+            while any(future in self._pending for future in futures):
+                loop.exec_()
+        finally:
+            self.finished.disconnect(loop.quit)
+        if everything:
+            self.failed, self._failed = self._failed, []
+            return not self.failed
+        return all(future.exception() is None for future in futures)
+
+    def stop(self):
+        self._pool.shutdown(wait=True)
+
+
+pipeline = InstallPipeline()
@@ -33,28 +33,222 @@ If there is default value for a search entry, error will not be generated. Defau
         __self__ - returns item name as it is in lua
         __parent__ - returns item parent
     destination - you can specify a dictionary for matched items in the resulting array
+
+The file is read in one go, split into tokens by a single regular expression
+and parsed by a small recursive descent parser for the table constructor
+subset of lua that FA data files use. Anything that isn't a table or a plain
+string (numbers, booleans, calls like VECTOR3( 1, 2, 3 )) is returned as its
+source text.
 """
 import re
-import zipfile
 import os
 
+# Whitespace and comments are matched in front of each token, and skipped
+_TOKEN = re.compile(r"""
+    (?: \s+ | --\[(?P<ceq>=*)\[ .*? \](?P=ceq)\] | --[^\n]* )*
+    (?:
+        (?P<name> [A-Za-z_][A-Za-z0-9_]* )
+      | (?P<number> 0[xX][0-9a-fA-F]+ | (?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)? )
+      | (?P<string> "(?:[^"\\\n]|\\.)*" | '(?:[^'\\\n]|\\.)*' )
+      | (?P<long> \[(?P<leq>=*)\[ .*? \](?P=leq)\] )
+      | (?P<op> \.\.\.? | [=~<>]= | . )
+      | $
+    )""", re.S | re.X)
+
+_ESCAPE = re.compile(r"\\(\d{1,3}|\n|.)", re.S)
+_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', 'a': '\a', 'b': '\b', 'f': '\f', 'v': '\v'}
+
+# Where an expression ends, when not nested in brackets
+_TERMINATORS = {',', ';', '}', ')', ']'}
+_OPENING = {'(', '{', '['}
+_CLOSING = {')', '}', ']'}
+
+
+def _unescape(match):
+    escape = match.group(1)
+    if escape.isdigit():
+        return chr(int(escape))
+    return _ESCAPES.get(escape, escape)
+
+
+def tokenize(text):
+    """
+    Splits lua source into (kind, start, end) tokens, skipping whitespace and comments.
+    """
+    return [(m.lastgroup,) + m.span(m.lastgroup) for m in _TOKEN.finditer(text) if m.lastgroup]
+
+
+class _Parser:
+    """
+    Parses a chunk of assignments of tables and values. visit(parent, key, value)
+    is called for every item, once its value has been parsed completely.
+    """
+    def __init__(self, text, visit, loweringKeys=True):
+        self.text = text
+        self.visit = visit
+        self.lower = loweringKeys
+        tokens = tokenize(text)
+        # Kept apart for quick lookups, ops by their text
+        self.kinds = [text[start:end] if kind == "op" else kind for kind, start, end in tokens]
+        self.kinds.append(None)
+        self.kinds.append(None)
+        self.tokens = tokens
+        self.pos = 0
+
+    def _isAssignment(self, pos):
+        return self.kinds[pos] == "name" and self.kinds[pos + 1] == "="
+
+    def _text(self, pos):
+        _, start, end = self.tokens[pos]
+        return self.text[start:end]
+
+    def _key(self, key):
+        return key.lower() if self.lower else key
+
+    def _string(self, pos):
+        text = self._text(pos)
+        if self.kinds[pos] == "long":
+            bracket = text.index("[", 1) + 1
+            body = text[bracket:-bracket]
+            return body[1:] if body.startswith("\n") else body
+        return _ESCAPE.sub(_unescape, text[1:-1])
+
+    def chunk(self):
+        lua = {}
+        kinds = self.kinds
+        while kinds[self.pos] is not None:
+            if kinds[self.pos] == "name" and self._text(self.pos) == "local":
+                self.pos += 1
+            if self._isAssignment(self.pos):
+                key = self._key(self._text(self.pos))
+                self.pos += 2
+                self._item(lua, "", key)
+            else:
+                self.pos += 1   # Statements other than assignments are of no interest
+        return lua
+
+    def assignment(self, name):
+        kinds = self.kinds
+        span, value = None, None
+        while kinds[self.pos] is not None:
+            if self._isAssignment(self.pos):
+                first = self.pos
+                self.pos += 2
+                if self._text(first) == name:
+                    value = self.value(">" + name)
+                    span = self.tokens[first][1], self.tokens[self.pos - 1][2]
+                else:
+                    self.raw()
+            else:
+                self.pos += 1
+        return span, value
+
+    def _item(self, lua, parent, key):
+        value = lua[key] = self.value(parent + ">" + key)
+        self.visit(parent, key, value)
+
+    def value(self, path):
+        pos = self.pos
+        kind = self.kinds[pos]
+        if kind == "{":
+            return self.table(path)
+        if kind == "string" or kind == "long":
+            following = self.kinds[pos + 1]
+            if following is None or following in _TERMINATORS or self._isAssignment(pos + 1):
+                self.pos += 1
+                return self._string(pos)
+        return self.raw()
+
+    def raw(self):
+        """
+        Skips an expression, and returns its source text.
+        """
+        kinds = self.kinds
+        first = pos = self.pos
+        depth = 0
+        while kinds[pos] is not None:
+            kind = kinds[pos]
+            if depth == 0 and (kind in _TERMINATORS or pos > first and self._isAssignment(pos)):
+                break
+            if kind in _OPENING:
+                depth += 1
+            elif kind in _CLOSING:
+                depth -= 1
+            pos += 1
+        self.pos = pos
+        if pos == first:
+            return ""
+        return self.text[self.tokens[first][1]:self.tokens[pos - 1][2]]
+
+    def table(self, path):
+        kinds = self.kinds
+        self.pos += 1   # {
+        lua = {}
+        index = 0
+        while True:
+            kind = kinds[self.pos]
+            if kind is None:
+                break
+            if kind == "}":
+                self.pos += 1
+                break
+            if kind == "," or kind == ";":
+                self.pos += 1
+                continue
+            start = self.pos
+            positional = False
+            if kind == "[":
+                self.pos += 1
+                if kinds[self.pos] in ("string", "long") and kinds[self.pos + 1] == "]":
+                    key = self._string(self.pos)
+                    self.pos += 1
+                else:
+                    key = self.raw()
+                if kinds[self.pos] == "]":
+                    self.pos += 1
+                if kinds[self.pos] == "=":
+                    self.pos += 1
+                key = self._key(key)
+            elif self._isAssignment(self.pos):
+                key = self._key(self._text(self.pos))
+                self.pos += 2
+            else:
+                key = str(index)
+                positional = True
+            value = self.value(path + ">" + key)
+            if self.pos == start:
+                # Nothing to parse here, e.g. a stray closing bracket of a malformed
+                # file. Skip the token, every pass has to consume one.
+                self.pos += 1
+                continue
+            if positional:
+                index += 1
+            lua[key] = value
+            self.visit(path, key, value)
+        return lua
+
+
+def findAssignment(text, name):
+    """
+    Finds the last top level assignment to name in the lua source text, e.g. to
+    replace it. Returns the (start, end) span of its source, from the name to
+    the end of the value, and the parsed value with keys as they are written.
+    Returns (None, None) if name isn't assigned to. Other values are skipped,
+    not parsed.
+    """
+    parser = _Parser(text, lambda parent, key, value: None, loweringKeys=False)
+    return parser.assignment(name)
+
 
 class luaParser:
-    
+
     def __init__(self, luaPath):
         self.iszip = False
         self.zip = None
         self.__path = luaPath
-        self.__keyFilter = re.compile("[\[\],'\"]")
-        self.__valFilter = re.compile("[\[\]]")
         self.__searchResult = dict()
         self.__searchPattern = dict()
         self.__foundItemsCount = dict()
-        self.__stream = list()
-        self.__lines = list()
-        self.__prevUnfinished = False
-        self.__inString = False
-        self.__stringChar = ""
         self.__parsedData = dict()
         self.__defaultValues = dict()
         self.errors = 0
@@ -63,218 +257,87 @@ class luaParser:
         self.warning = False
         self.errorMsg = ""
         self.loweringKeys = True
-    
-    def __checkUninterruptibleStr(self, char):
-        if char == "\"" or char == "'":
-            if not self.__inString:
-                self.__stringChar = char
-                self.__inString = True
-            elif char == self.__stringChar:
-                self.__inString = False
-        elif not self.__inString and char == "(":
-            self.__inString = True
-            self.__stringChar = ")"
-    
-    def __processLine(self, parent=""):
-        # initialize item counter
-        counter = 0
-        # initialize empty array
-        lua = dict()
-        # initialize value
-        value = ""
-        # start cycle
-        while len(self.__stream):
-            # get a line from the list or read next line from the file
-            if len(self.__lines) == 0:
-                line = self.__stream.pop(0)
-                # cut commentary section (either start whit '#' or is a '--[[  ]]--' section
-                comment = re.compile("((#.*))$|((--\[\[).*(\]\]--)$)")
-                line = comment.sub("", line)
-                # process line to see if it one command or a stack of them
-                newLine = 0
-                pos = 0
-                self.__inString = False
-                while len(line) > pos:
-                    char = line[pos]
-                    self.__checkUninterruptibleStr(char)
-                    if char == "{":
-                        pos = pos + 1
-                        char = line[pos]
-                        self.__checkUninterruptibleStr(char)
-                        self.__lines.append(line[newLine:pos])
-                        newLine = pos
-                    elif char == "," and not self.__inString:
-                        self.__lines.append(line[newLine:pos])
-                        pos = pos + 1
-                        char = line[pos]
-                        self.__checkUninterruptibleStr(char)
-                        newLine = pos
-                    elif char == "}":
-                        self.__lines.append(line[newLine:pos])
-                        self.__lines.append("}")
-                        pos = pos + 1
-                        if pos <= len(line):
-                            self.__checkUninterruptibleStr(line[pos])
-                        newLine = pos
-                    pos = pos + 1
-                if len(self.__lines) > 0:
-                    line = self.__lines.pop(0)
-            else:
-                line = self.__lines.pop(0)
-            line = line.strip()
-            # if the string is not empty, proceed
-            if line != "":
-                # split it by '='
-                lineArray = line.split("=")
-                # if result is one element list
-                if len(lineArray) == 1:
-                    # this element is value
-                    value = lineArray[0].strip()
-                    # assign counter value to key
-                    key = str(counter)
+
+    def __compileSearch(self):
+        self.__matchers = []
+        for searchKey, resultKey in self.__searchPattern.items():
+            valcmd = searchKey.split(":")
+            pattern = valcmd[-1]
+            valcmd = valcmd[0] if len(valcmd) == 2 else "none"
+            last = pattern.split(">")[-1]
+            self.__matchers.append((
+                searchKey, resultKey, valcmd,
+                None if "*" in last else last,  # Cheap check of the key before matching the whole path
+                re.compile(".*>(" + pattern.replace("*", ".*") + ")$")))
+
+    def __visit(self, parent, key, value):
+        # checking item if it suits searchPattern, and adding if so
+        for searchKey, resultKey, valcmd, last, regex in self.__matchers:
+            if last is not None and last != key:
+                continue
+            if not regex.match(parent + ">" + key):
+                continue
+            if valcmd == "count":
+                count = 1 if isinstance(value, str) else len(value)
+                if resultKey in self.__searchResult:
+                    resultVal = self.__searchResult[resultKey] + count
                 else:
-                    # first is key
-                    if self.loweringKeys:
-                        key = lineArray[0].lower()
-                    else:
-                        key = lineArray[0]
-                    # get rid of redundant chars in key
-                    key = self.__keyFilter.sub("", key).strip()
-                    # second is value
-                    value = lineArray[1].strip()
-                # if value is '}' - which is end of lua array, stop parsing
-                if value == "}":
-                    break
-                unfinished = False
-                if len(value) != 0:
-                    # remove finishing comma if there is one
-                    if value[-1] == ",":
-                        value = value[:-1]
-                    # get rid of redundant chars in value
-                    value = self.__valFilter.sub("", value)
-                if len(value) != 0:
-                    # parse value:
-                    # if the string starts with '{'
-                    if value[-1] == "{":
-                        # add new item into the array: recursive function call
-                        if self.__prevUnfinished:
-                            self.__prevUnfinished = False
-                            lua[prevkey] = self.__processLine(parent+">"+prevkey)
-                        else:
-                            lua[key] = self.__processLine(parent+">"+key)
-                    else:
-                        # add new item into the array: value itself
-                        if value[0] == "\"" or value[0] == "'":
-                            value = value[1:]
-                        if value[-1] == "\"" or value[-1] == "'":
-                            value = value[:-1]
-                        lua[key] = value
-                elif len(value) != 0:
-                    # add new item into the array: value itself
-                    lua[key] = value
-                elif len(key) != 0:
-                    self.__prevUnfinished = True
-                    prevkey = key
-            # checking line if it suits searchPattern, and adding if so
-                for searchKey in self.__searchPattern:
-                    # regkey = re.compile(".*("+searchKey.split(":")[-1].replace("*", ".*")+")$")
-                    # if regkey.match(parent+">"+key):
-                    if re.match(".*>("+searchKey.split(":")[-1].replace("*", ".*")+")$", parent+">"+key):
-                        # get command from key
-                        valcmd = searchKey.split(":")
-                        valcmd = valcmd[0] if len(valcmd) == 2 else "none"
-                        # add new value into the resulting array
-                        resultKey = self.__searchPattern[searchKey]
-                        if valcmd == "count":
-                            if key in lua:
-                                if isinstance(lua[key], str):
-                                    count = 1
-                                else:
-                                    count = len(lua[key])
-                            else:
-                                count = 0
-                            if resultKey in self.__searchResult:
-                                resultVal = self.__searchResult[resultKey] + count
-                            else:
-                                resultVal = count
-                        else:
-                            resultVal = lua[key]
-                        resultKey = resultKey.replace("__self__", key)
-                        resultKey = resultKey.replace("__parent__", parent.split(">")[-1])
-                        keycmd = resultKey.split(":")
-                        # unpack command from search key
-                        if len(keycmd) == 2:
-                            resultKey = keycmd[1]
-                            keydst = keycmd[0]
-                        else:
-                            keydst = "__nowhere__"
-                        # write result into the array
-                        if keydst == "__nowhere__":
-                            self.__searchResult[resultKey] = resultVal
-                        else:
-                            if keydst in self.__searchResult:
-                                if isinstance(self.__searchResult[keydst], dict):
-                                    self.__searchResult[keydst][resultKey] = resultVal
-                            else:
-                                self.__searchResult[keydst] = dict()
-                                self.__searchResult[keydst][resultKey] = resultVal
-                        if isinstance(resultVal, int):
-                            self.__foundItemsCount[searchKey] = self.__foundItemsCount[searchKey] + resultVal
-                        else:
-                            self.__foundItemsCount[searchKey] = self.__foundItemsCount[searchKey] + 1
-            # increase counter
-            counter = counter + 1
-        # return resulting array
-        return lua
+                    resultVal = count
+            else:
+                resultVal = value
+            resultKey = resultKey.replace("__self__", key)
+            resultKey = resultKey.replace("__parent__", parent.split(">")[-1])
+            keycmd = resultKey.split(":")
+            # write result into the array
+            if len(keycmd) == 2:
+                keydst, resultKey = keycmd
+                if keydst not in self.__searchResult:
+                    self.__searchResult[keydst] = dict()
+                if isinstance(self.__searchResult[keydst], dict):
+                    self.__searchResult[keydst][resultKey] = resultVal
+            else:
+                self.__searchResult[resultKey] = resultVal
+            if isinstance(resultVal, int):
+                self.__foundItemsCount[searchKey] += resultVal
+            else:
+                self.__foundItemsCount[searchKey] += 1
 
-    def __parseLua(self):
-        # open file
+    def __read(self):
         if not self.iszip:
-            f = open(self.__path, "r")
-        else:
-            if self.zip.testzip() is None:
-                for member in self.zip.namelist() :
-                    filename = os.path.basename(member)
-                    if not filename:
-                        continue
-                    if filename == self.__path:
-                        f = self.zip.open(member)
-                        break
-        if not f:
-            return
-
-        self.__stream = f.readlines()
-        if self.__stream[-1][-1] != "\n":  # file doesn't end in a newline
-            # needed to prevent a bug happening when a file doesn't end with a newline.
-                        self.__stream[-1] += "\n"
-        f.close()
-        # call recursive function
-        result = self.__processLine()
-        return result
+            with open(self.__path, "rb") as f:
+                return f.read()
+        # Only the member itself is decompressed, the rest of the archive isn't touched
+        for member in self.zip.namelist():
+            if os.path.basename(member) == self.__path:
+                with self.zip.open(member) as f:
+                    return f.read()
+        return None
+
+    def __parseLua(self):
+        data = self.__read()
+        if data is None:
+            return None
+        try:
+            text = data.decode("utf-8")
+        except UnicodeDecodeError:
+            text = data.decode("latin-1")
+        self.__compileSearch()
+        return _Parser(text, self.__visit, self.loweringKeys).chunk()
 
     def __checkErrors(self):
         for key in self.__foundItemsCount:
             resultKey = self.__searchPattern[key]
-            if len(key.split(":")) == 2 or key.find("*") != -1:
-                if self.__foundItemsCount[key] == 0:
-                    if resultKey in self.__defaultValues:
-                        self.__searchResult[resultKey] = self.__defaultValues[resultKey]
-                    else:
-                        self.error = True
-                        self.errors = self.errors + 1
-                        self.errorMsg = self.errorMsg + "Error: no matches for '" + key + "' were found\n"
-            else:
-                if self.__foundItemsCount[key] == 0:
-                    if resultKey in self.__defaultValues:
-                        self.__searchResult[resultKey] = self.__defaultValues[resultKey]
-                    else:
-                        self.error = True
-                        self.errors = self.errors + 1
-                        self.errorMsg = self.errorMsg + "Error: no matches for '" + key + "' were found\n"
-                elif self.__foundItemsCount[key] > 1:
-                    self.warning = True
-                    self.warnings = self.warnings + 1
-                    self.errorMsg = self.errorMsg + "Warning: there were duplicate occurrences for '" + key + "'\n"
+            if self.__foundItemsCount[key] == 0:
+                if resultKey in self.__defaultValues:
+                    self.__searchResult[resultKey] = self.__defaultValues[resultKey]
+                else:
+                    self.error = True
+                    self.errors = self.errors + 1
+                    self.errorMsg = self.errorMsg + "Error: no matches for '" + key + "' were found\n"
+            elif self.__foundItemsCount[key] > 1 and len(key.split(":")) != 2 and key.find("*") == -1:
+                self.warning = True
+                self.warnings = self.warnings + 1
+                self.errorMsg = self.errorMsg + "Warning: there were duplicate occurrences for '" + key + "'\n"
 
     def parse(self, luaSearch, defValues=dict()):
         self.__searchPattern.update(luaSearch)
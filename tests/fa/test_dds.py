@@ -0,0 +1,63 @@
+import struct
+
+import pytest
+from PyQt5 import QtGui
+
+from fa import dds
+
+
+def _dds(width, height, data, fourcc=b"", bits=32, masks=(0xff0000, 0xff00, 0xff)):
+    flags = dds.DDPF_FOURCC if fourcc else dds.DDPF_RGB
+    header = bytearray(dds.HEADER_SIZE)
+    header[:4] = dds.MAGIC
+    struct.pack_into("<7I", header, 4, 124, 0x1007, height, width, width * bits // 8 if not fourcc else 0, 0, 1)
+    struct.pack_into("<2I4sI3I", header, 76, 32, flags, fourcc.ljust(4, b"\0"), bits if not fourcc else 0, *masks)
+    return bytes(header) + data
+
+
+def _rgb(image, x, y):
+    color = QtGui.QColor(image.pixel(x, y))
+    return color.red(), color.green(), color.blue()
+
+
+def test_bgra():
+    # 2x2: red, green / blue, white, as BGRA
+    image = dds.to_image(_dds(2, 2, b"\0\0\xff\x80" b"\0\xff\0\x80" b"\xff\0\0\x80" b"\xff\xff\xff\x80"))
+    assert (image.width(), image.height()) == (2, 2)
+    assert [_rgb(image, x, y) for y in range(2) for x in range(2)] == \
+        [(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 255)]
+
+
+def test_bgr():
+    image = dds.to_image(_dds(2, 1, b"\0\0\xff" b"\xff\0\0", bits=24))
+    assert [_rgb(image, x, 0) for x in range(2)] == [(255, 0, 0), (0, 0, 255)]
+
+
+@pytest.mark.parametrize("fourcc,alpha", [(b"DXT1", b""), (b"DXT5", b"\xff" * 8)])
+def test_dxt(fourcc, alpha):
+    # One block: color 0 is red, color 1 is blue; first row all color 0, second all color 1,
+    # third and fourth the interpolated colors 2 and 3
+    block = alpha + struct.pack("<HHI", 0xf800, 0x001f, 0b11111111101010100101010100000000)
+    image = dds.to_image(_dds(4, 4, block, fourcc=fourcc))
+    assert _rgb(image, 3, 0) == (255, 0, 0)
+    assert _rgb(image, 0, 1) == (0, 0, 255)
+    assert _rgb(image, 2, 2) == (170, 0, 85)
+    assert _rgb(image, 1, 3) == (85, 0, 170)
+
+
+def test_broken_images():
+    with pytest.raises(IOError):
+        dds.to_image(b"not a dds")
+    with pytest.raises(dds.DDSError):
+        dds.to_image(_dds(64, 64, b"\0" * 100))
+    with pytest.raises(dds.DDSError):
+        dds.to_image(_dds(4, 4, b"\0" * 16, fourcc=b"ATI2"))
+
+
+def test_save_previews(tmpdir):
+    tmpdir.join("map.dds").write_binary(_dds(256, 256, b"\x10\x20\x30\xff" * 256 * 256))
+    dds.save_previews(str(tmpdir.join("map.dds")), small=str(tmpdir.join("small.png")),
+                      large=str(tmpdir.join("large.png")))
+    assert QtGui.QImage(str(tmpdir.join("small.png"))).size().width() == dds.SMALL_PREVIEW_SIZE
+    large = QtGui.QImage(str(tmpdir.join("large.png")))
+    assert large.width() == 256 and _rgb(large, 100, 100) == (0x30, 0x20, 0x10)
@@ -0,0 +1,76 @@
+import io
+import json
+import os
+
+import pytest
+from PyQt5 import QtCore
+
+from fa import fafreplay
+
+INFO = {"uid": 42, "featured_mod": "faf", "complete": True}
+
+
+def qt_fafreplay(info, data):
+    return json.dumps(info).encode() + b"\n" + bytes(QtCore.qCompress(QtCore.QByteArray(data)).toBase64())
+
+
+def test_reads_qt_written_replays():
+    data = os.urandom(100000) + b"\x00" * 500000
+    reader = fafreplay.ReplayReader(io.BytesIO(qt_fafreplay(INFO, data)))
+    assert reader.info == INFO
+    chunks = list(reader.chunks(chunk_size=4096))
+    assert b"".join(chunks) == data
+    assert max(len(c) for c in chunks) <= 4096
+    assert reader.size == len(data)
+
+
+def test_written_replays_are_readable_by_qt():
+    data = b"Supreme Commander v1.50.3696\r\n" + os.urandom(70000)
+    out = io.BytesIO()
+    writer = fafreplay.ReplayWriter(out, INFO, len(data))
+    for offset in range(0, len(data), 1000):
+        writer.write(data[offset:offset + 1000])
+    writer.close()
+
+    header, payload = out.getvalue().split(b"\n", 1)
+    assert json.loads(header.decode()) == INFO
+    assert bytes(QtCore.qUncompress(QtCore.QByteArray.fromBase64(payload))) == data
+
+
+def test_writer_checks_size():
+    writer = fafreplay.ReplayWriter(io.BytesIO(), INFO, 10)
+    writer.write(b"12345")
+    with pytest.raises(fafreplay.ReplayFormatError):
+        writer.close()
+
+
+def test_truncated_replay_is_an_error():
+    replay = qt_fafreplay(INFO, os.urandom(50000))
+    reader = fafreplay.ReplayReader(io.BytesIO(replay[:len(replay) // 2]))
+    with pytest.raises(fafreplay.ReplayFormatError):
+        list(reader.chunks())
+
+
+def test_file_roundtrip(tmpdir):
+    raw = tmpdir.join("raw.scfareplay")
+    raw.write_binary(os.urandom(300000))
+    packed = str(tmpdir.join("1-test.fafreplay"))
+    unpacked = str(tmpdir.join("out.scfareplay"))
+
+    fafreplay.encode_file(INFO, str(raw), packed)
+    assert fafreplay.read_info(packed) == INFO
+    info, size = fafreplay.decode_file(packed, unpacked)
+    assert info == INFO and size == 300000
+    assert open(unpacked, "rb").read() == raw.read_binary()
+    assert not os.path.exists(packed + ".part")
+
+
+def test_broken_replay_leaves_nothing_behind(tmpdir):
+    replay = qt_fafreplay(INFO, os.urandom(50000))
+    packed = tmpdir.join("1-test.fafreplay")
+    packed.write_binary(replay[:len(replay) // 2])
+    unpacked = str(tmpdir.join("out.scfareplay"))
+
+    with pytest.raises(fafreplay.ReplayFormatError):
+        fafreplay.decode_file(str(packed), unpacked)
+    assert not os.path.exists(unpacked) and not os.path.exists(unpacked + ".part")
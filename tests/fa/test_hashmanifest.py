@@ -0,0 +1,44 @@
+import binascii
+import hashlib
+import os
+
+from fa import hashmanifest
+
+
+def test_hashes_are_cached_until_the_file_changes(tmpdir, mocker):
+    gamefile = tmpdir.join("gamedata.scd")
+    gamefile.write_binary(b"data" * 1000)
+    manifest = hashmanifest.HashManifest(str(tmpdir.join("manifest.json")))
+
+    assert manifest.md5(str(gamefile)) == hashlib.md5(b"data" * 1000).hexdigest()
+    assert manifest.crc32(str(gamefile)) == binascii.crc32(b"data" * 1000) & 0xffffffff
+    manifest.save()
+
+    # A fresh manifest serves both from disk, without reading the file
+    manifest = hashmanifest.HashManifest(str(tmpdir.join("manifest.json")))
+    md5 = mocker.spy(hashlib, "md5")
+    assert manifest.md5(str(gamefile)) == hashlib.md5(b"data" * 1000).hexdigest()
+    assert manifest.crc32(str(gamefile)) is not None
+    assert md5.call_count == 1     # Only our own call above
+
+    gamefile.write_binary(b"other data")
+    assert manifest.md5(str(gamefile)) == hashlib.md5(b"other data").hexdigest()
+
+
+def test_invalidate(tmpdir):
+    gamefile = tmpdir.join("gamedata.scd")
+    gamefile.write_binary(b"data")
+    manifest = hashmanifest.HashManifest(str(tmpdir.join("manifest.json")))
+    manifest.md5(str(gamefile))
+    assert len(manifest) == 1
+
+    manifest.invalidate(str(gamefile))
+    assert len(manifest) == 0
+
+
+def test_missing_files_and_broken_manifest(tmpdir):
+    tmpdir.join("manifest.json").write("{not json")
+    manifest = hashmanifest.HashManifest(str(tmpdir.join("manifest.json")))
+    assert manifest.md5(str(tmpdir.join("missing"))) is None
+    assert manifest.crc32(str(tmpdir)) is None
+    assert len(manifest) == 0
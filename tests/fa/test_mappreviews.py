@@ -0,0 +1,112 @@
+import os
+import threading
+
+from fa import maps, mappreviews
+
+
+def _touch(path, mtime):
+    with open(path, "wb") as fh:
+        fh.write(b"x")
+    os.utime(path, (mtime, mtime))
+
+
+def test_preview_is_stale(tmpdir, mocker):
+    cache = tmpdir.mkdir("cache")
+    mapdir = tmpdir.mkdir("scmp_001")
+    mocker.patch.object(maps.util, "CACHE_DIR", str(cache))
+
+    assert not maps.previewIsStale(str(mapdir))     # No map file
+    _touch(str(mapdir.join("scmp_001.scmap")), 1000)
+    assert maps.previewIsStale(str(mapdir))         # No preview
+    _touch(str(cache.join("scmp_001.png")), 2000)
+    assert not maps.previewIsStale(str(mapdir))
+    _touch(str(mapdir.join("scmp_001.small.png")), 3000)
+    assert maps.previewIsStale(str(mapdir))         # Preview shipped with the map changed
+    _touch(str(mapdir.join("scmp_001.scmap")), 4000)
+    _touch(str(mapdir.join("scmp_001.small.png")), 1000)
+    assert maps.previewIsStale(str(mapdir))         # Map changed
+
+
+def test_generate_drops_previews_older_than_the_map(tmpdir, mocker):
+    mocker.patch.object(maps.util, "CACHE_DIR", str(tmpdir.mkdir("cache")))
+    export = mocker.patch.object(maps, "__exportPreviewFromMap", return_value={"cache": None, "tozip": []})
+    mapdir = tmpdir.mkdir("scmp_001")
+    _touch(str(mapdir.join("scmp_001.scmap")), 2000)
+    _touch(str(mapdir.join("scmp_001.dds")), 1000)
+    _touch(str(mapdir.join("scmp_001.large.png")), 1000)
+    _touch(str(mapdir.join("scmp_001.small.png")), 3000)    # Shipped with the map
+
+    maps.generatePreview(str(mapdir))
+
+    export.assert_called_once_with(str(mapdir))
+    assert sorted(os.listdir(str(mapdir))) == ["scmp_001.scmap", "scmp_001.small.png"]
+
+
+def test_generator_renders_stale_maps(tmpdir, mocker, qtbot):
+    user = tmpdir.mkdir("user")
+    for name in ("a", "b", "c"):
+        user.mkdir(name)
+    user.join("not_a_map.txt").write("")
+    mocker.patch.object(maps, "getUserMapsFolder", return_value=str(user))
+    mocker.patch.object(maps, "getBaseMapsFolder", return_value=str(tmpdir.join("missing")))
+    mocker.patch.object(maps, "previewIsStale", side_effect=lambda d: not d.endswith("b"))
+    rendered = []
+    mocker.patch.object(maps, "generatePreview", side_effect=rendered.append)
+
+    generator = mappreviews.PreviewGenerator()
+    progress = []
+    generator.progress.connect(lambda done, total: progress.append((done, total)))
+    with qtbot.waitSignal(generator.finished):
+        generator.scan()
+    generator.stop()
+
+    assert sorted(os.path.basename(d) for d in rendered) == ["a", "c"]
+    # Workers report concurrently, not necessarily in order
+    assert max(progress) == (2, 2)
+
+
+def test_generator_cancel(tmpdir, mocker, qtbot):
+    gate = threading.Event()
+    rendered = []
+    mocker.patch.object(maps, "generatePreview", side_effect=lambda d: gate.wait() or rendered.append(d))
+
+    generator = mappreviews.PreviewGenerator(workers=1)
+    generator.generate([str(tmpdir.join(name)) for name in ("a", "b", "c")])
+    with qtbot.waitSignal(generator.finished):
+        generator.cancel()
+    gate.set()
+    generator.stop()
+
+    # Only the one already being rendered is finished
+    assert len(rendered) <= 1
+
+
+class FakeDownloader(object):
+    def __init__(self, preview=None):
+        self.requested = []
+        self.preview = preview
+
+    def downloadMap(self, name, requester):
+        self.requested.append(name)
+        if self.preview is not None:
+            with open(self.preview, "wb") as fh:
+                fh.write(b"png")
+        requester.setIcon("icon")
+
+
+def test_resolver_asks_again_after_a_failed_download(tmpdir, mocker, qtbot):
+    mocker.patch.object(mappreviews.util, "CACHE_DIR", str(tmpdir))
+    mocker.patch.object(maps, "previewPath", return_value=None)
+    downloader = FakeDownloader()
+    resolver = mappreviews.PreviewResolver(downloader)
+
+    with qtbot.waitSignal(resolver.previewReady) as ready:
+        resolver.request("SCMP_009")
+    assert ready.args == ["SCMP_009", None]
+
+    downloader.preview = str(tmpdir.join("scmp_009.png"))
+    with qtbot.waitSignal(resolver.previewReady) as ready:
+        resolver.request("SCMP_009")
+    assert ready.args == ["SCMP_009", "icon"]
+    assert downloader.requested == ["SCMP_009", "SCMP_009"]
+    resolver.stop()
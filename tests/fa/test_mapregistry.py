@@ -0,0 +1,118 @@
+import os
+import threading
+
+from PyQt5 import QtCore
+
+from fa import mapregistry, scmap
+from fa.mapregistry import MapRegistry, MapInfo
+
+SCENARIO = """
+version = 3
+ScenarioInfo = {
+    name = "Seton's Clutch",
+    type = 'skirmish',
+    size = {1024, 512},
+    map_version = 2,
+    Configurations = {
+        ['standard'] = {
+            teams = {
+                { name = 'FFA', armies = {'ARMY_1','ARMY_2','ARMY_3','ARMY_4',} },
+            },
+        },
+    }}
+"""
+
+
+def _registry(tmpdir):
+    user = tmpdir.mkdir("user")
+    base = tmpdir.mkdir("base")
+    return user, base, MapRegistry(lambda: str(user), lambda: str(base))
+
+
+def test_lookup_ignores_case(tmpdir):
+    user, base, _ = _registry(tmpdir)
+    user.mkdir("My_Map.v0002")
+    user.join("readme.txt").write("")
+    base.mkdir("SCMP_009")
+    registry = MapRegistry(lambda: str(user), lambda: str(base))
+
+    assert len(registry) == 2
+    assert "my_map.v0002" in registry and "MY_MAP.V0002" in registry
+    assert "readme.txt" not in registry
+    assert registry.get("my_map.V0002").folder == str(user.join("My_Map.v0002"))
+    assert registry.get("scmp_009").base
+    assert registry.userNames() == ["My_Map.v0002"]
+
+
+def test_user_maps_shadow_base_maps(tmpdir):
+    user, base, _ = _registry(tmpdir)
+    user.mkdir("scmp_009")
+    base.mkdir("SCMP_009")
+    registry = MapRegistry(lambda: str(user), lambda: str(base))
+    assert not registry.get("SCMP_009").base
+
+
+def test_refresh(tmpdir):
+    user, base, registry = _registry(tmpdir)
+    assert "new_map" not in registry
+    user.mkdir("New_Map")
+    registry.refresh()
+    assert "new_map" in registry
+
+
+def test_missing_folders(tmpdir):
+    registry = MapRegistry(lambda: str(tmpdir.join("nope")), lambda: str(tmpdir.join("none")))
+    assert len(registry) == 0
+    assert registry.get("anything") is None
+
+
+def test_watcher_notices_new_maps(tmpdir, qtbot):
+    user, base, registry = _registry(tmpdir)
+    with qtbot.waitSignal(registry.mapsChanged, timeout=5000):
+        user.mkdir("Downloaded_Map")
+    assert "downloaded_map" in registry
+
+
+def test_registry_made_on_a_worker_thread_watches(tmpdir, qtbot):
+    user = tmpdir.mkdir("user")
+    made = []
+    worker = threading.Thread(target=lambda: made.append(MapRegistry(lambda: str(user), lambda: str(tmpdir))))
+    worker.start()
+    worker.join()
+    registry, = made
+
+    qtbot.waitUntil(lambda: registry._watcher is not None)
+    assert registry._watcher.thread() == QtCore.QCoreApplication.instance().thread()
+    with qtbot.waitSignal(registry.mapsChanged, timeout=5000):
+        user.mkdir("Downloaded_Map")
+    assert "downloaded_map" in registry
+
+
+def test_scenario_info(tmpdir, mocker):
+    user, base, _ = _registry(tmpdir)
+    user.mkdir("SCMP_009").join("SCMP_009_scenario.lua").write(SCENARIO)
+    user.mkdir("no_scenario")
+    registry = MapRegistry(lambda: str(user), lambda: str(base))
+
+    assert registry.info("scmp_009") == MapInfo("Seton's Clutch", (1024, 512), 4, 2)
+    listed = mocker.spy(mapregistry, "_scenarioFile")
+    assert registry.info("SCMP_009").name == "Seton's Clutch"
+    assert not listed.called
+    assert registry.info("no_scenario") is None
+    assert registry.info("not_installed") is None
+
+    scenario = user.join("SCMP_009", "SCMP_009_scenario.lua")
+    scenario.write(SCENARIO.replace("map_version = 2", "map_version = 3"))
+    os.utime(str(scenario), (0, 10 ** 9))
+    assert registry.info("scmp_009").version == 3
+
+
+def test_size_from_scmap(tmpdir):
+    user, base, _ = _registry(tmpdir)
+    mapdir = user.mkdir("SCMP_009")
+    mapdir.join("SCMP_009_scenario.lua").write(SCENARIO.replace("size = {1024, 512},", ""))
+    mapdir.join("SCMP_009.scmap").write_binary(
+        scmap.HEADER.pack(scmap.MAGIC, 2, 0, 2, 256.0, 256.0, 0, 0) + b"\0" * 4)
+    registry = MapRegistry(lambda: str(user), lambda: str(base))
+
+    assert registry.info("scmp_009").size == (256, 256)
@@ -0,0 +1,104 @@
+import os
+import zipfile
+
+from fa import hashmanifest, movies
+
+
+def make_gamedata(path, members):
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zfile:
+        for name, data in members.items():
+            zfile.writestr(name, data)
+    return path
+
+
+def manifest_in(tmpdir):
+    return movies.MovieManifest(str(tmpdir.join("movies.json")), hashmanifest.HashManifest(str(tmpdir.join("hashes.json"))))
+
+
+def test_sync_extracts_movies_only(tmpdir):
+    archive = make_gamedata(str(tmpdir.join("movies.nx2")), {
+        "movies/intro.sfd": b"intro" * 1000,
+        "movies/sub/outro.sfd": b"outro",
+        "units/uel0001.bp": b"not a movie",
+    })
+    manifest = manifest_in(tmpdir)
+
+    extracted = movies.sync([archive], str(tmpdir), manifest)
+
+    assert sorted(extracted) == [str(tmpdir.join("movies", "intro.sfd")), str(tmpdir.join("movies", "sub", "outro.sfd"))]
+    assert tmpdir.join("movies", "intro.sfd").read_binary() == b"intro" * 1000
+    assert not tmpdir.join("units").exists()
+    assert tmpdir.join("movies.json").exists()
+
+
+def test_sync_skips_unchanged_movies_without_reading_them(tmpdir, mocker):
+    archive = make_gamedata(str(tmpdir.join("movies.nx2")), {"movies/intro.sfd": b"intro" * 1000})
+    movies.sync([archive], str(tmpdir), manifest_in(tmpdir))
+
+    manifest = manifest_in(tmpdir)
+    crc = mocker.spy(manifest._hashes, "crc32")
+    assert movies.sync([archive], str(tmpdir), manifest) == []
+    assert crc.call_count == 0
+
+
+def test_sync_replaces_changed_movies(tmpdir):
+    manifest = manifest_in(tmpdir)
+    archive = make_gamedata(str(tmpdir.join("movies.nx2")), {"movies/intro.sfd": b"old"})
+    movies.sync([archive], str(tmpdir), manifest)
+
+    archive = make_gamedata(str(tmpdir.join("movies.nx2")), {"movies/intro.sfd": b"new"})
+    assert movies.sync([archive], str(tmpdir), manifest) == [str(tmpdir.join("movies", "intro.sfd"))]
+    assert tmpdir.join("movies", "intro.sfd").read_binary() == b"new"
+
+
+def test_sync_adopts_identical_movies_already_on_disk(tmpdir, mocker):
+    tmpdir.mkdir("movies").join("intro.sfd").write_binary(b"intro")
+    archive = make_gamedata(str(tmpdir.join("movies.nx2")), {"movies/intro.sfd": b"intro"})
+    manifest = manifest_in(tmpdir)
+
+    assert movies.sync([archive], str(tmpdir), manifest) == []
+    assert len(manifest) == 1
+
+    # The CRC computed then is kept with the other game file hashes
+    hashes = manifest_in(tmpdir)._hashes
+    mocker.patch("builtins.open", side_effect=AssertionError)
+    assert hashes.crc32(str(tmpdir.join("movies", "intro.sfd"))) == zipfile.crc32(b"intro")
+
+
+def test_sync_notices_modified_files(tmpdir):
+    manifest = manifest_in(tmpdir)
+    archive = make_gamedata(str(tmpdir.join("movies.nx2")), {"movies/intro.sfd": b"intro"})
+    movies.sync([archive], str(tmpdir), manifest)
+
+    movie = tmpdir.join("movies", "intro.sfd")
+    movie.write_binary(b"broken")
+    assert movies.sync([archive], str(tmpdir), manifest) == [str(movie)]
+    assert movie.read_binary() == b"intro"
+
+
+def test_sync_ignores_members_outside_the_movie_folder(tmpdir):
+    archive = make_gamedata(str(tmpdir.join("evil.nx2")), {"movies/../../evil.sfd": b"evil"})
+    target = tmpdir.mkdir("fa")
+
+    assert movies.sync([archive], str(target), manifest_in(tmpdir)) == []
+    assert not tmpdir.join("evil.sfd").exists()
+
+
+def test_sync_skips_broken_archives(tmpdir):
+    broken = tmpdir.join("broken.nx2")
+    broken.write_binary(b"not a zip")
+    archive = make_gamedata(str(tmpdir.join("movies.nx2")), {"movies/intro.sfd": b"intro"})
+    manifest = manifest_in(tmpdir)
+
+    assert movies.sync([str(broken), archive], str(tmpdir), manifest) == [str(tmpdir.join("movies", "intro.sfd"))]
+    assert os.path.isfile(str(tmpdir.join("movies", "intro.sfd")))
+
+
+def test_sync_takes_movies_shipped_twice_from_the_last_archive(tmpdir):
+    first = make_gamedata(str(tmpdir.join("movies.nx2")), {"movies/intro.sfd": b"old" * 1000})
+    last = make_gamedata(str(tmpdir.join("patch.nx2")), {"movies/intro.sfd": b"new" * 1000})
+    manifest = manifest_in(tmpdir)
+
+    assert movies.sync([first, last], str(tmpdir), manifest) == [str(tmpdir.join("movies", "intro.sfd"))]
+    assert tmpdir.join("movies", "intro.sfd").read_binary() == b"new" * 1000
+    assert movies.sync([first, last], str(tmpdir), manifest) == []
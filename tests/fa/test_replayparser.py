@@ -0,0 +1,78 @@
+import struct
+
+import pytest
+
+from fa.replayparser import ReplayHeader, ReplayHeaderTruncated, replayParser
+
+
+def lua(value):
+    if value is None:
+        return b"\x02\x00"
+    if isinstance(value, bool):
+        return b"\x03" + bytes([value])
+    if isinstance(value, (int, float)):
+        return b"\x00" + struct.pack("<f", value)
+    if isinstance(value, str):
+        return b"\x01" + value.encode() + b"\x00"
+    return b"\x04" + b"".join(lua(k) + lua(v) for k, v in value.items()) + b"\x05"
+
+
+def sized(value):
+    data = lua(value)
+    return struct.pack("<I", len(data)) + data
+
+
+def make_header():
+    data = b"Supreme Commander v1.50.3701\x00\r\n\x00"
+    data += b"Replay v1.9\r\n/maps/SCMP_009/SCMP_009.scmap\x00\r\n\x1a\x00"
+    data += sized({"some-uid": {"name": "Some mod"}})
+    data += sized({"Options": {"Victory": "demoralization", "Timeouts": 3}, "NoRushRadius": None})
+    data += b"\x02" + b"Alice\x00" + struct.pack("<I", 1) + b"Bob\x00" + struct.pack("<I", 2)
+    data += b"\x00"
+    data += b"\x02"
+    data += sized({"PlayerName": "Alice", "Faction": 1, "Human": True}) + b"\x00\xff"
+    data += sized({"PlayerName": "civilian"}) + b"\xff"
+    data += struct.pack("<I", 1234)
+    return data
+
+
+def test_parses_header():
+    data = make_header()
+    header = ReplayHeader.from_buffer(data + b"\x00" * 100)
+    assert header.version == "Supreme Commander v1.50.3701"
+    assert header.game_version == "3701"
+    assert header.replay_version == "Replay v1.9"
+    assert header.map_path == "/maps/SCMP_009/SCMP_009.scmap"
+    assert header.mapname == "SCMP_009"
+    assert header.mods == {"some-uid": {"name": "Some mod"}}
+    assert header.scenario["Options"]["Timeouts"] == 3
+    assert header.scenario["NoRushRadius"] is None
+    assert header.sources == [("Alice", 1), ("Bob", 2)]
+    assert not header.cheats_enabled
+    assert [a["PlayerName"] for a in header.armies] == ["Alice", "civilian"]
+    assert header.armies[0]["Human"] is True
+    assert header.armies[0]["source"] == 0
+    assert header.armies[1]["source"] == 255
+    assert header.seed == 1234
+    assert header.size == len(data)
+
+
+def test_truncated_header():
+    data = make_header()
+    for cut in (10, 60, len(data) - 1):
+        with pytest.raises(ReplayHeaderTruncated):
+            ReplayHeader.from_buffer(bytearray(data[:cut]))
+
+
+def test_file(tmpdir):
+    replay = tmpdir.join("test.scfareplay")
+    replay.write_binary(make_header() + b"\x17" * 10000)
+    parser = replayParser(str(replay))
+    assert parser.getVersion() == "3701"
+    assert parser.getHeader().seed == 1234
+
+
+def test_version_of_garbage(tmpdir):
+    replay = tmpdir.join("test.scfareplay")
+    replay.write_binary(b"\xff\xfe garbage")
+    assert replayParser(str(replay)).getVersion() is None
@@ -0,0 +1,56 @@
+from PyQt5 import QtNetwork
+
+from fa import replayrelay
+
+
+def test_ring_buffer_evicts_oldest():
+    ring = replayrelay.RingBuffer(capacity=8)
+    ring.append(b"0123")
+    ring.append(b"456789")
+    assert (ring.start, ring.end) == (2, 10)
+    assert ring.read(1, 4) is None
+    assert ring.read(2, 4) == b"2345"
+    assert ring.read(8, 4) == b"89"
+
+
+class _Sink(object):
+    def __init__(self):
+        self.server = QtNetwork.QTcpServer()
+        self.server.listen(QtNetwork.QHostAddress.LocalHost, 0)
+        self.server.newConnection.connect(self._accept)
+        self.data = bytearray()
+        self.connections = []
+
+    def _accept(self):
+        socket = self.server.nextPendingConnection()
+        socket.readyRead.connect(lambda: self.data.extend(bytes(socket.readAll())))
+        self.connections.append(socket)
+
+
+def test_relay_streams_evicted_data_from_backing(qtbot):
+    sink = _Sink()
+    stream = bytes(range(256)) * 64
+    relay = replayrelay.ReplayRelay("127.0.0.1", sink.server.serverPort(),
+                                    lambda offset, size: stream[offset:offset + size], capacity=1024)
+
+    # Everything is written before the relay is even connected
+    for i in range(0, len(stream), 1000):
+        relay.write(stream[i:i + 1000])
+
+    with qtbot.waitSignal(relay.finished, timeout=5000):
+        relay.finish()
+    qtbot.waitUntil(lambda: len(sink.data) == len(stream))
+
+    assert bytes(sink.data) == stream
+    metrics = relay.metrics()
+    assert metrics['lag'] == 0 and metrics['sent'] == len(stream)
+
+
+def test_relay_gives_up_on_gone_data(qtbot):
+    sink = _Sink()
+    relay = replayrelay.ReplayRelay("127.0.0.1", sink.server.serverPort(), capacity=4)
+    relay.write(b"lost data")
+
+    with qtbot.waitSignal(relay.finished, timeout=5000):
+        relay.finish()
+    assert relay.metrics()['lag'] == 9
@@ -0,0 +1,87 @@
+import os
+import time
+
+import pytest
+from PyQt5 import QtNetwork
+
+import fa
+import util
+from fa import fafreplay, replayserver, replayspill
+
+INFO = {"uid": 7, "recorder": "Alice", "complete": False}
+
+
+class _Game(object):
+    """ a socket standing in for FA, connected to a recorder """
+    def __init__(self, qtbot, parent):
+        self.server = QtNetwork.QTcpServer()
+        self.server.listen(QtNetwork.QHostAddress.LocalHost, 0)
+        self.socket = QtNetwork.QTcpSocket()
+        self.socket.connectToHost("127.0.0.1", self.server.serverPort())
+        qtbot.waitUntil(self.server.hasPendingConnections)
+        self.recorder = replayserver.ReplayRecorder(parent, self.server.nextPendingConnection())
+
+    def send(self, qtbot, data):
+        size = self.recorder.spill.size
+        self.socket.write(data)
+        qtbot.waitUntil(lambda: self.recorder.spill.size == size + len(data))
+
+
+@pytest.fixture
+def recording(tmpdir, mocker):
+    mocker.patch.object(replayserver, "SPILL_DIR", str(tmpdir.join("spill")))
+    mocker.patch.object(util, "REPLAY_DIR", str(tmpdir), create=True)
+    mocker.patch.object(util, "settings", create=True).value.return_value = True
+    mocker.patch.object(fa, "instance", create=True)._info = dict(INFO)
+    # Nobody listens there, the relay keeps retrying
+    mocker.patch.object(replayserver, "INTERNET_REPLAY_SERVER_HOST", "127.0.0.1")
+    mocker.patch.object(replayserver, "INTERNET_REPLAY_SERVER_PORT", 1)
+    return tmpdir
+
+
+def test_relay_giving_up_keeps_local_replay(qtbot, mocker, recording):
+    parent = mocker.Mock()
+    game = _Game(qtbot, parent)
+    recorder = game.recorder
+    game.send(qtbot, b"Supreme Commander")
+
+    recorder.relay.abort()
+    assert recorder.relay is None
+    parent.removeRecorder.assert_not_called()
+
+    game.send(qtbot, b" v1.50.3701\x00")
+    game.socket.disconnectFromHost()
+    qtbot.waitUntil(lambda: parent.removeRecorder.called)
+
+    info, size = fafreplay.decode_file(str(recording.join("7-Alice.fafreplay")), str(recording.join("out")))
+    assert recording.join("out").read_binary() == b"Supreme Commander v1.50.3701\x00"
+    assert not os.path.exists(recorder.spill.path)
+
+
+def test_failed_replay_is_recovered_with_the_final_info(qtbot, mocker, recording):
+    parent = mocker.Mock()
+    game = _Game(qtbot, parent)
+    recorder = game.recorder
+    recorder.relay.abort()
+    game.send(qtbot, b"Supreme Commander")
+    fa.instance._info = dict(INFO, complete=True, title="final")
+    mocker.patch.object(recorder.spill, "export", side_effect=IOError)
+
+    game.socket.disconnectFromHost()
+    qtbot.waitUntil(lambda: parent.removeRecorder.called)
+    assert os.path.exists(recorder.spill.path)
+
+    recovered = replayspill.recover(replayserver.SPILL_DIR, str(recording))
+    info, size = fafreplay.decode_file(recovered[0], str(recording.join("out")))
+    assert info["complete"] and info["title"] == "final" and "game_end" in info
+
+
+def test_closing_the_server_waits_for_recovery(qtbot, mocker, recording):
+    done = []
+    mocker.patch.object(replayspill, "recover", side_effect=lambda *args: time.sleep(0.2) or done.append(args))
+
+    server = replayserver.ReplayServer(mocker.Mock())
+    server.close()
+
+    assert len(done) == 1
+    assert done[0][:2] == (replayserver.SPILL_DIR, str(recording))
@@ -0,0 +1,63 @@
+import os
+import time
+
+from fa import fafreplay, replayspill
+
+INFO = {"uid": 7, "recorder": "Alice", "complete": False}
+
+
+def test_finalize(tmpdir):
+    spill = replayspill.ReplaySpill(str(tmpdir.join("spill")), "7-Alice", INFO)
+    spill.append(b"Supreme Commander")
+    spill.append(b" v1.50.3701\x00")
+    assert spill.size == 29
+
+    destination = str(tmpdir.join("7-Alice.fafreplay"))
+    spill.finalize(dict(INFO, complete=True), destination)
+    assert not os.path.exists(spill.path)
+    assert not os.path.exists(spill.info_path)
+
+    info, size = fafreplay.decode_file(destination, str(tmpdir.join("out")))
+    assert info["complete"]
+    assert tmpdir.join("out").read_binary() == b"Supreme Commander v1.50.3701\x00"
+
+
+def test_export_keeps_spill_readable(tmpdir):
+    spill = replayspill.ReplaySpill(str(tmpdir.join("spill")), "7-Alice", INFO)
+    spill.append(b"0123456789")
+    assert spill.read(4, 3) == b"456"
+
+    spill.export(INFO, str(tmpdir.join("7-Alice.fafreplay")))
+    assert not os.path.exists(spill.info_path)
+    assert spill.read(8, 10) == b"89"
+
+    spill.discard()
+    assert not os.path.exists(spill.path)
+
+
+def test_recover_orphaned_spills(tmpdir):
+    spilldir = str(tmpdir.join("spill"))
+    replays = tmpdir.mkdir("replays")
+
+    spill = replayspill.ReplaySpill(spilldir, "7-Alice", INFO, checkpoint_interval=0)
+    spill.append(b"x" * 1000)   # Checkpointed right away, then the client "crashes"
+    empty = replayspill.ReplaySpill(spilldir, "8-Alice", dict(INFO, uid=8))
+    empty.close()
+
+    recovered = replayspill.recover(spilldir, str(replays))
+    assert recovered == [str(replays.join("7-Alice.fafreplay"))]
+    assert os.listdir(spilldir) == []
+
+    info, size = fafreplay.decode_file(recovered[0], str(tmpdir.join("out")))
+    assert info["uid"] == 7 and "game_end" in info
+    assert size == 1000
+
+
+def test_recover_leaves_recordings_in_progress(tmpdir):
+    spilldir = str(tmpdir.join("spill"))
+    spill = replayspill.ReplaySpill(spilldir, "7-Alice", INFO, checkpoint_interval=0)
+    spill.append(b"x" * 1000)
+
+    assert replayspill.recover(spilldir, str(tmpdir), before=time.time() - 60) == []
+    assert os.path.exists(spill.path) and os.path.exists(spill.info_path)
+    spill.discard()
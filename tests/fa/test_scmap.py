@@ -0,0 +1,72 @@
+import struct
+
+import pytest
+
+from fa import dds, scmap
+
+
+def _dds(width, height):
+    header = bytearray(dds.HEADER_SIZE)
+    header[:4] = dds.MAGIC
+    struct.pack_into("<7I", header, 4, 124, 0x1007, height, width, width * 4, 0, 1)
+    struct.pack_into("<2I4sI3I", header, 76, 32, dds.DDPF_RGB, b"\0" * 4, 32, 0xff0000, 0xff00, 0xff)
+    return bytes(header) + b"\0\0\xff\xff" * (width * height)
+
+
+def _scmap(version=56, size=(512.0, 256.0), preview=None, heights=(2, 1), scale=1 / 128):
+    preview = _dds(2, 2) if preview is None else preview
+    data = scmap.HEADER.pack(scmap.MAGIC, 2, -0x12011042, 2, size[0], size[1], 0, 0)
+    data += struct.pack("<i", len(preview)) + preview
+    data += struct.pack("<iiif", version, heights[0], heights[1], scale)
+    data += struct.pack("<{}H".format((heights[0] + 1) * (heights[1] + 1)), *range((heights[0] + 1) * (heights[1] + 1)))
+    if version >= 56:
+        data += b"\0"
+    data += b"TTerrain\0/textures/bg.dds\0/textures/sky.dds\0"
+    if version >= 56:
+        data += struct.pack("<i", 1) + b"<aeon>\0/textures/aeon.dds\0"
+    else:
+        data += b"/textures/cube.dds\0"
+    return data
+
+
+def test_sections(tmpdir):
+    path = tmpdir.join("map.scmap")
+    path.write_binary(_scmap())
+
+    with scmap.Scmap(str(path)) as m:
+        assert m.header == scmap.Header(2, 512.0, 256.0)
+        assert m.preview() == _dds(2, 2)
+        image = m.previewImage()
+        assert (image.width(), image.height()) == (2, 2)
+        assert m.version == 56
+        assert m.heightmap[:3] == (2, 1, 1 / 128)
+        assert list(m.heights()) == list(range(6))
+        assert m.terrain == scmap.Terrain("TTerrain", "/textures/bg.dds", "/textures/sky.dds",
+                                          [("<aeon>", "/textures/aeon.dds")])
+
+
+def test_old_version_terrain(tmpdir):
+    path = tmpdir.join("map.scmap")
+    path.write_binary(_scmap(version=53))
+
+    with scmap.Scmap(str(path)) as m:
+        assert m.terrain.cubemaps == [("<default>", "/textures/cube.dds")]
+
+
+def test_header_does_not_need_the_rest(tmpdir):
+    path = tmpdir.join("map.scmap")
+    path.write_binary(_scmap()[:scmap.HEADER.size + 10])
+
+    assert scmap.header(str(path)) == scmap.Header(2, 512.0, 256.0)
+    with pytest.raises(scmap.ScmapError):
+        scmap.preview(str(path))
+
+
+def test_not_a_map(tmpdir):
+    path = tmpdir.join("map.scmap")
+    path.write_binary(b"DDS " + b"\0" * 100)
+    with pytest.raises(scmap.ScmapError):
+        scmap.Scmap(str(path))
+    path.write_binary(b"")
+    with pytest.raises(IOError):
+        scmap.header(str(path))
@@ -0,0 +1,142 @@
+import hashlib
+import http.server
+import os
+import threading
+import time
+
+import pytest
+
+from fa import updatepipeline
+
+FILES = {"/a.scd": b"a" * 300000, "/b.nx2": b"b" * 1000, "/c.patch": b"PATCH"}
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path == "/moved":
+            self.send_response(302)
+            self.send_header("Location", "/b.nx2")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        data = FILES.get(self.path)
+        if data is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:{}".format(httpd.server_address[1])
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _md5(path):
+    if not os.path.isfile(path):
+        return None
+    with open(path, "rb") as fh:
+        return hashlib.md5(fh.read()).hexdigest()
+
+
+def _patch(original, patch):
+    with open(patch, "rb") as src, open(original, "ab") as dst:
+        dst.write(src.read())
+    os.remove(patch)
+
+
+def _wait(pipeline, count):
+    done = []
+    deadline = time.time() + 10
+    while len(done) < count and time.time() < deadline:
+        done += pipeline.poll()
+        time.sleep(0.01)
+    assert pipeline.pending == 0
+    return {(c.kind, c.name): c for c in done}
+
+
+def test_pipeline(server, tmpdir):
+    tmpdir.join("old").write_binary(b"OLD ")
+    pipeline = updatepipeline.UpdatePipeline(_md5, _patch, str(tmpdir))
+    try:
+        pipeline.hash("old", str(tmpdir.join("old")))
+        pipeline.hash("missing", str(tmpdir.join("missing")))
+        pipeline.download("a.scd", server + "/a.scd", str(tmpdir.join("a.scd")))
+        pipeline.download("b.nx2", server + "/moved", str(tmpdir.join("b.nx2")))
+        pipeline.download("gone", server + "/gone", str(tmpdir.join("gone")))
+        pipeline.patch("old", server + "/c.patch", str(tmpdir.join("old")))
+        done = _wait(pipeline, 6)
+    finally:
+        pipeline.close()
+
+    assert done[(updatepipeline.HASHED, "old")].value == hashlib.md5(b"OLD ").hexdigest()
+    assert done[(updatepipeline.HASHED, "missing")].value is None
+    assert done[(updatepipeline.DOWNLOADED, "a.scd")].error is None
+    assert tmpdir.join("a.scd").read_binary() == FILES["/a.scd"]
+    assert tmpdir.join("b.nx2").read_binary() == FILES["/b.nx2"]
+    assert done[(updatepipeline.DOWNLOADED, "gone")].error.status == 404
+    assert not tmpdir.listdir(lambda p: p.basename.startswith("gone"))
+    assert done[(updatepipeline.PATCHED, "old")].error is None
+    assert tmpdir.join("old").read_binary() == b"OLD PATCH"
+    assert not tmpdir.listdir(lambda p: p.ext == ".patch")
+    assert pipeline.received == 300000 + 1000 + 5
+
+
+class _FlakyHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves DATA with Range support, but drops the first connection halfway.
+    """
+    protocol_version = "HTTP/1.1"
+    DATA = bytes(range(256)) * 1024
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(self.headers.get("Range"))
+        start = 0
+        if self.headers.get("Range"):
+            start = int(self.headers["Range"][len("bytes="):-1])
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes {}-{}/{}".format(start, len(self.DATA) - 1, len(self.DATA)))
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(self.DATA) - start))
+        self.end_headers()
+        if len(self.requests) == 1:
+            self.wfile.write(self.DATA[:100000])
+            self.close_connection = True
+            return
+        self.wfile.write(self.DATA[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+def test_fetch_resumes_interrupted_download(tmpdir, monkeypatch):
+    monkeypatch.setattr(updatepipeline, "RETRY_DELAY", 0)
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _FlakyHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    url = "http://127.0.0.1:{}/big.scd".format(httpd.server_address[1])
+    destination = str(tmpdir.join("big.scd"))
+    try:
+        fetcher = updatepipeline.HttpFetcher(timeout=5)
+        tmpdir.join("big.scd.deadbeef.part").write("stale")
+        fetcher.fetch(url, destination)
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+    assert tmpdir.join("big.scd").read_binary() == _FlakyHandler.DATA
+    assert _FlakyHandler.requests == [None, "bytes=100000-"]
+    assert tmpdir.listdir() == [tmpdir.join("big.scd")]
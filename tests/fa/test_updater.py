@@ -4,6 +4,7 @@ from fa import updater
 from PyQt5 import QtWidgets, QtCore
 import pytest
 import collections
+import threading
 
 class NoIsFinished(QtCore.QObject):
     finished = QtCore.pyqtSignal()
@@ -91,3 +92,39 @@ def test_updater_does_not_hide_and_accept_before_all_watches_are_finished(applic
     assert u.isVisible()
     assert not u.result() == QtWidgets.QDialog.Accepted
 
+
+
+def _pipelineUpdater(mocker, completions):
+    self = mocker.Mock(filesToUpdate=["a.nx2", "b.nx2", "c.nx2"], updatedFiles=[],
+                       result=updater.Updater.RESULT_NONE, destination="gamedata")
+    self.pipeline.poll.return_value = completions
+    self.pipeline.pending = 0
+    return self
+
+
+def test_updater_goes_on_after_a_failed_file(application, mocker):
+    box = mocker.patch.object(QtWidgets.QMessageBox, "information")
+    Completion = updater.updatepipeline.Completion
+    self = _pipelineUpdater(mocker, [
+        Completion(updater.updatepipeline.HASHED, "c.nx2", None, OSError("locked")),
+        Completion(updater.updatepipeline.DOWNLOADED, "a.nx2", None, IOError("HTTP 404")),
+        Completion(updater.updatepipeline.PATCHED, "b.nx2", None, None),
+    ])
+
+    updater.Updater.processPipeline(self)
+
+    # A file that can't be hashed is fetched in full
+    self.requestFile.assert_called_once_with("c.nx2", None)
+    assert box.call_count == 1
+    assert self.result == updater.Updater.RESULT_NONE
+    assert self.filesToUpdate == ["c.nx2"]
+    assert self.updatedFiles == ["b.nx2"]
+
+
+def test_updater_log_from_worker_threads(application, qtbot):
+    updater.clearLog()
+    worker = threading.Thread(target=updater.log, args=("patched on a worker",))
+    worker.start()
+    worker.join()
+
+    qtbot.waitUntil(lambda: updater.dumpPlainText() == "patched on a worker")
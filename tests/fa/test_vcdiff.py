@@ -0,0 +1,45 @@
+import binascii
+import os
+
+import pytest
+
+from fa import vcdiff
+
+SOURCE = b"The quick brown fox jumps over the lazy dog. " * 8
+TARGET = SOURCE[:200] + b"Z" * 40 + SOURCE[149:] + b"abc" * 9
+
+# xdelta3 -e -s source target, with application header and checksums
+DELTA = binascii.unhexlify("d6c3c400040774312f2f73312f058268001d835e00040b046efcabc15a616263138148002813815304231800811503")
+# xdelta3 -e -n -A -s source target, plain RFC 3284
+PLAIN_DELTA = binascii.unhexlify("d6c3c400000182680019835e00040b045a616263138148002813815304231800811503")
+
+
+@pytest.mark.parametrize("delta", [DELTA, PLAIN_DELTA])
+def test_decode_in_place(tmpdir, delta):
+    tmpdir.join("gamedata.scd").write_binary(SOURCE)
+    tmpdir.join("patch").write_binary(delta)
+
+    written = vcdiff.decode(str(tmpdir.join("gamedata.scd")), str(tmpdir.join("patch")),
+                            str(tmpdir.join("gamedata.scd")))
+    assert written == len(TARGET)
+    assert tmpdir.join("gamedata.scd").read_binary() == TARGET
+    assert sorted(os.listdir(str(tmpdir))) == ["gamedata.scd", "patch"]
+
+
+def test_checksum_mismatch_leaves_target_alone(tmpdir):
+    tmpdir.join("gamedata.scd").write_binary(SOURCE.replace(b"fox", b"cat"))
+    tmpdir.join("patch").write_binary(DELTA)
+
+    with pytest.raises(vcdiff.VcdiffError):
+        vcdiff.decode(str(tmpdir.join("gamedata.scd")), str(tmpdir.join("patch")),
+                      str(tmpdir.join("gamedata.scd")))
+    assert tmpdir.join("gamedata.scd").read_binary() == SOURCE.replace(b"fox", b"cat")
+    assert sorted(os.listdir(str(tmpdir))) == ["gamedata.scd", "patch"]
+
+
+def test_secondary_compression_is_unsupported(tmpdir):
+    tmpdir.join("source").write_binary(SOURCE)
+    tmpdir.join("patch").write_binary(b"\xd6\xc3\xc4\x00\x01\x02")
+    with pytest.raises(vcdiff.VcdiffUnsupported):
+        vcdiff.decode(str(tmpdir.join("source")), str(tmpdir.join("patch")), str(tmpdir.join("target")))
+    assert not tmpdir.join("target").exists()
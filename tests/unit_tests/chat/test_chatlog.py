@@ -0,0 +1,102 @@
+import pytest
+from PyQt5 import QtCore
+
+from chat.chatlog import ChatLine, ChatLog, ChatLogView
+
+FORMATTER = '<tr><td width="100"><font color="{color}">{name}:&nbsp;</font></td><td width="100%">{text}</td></tr>'
+
+
+def line(text, name="bob"):
+    return ChatLine(FORMATTER, text, name=name, color="red")
+
+
+def texts(log):
+    return [log[row].text for row in range(len(log))]
+
+
+def test_ring_drops_oldest():
+    log = ChatLog(limit=3)
+
+    assert [log.append(line(str(i))) for i in range(5)] == [False, False, False, True, True]
+    assert texts(log) == ["2", "3", "4"]
+    with pytest.raises(IndexError):
+        log[3]
+
+    log.clear()
+    assert len(log) == 0
+
+
+def test_find():
+    log = ChatLog(limit=4)
+    for text, name in [("gg", "a"), ("Hello there", "b"), ("meh", "hello_kitty"), ("bye", "c"), ("hello", "d")]:
+        log.append(line(text, name))
+
+    assert log.find("HELLO", 3) == 3
+    assert log.find("hello", 2) == 1
+    assert log.find("kitty", 9) == 1
+    assert log.find("bye", 0, backwards=False) == 2
+    assert log.find("gg", 3) is None
+
+
+def test_html_formatted_once():
+    chat_line = line("<b>hi</b>")
+
+    assert chat_line.html() == FORMATTER.format(text="<b>hi</b>", name="bob", color="red")
+    assert chat_line.html() is chat_line.html()
+
+
+@pytest.fixture
+def view(qtbot):
+    view = ChatLogView()
+    view.setLimit(50)
+    view.resize(400, 200)
+    qtbot.addWidget(view)
+    view.show()
+    qtbot.waitExposed(view)
+    return view
+
+
+def test_follows_new_lines(view, qtbot):
+    for i in range(30):
+        view.append(line("line %d" % i))
+    view.repaint()
+
+    bar = view.verticalScrollBar()
+    assert bar.value() == bar.maximum() == 29
+    assert view._shown[-1][0] == 29
+    assert len(view._docs) == len(view._shown) < 30
+
+
+def test_stays_put_when_scrolled_up(view):
+    for i in range(50):
+        view.append(line("line %d" % i))
+    view.verticalScrollBar().setValue(20)
+
+    view.append(line("new"))
+
+    assert view.log[view.verticalScrollBar().value()].text == "line 20"
+    view.append(line("forced"), scroll=True)
+    assert view.following()
+
+
+def test_anchor_clicked(view, qtbot):
+    view.append(line('<a href="http://example.com/">link</a>'))
+    view.repaint()
+    row, top, doc = view._shown[0]
+    pos = next(QtCore.QPoint(x, int(top) + y) for y in range(0, 30) for x in range(0, 400)
+               if doc.documentLayout().anchorAt(QtCore.QPointF(x, y)))
+
+    with qtbot.waitSignal(view.anchorClicked) as blocker:
+        qtbot.mouseClick(view.viewport(), QtCore.Qt.LeftButton, pos=pos)
+    assert blocker.args[0].toString() == "http://example.com/"
+
+
+def test_find_selects_and_copies(view):
+    for i in range(40):
+        view.append(line("line %d" % i, name="needle" if i == 5 else "bob"))
+
+    assert view.find("NEEDLE")
+    assert view.verticalScrollBar().value() == 5
+    assert view.selectedText() == "needle: line 5"
+    assert not view.find("needle")
+    assert not view.find("nothing")
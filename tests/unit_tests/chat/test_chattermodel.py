@@ -0,0 +1,191 @@
+import pytest
+from PyQt5 import QtCore, QtTest
+
+from chat.chattermodel import ChatterModel, ChatterFilterModel
+
+
+class FakeChatter(object):
+    def __init__(self, name, rank=2, id_=-1):
+        self.name = name
+        self.rank = rank
+        self.id = id_
+        self.relationCalls = 0
+
+    def sortKey(self):
+        return self.rank, self.name.lower()
+
+    def data(self, column, role):
+        if role == QtCore.Qt.DisplayRole:
+            return self.name
+        return None
+
+    def isFiltered(self, text):
+        return text in self.name.lower()
+
+    def playerId(self):
+        return self.id
+
+    @property
+    def user(self):
+        return self
+
+    def relationsChanged(self):
+        self.relationCalls += 1
+        self.rank = 1
+
+
+class FakeMe(QtCore.QObject):
+    relationsUpdated = QtCore.pyqtSignal(set)
+    ircRelationsUpdated = QtCore.pyqtSignal(set)
+
+
+def names(model):
+    return [model.index(row, 2).data() for row in range(model.rowCount())]
+
+
+@pytest.fixture
+def model(qtbot):
+    model = ChatterModel(FakeMe())
+    # Checks the begin/end signals and indexes along the way
+    model.tester = QtTest.QAbstractItemModelTester(model, QtTest.QAbstractItemModelTester.FailureReportingMode.Fatal)
+    return model
+
+
+def test_add_keeps_order(model):
+    for name, rank in [("zed", 2), ("Alice", 2), ("bob", 0), ("carl", 3), ("dave", 2)]:
+        model.add(FakeChatter(name, rank))
+
+    assert names(model) == ["bob", "Alice", "dave", "zed", "carl"]
+    assert model.columnCount() == 4
+
+
+def test_remove(model):
+    chatters = [FakeChatter(name) for name in ("a", "b", "c")]
+    for chatter in chatters:
+        model.add(chatter)
+
+    model.remove(chatters[1])
+    model.remove(chatters[1])
+
+    assert names(model) == ["a", "c"]
+    assert chatters[1] not in model
+
+
+def test_same_keys(model):
+    twins = [FakeChatter("twin"), FakeChatter("twin"), FakeChatter("twin")]
+    for chatter in twins:
+        model.add(chatter)
+
+    assert [model.row(chatter) for chatter in twins] == [0, 1, 2]
+    model.remove(twins[1])
+    assert model.row(twins[2]) == 1
+
+
+@pytest.mark.parametrize("name,rank,expected", [
+    ("c", -1, "cabde"),
+    ("c", 9, "abdec"),
+    ("a", 1.5, "bacde"),    # Just past its old place
+    ("c", 2.5, "abcde"),    # Stays
+    ("e", 1.5, "abecd"),
+])
+def test_changed_key_moves_the_row(model, name, rank, expected):
+    chatters = {}
+    for i, n in enumerate("abcde"):
+        chatters[n] = FakeChatter(n, rank=i)
+        model.add(chatters[n])
+
+    chatters[name].rank = rank
+    model.chatterChanged(chatters[name])
+
+    assert "".join(names(model)) == expected
+    assert [model.row(c) for c in model.chatters()] == list(range(5))
+
+
+def test_changed_emits_data_changed(model, qtbot):
+    chatter = FakeChatter("a")
+    model.add(chatter)
+
+    with qtbot.waitSignal(model.dataChanged) as blocker:
+        model.chatterChanged(chatter)
+    assert blocker.args[0].row() == 0
+
+
+def test_relations_broadcast(qtbot):
+    me = FakeMe()
+    model = ChatterModel(me)
+    friend = FakeChatter("zed", id_=17)
+    irc_friend = FakeChatter("yan")
+    other = FakeChatter("abe", id_=18)
+    for chatter in (friend, irc_friend, other):
+        model.add(chatter)
+
+    me.relationsUpdated.emit({17})
+    me.ircRelationsUpdated.emit({"yan"})
+
+    assert (friend.relationCalls, irc_friend.relationCalls, other.relationCalls) == (1, 1, 0)
+    assert names(model) == ["yan", "zed", "abe"]
+
+
+def test_many_relations_resort(qtbot):
+    me = FakeMe()
+    model = ChatterModel(me)
+    chatters = [FakeChatter("user%03d" % i, id_=i) for i in range(100)]
+    for chatter in chatters:
+        model.add(chatter)
+
+    me.relationsUpdated.emit(set(range(50, 100)))
+
+    assert names(model) == ["user%03d" % i for i in list(range(50, 100)) + list(range(50))]
+    assert [model.row(c) for c in model.chatters()] == list(range(100))
+
+
+def test_resort(model):
+    chatters = [FakeChatter(n, rank=i) for i, n in enumerate("abc")]
+    for chatter in chatters:
+        model.add(chatter)
+    persistent = QtCore.QPersistentModelIndex(model.index(0, 2))
+
+    for chatter in chatters:
+        chatter.rank = -chatter.rank
+    model.resort()
+
+    assert names(model) == ["c", "b", "a"]
+    assert persistent.row() == 2
+
+
+@pytest.mark.parametrize("count", [3, 40])
+def test_add_many(model, count):
+    model.add(FakeChatter("user%03d" % count))
+    chatters = [FakeChatter("user%03d" % i) for i in reversed(range(count))]
+
+    model.addMany(chatters + chatters[:2])
+
+    assert names(model) == ["user%03d" % i for i in range(count + 1)]
+    assert [model.row(c) for c in model.chatters()] == list(range(count + 1))
+
+
+@pytest.mark.parametrize("count", [3, 40])
+def test_remove_many(model, count):
+    chatters = [FakeChatter("user%03d" % i) for i in range(2 * count)]
+    model.addMany(chatters)
+    persistent = QtCore.QPersistentModelIndex(model.index(1, 2))
+    gone = QtCore.QPersistentModelIndex(model.index(0, 2))
+
+    model.removeMany(chatters[::2] + [FakeChatter("stranger")])
+
+    assert names(model) == ["user%03d" % i for i in range(1, 2 * count, 2)]
+    assert [model.row(c) for c in model.chatters()] == list(range(count))
+    assert persistent.row() == 0
+    assert not gone.isValid()
+
+
+def test_filter(model):
+    for name in ("Alice", "bob", "Alan"):
+        model.add(FakeChatter(name))
+    proxy = ChatterFilterModel()
+    proxy.setSourceModel(model)
+
+    proxy.setFilter("al")
+    assert names(proxy) == ["Alan", "Alice"]
+    proxy.setFilter("")
+    assert names(proxy) == ["Alan", "Alice", "bob"]
@@ -0,0 +1,160 @@
+import os
+import sqlite3
+import time
+
+import pytest
+
+from chat import history
+from chat.chatlog import ChatLine, ChatLog
+from chat.history import ChatHistory
+
+
+@pytest.fixture
+def store(tmpdir, qtbot):
+    store = ChatHistory(str(tmpdir))
+    yield store
+    store.close()
+
+
+def fill(store, name, count, start=0):
+    return [store.append(name, "message", "bob", "line %d" % i, when=1000 + i) for i in range(start, start + count)]
+
+
+def texts(lines):
+    return [line.text for line in lines]
+
+
+def indexed(store):
+    """ ids of the lines with words in the index """
+    if store.fulltext:
+        rows = store._db.execute("SELECT docid FROM words WHERE words MATCH 'bob'")
+    else:
+        rows = store._db.execute("SELECT docid FROM words")
+    return sorted(row[0] for row in rows)
+
+
+def logged(store):
+    return [row[0] for row in store._db.execute("SELECT id FROM lines ORDER BY id")]
+
+
+def test_pages_back_and_forth(store):
+    ids = fill(store, "#aeolus", 10)
+    store.append("#other", "message", "bob", "elsewhere")
+
+    assert texts(store.before("#Aeolus", count=3)) == ["line 7", "line 8", "line 9"]
+    assert texts(store.before("#aeolus", ids[3], count=5)) == ["line 0", "line 1", "line 2"]
+    assert texts(store.after("#aeolus", ids[7])) == ["line 8", "line 9"]
+    assert store.before("#nobody") == []
+
+    line = store.before("#aeolus", count=1)[0]
+    assert (line.id, line.time, line.kind, line.name) == (ids[9], 1009, "message", "bob")
+
+
+def test_search(store):
+    store.append("#aeolus", "message", "bob", "good game everyone")
+    wanted = store.append("#aeolus", "action", "alice", "plays a GOOD map")
+    store.append("#aeolus", "message", "bob", "bye")
+    store.append("#other", "message", "bob", "good map")
+
+    assert store.search("#aeolus", "good ma") == [wanted]
+    assert store.search("#aeolus", "good", limit=5) == [wanted, wanted - 1]
+    assert store.search("#aeolus", "good", before=wanted) == [wanted - 1]
+    assert store.search("#aeolus", "alice") == [wanted]
+    assert store.search("#aeolus", "nothing") == []
+    assert store.search("#aeolus", "  ") == []
+
+
+def test_rotates_into_compressed_segments(tmpdir, qtbot, monkeypatch):
+    monkeypatch.setattr(history, "SEGMENT_SIZE", 500)
+    store = ChatHistory(str(tmpdir))
+    ids = fill(store, "#aeolus", 40)
+    store.close()
+
+    segments = sorted(os.listdir(str(tmpdir.join("1"))))
+    assert len(segments) > 3
+    assert all(name.endswith(".log.gz") for name in segments[:-1]) and segments[-1].endswith(".log")
+
+    store = ChatHistory(str(tmpdir))
+    assert texts(store.before("#aeolus", ids[12], count=4)) == ["line 8", "line 9", "line 10", "line 11"]
+    assert store.search("#aeolus", "line 17") == [ids[17]]
+    assert fill(store, "#aeolus", 1, start=40)[0] == ids[-1] + 1
+    assert texts(store.after("#aeolus", ids[-2])) == ["line 39", "line 40"]
+    store.close()
+
+
+def test_survives_a_cut_short_line(tmpdir, qtbot):
+    store = ChatHistory(str(tmpdir))
+    fill(store, "#aeolus", 2)
+    store.close()
+    with open(str(tmpdir.join("1", "000000.log")), "ab") as fh:
+        fh.write(b'[3, 1002, "mess')
+
+    store = ChatHistory(str(tmpdir))
+    fill(store, "#aeolus", 1, start=2)
+    assert texts(store.before("#aeolus")) == ["line 0", "line 1", "line 2"]
+    store.close()
+
+
+def test_commits_a_while_after_the_last_line(tmpdir, qtbot, monkeypatch):
+    monkeypatch.setattr(history, "COMMIT_INTERVAL", 0.05)
+    store = ChatHistory(str(tmpdir))
+    fill(store, "#aeolus", 3)
+    other = sqlite3.connect(str(tmpdir.join("history.sqlite")))
+
+    def committed():
+        return other.execute("SELECT COUNT(*) FROM lines").fetchone()[0]
+
+    assert committed() == 0
+    qtbot.waitUntil(lambda: committed() == 3)
+    assert tmpdir.join("1", "000000.log").read_binary().count(b"\n") == 3
+    other.close()
+    store.close()
+
+
+def test_prunes_old_and_excess_segments(tmpdir, qtbot, monkeypatch):
+    monkeypatch.setattr(history, "SEGMENT_SIZE", 500)
+    store = ChatHistory(str(tmpdir))
+    ids = fill(store, "#aeolus", 60)
+    store.close()
+    logdir = tmpdir.join("1")
+    segments = sorted(name for name in os.listdir(str(logdir)) if name.endswith(".gz"))
+    old = time.time() - (history.RETENTION_DAYS + 1) * 24 * 60 * 60
+    os.utime(str(logdir.join(segments[0])), (old, old))
+
+    store = ChatHistory(str(tmpdir))
+    assert not logdir.join(segments[0]).exists() and logdir.join(segments[1]).exists()
+    oldest = store.before("#aeolus", ids[-1] + 1, count=100)[0]
+    assert oldest.id > ids[0]
+    assert store.search("#aeolus", "line 0") == []
+    assert indexed(store) == logged(store)
+    store.close()
+
+    monkeypatch.setattr(history, "LOG_SIZE_LIMIT", 1)
+    store = ChatHistory(str(tmpdir))
+    assert [name for name in os.listdir(str(logdir)) if name.endswith(".gz")] == []
+    assert texts(store.before("#aeolus", count=100)) == texts(store.after("#aeolus", 0, count=100))
+    assert len(store.before("#aeolus", count=100)) < 10
+    assert indexed(store) == logged(store)
+    assert fill(store, "#aeolus", 1, start=60)[0] in store.search("#aeolus", "line 60")
+    store.close()
+
+
+def test_goes_without_a_broken_history(tmpdir, qtbot, monkeypatch):
+    tmpdir.mkdir("chatlogs").join("history.sqlite").write("not a database")
+    monkeypatch.setattr(history.util, "APPDATA_DIR", str(tmpdir), raising=False)
+    monkeypatch.setattr(history, "enabled", lambda: True)
+    monkeypatch.setattr(history, "_history", None)
+    monkeypatch.setattr(history, "_failed", False)
+
+    assert history.history() is None
+    assert history.history() is None
+
+
+def test_log_prepend():
+    log = ChatLog(limit=5)
+    for i in range(3):
+        log.append(ChatLine("{text}", str(i)))
+
+    assert log.prepend([ChatLine("{text}", "a"), ChatLine("{text}", "b")]) == 0
+    assert log.prepend([ChatLine("{text}", "c")]) == 1
+    assert [log[row].text for row in range(len(log))] == ["c", "a", "b", "0", "1"]
@@ -0,0 +1,119 @@
+import pytest
+from PyQt5 import QtNetwork
+
+from chat import irclib
+from chat.ircsocket import QtServerConnection
+
+
+def test_line_buffer_splits_incrementally():
+    lines = irclib.LineBuffer()
+
+    assert lines.feed(b"PING :a\r\nNOTICE") == [b"PING :a"]
+    assert lines.feed(b" x :hi") == []
+    assert lines.feed(b"\r") == []
+    assert lines.feed(b"\n\nEFNET\n") == [b"NOTICE x :hi", b"", b"EFNET"]
+    assert lines.feed(b"\r\n") == [b""]
+
+
+def test_flood_control():
+    now = [100.0]
+    flood = irclib.FloodControl(burst=3, interval=2.0, clock=lambda: now[0])
+
+    assert [flood.take() for _ in range(4)] == [True, True, True, False]
+    assert flood.delay() == pytest.approx(2.0)
+    now[0] += 3.0
+    assert flood.take()
+    assert not flood.take()
+    assert flood.delay() == pytest.approx(1.0)
+    now[0] += 60
+    assert sum(flood.take() for _ in range(10)) == 3
+
+
+class Server(object):
+    def __init__(self):
+        self.server = QtNetwork.QTcpServer()
+        self.server.listen(QtNetwork.QHostAddress.LocalHost)
+        self.client = None
+        self.received = b""
+        self.server.newConnection.connect(self._accept)
+
+    @property
+    def port(self):
+        return self.server.serverPort()
+
+    def _accept(self):
+        self.client = self.server.nextPendingConnection()
+        self.client.readyRead.connect(self._read)
+
+    def _read(self):
+        self.received += bytes(self.client.readAll())
+
+    def send(self, data):
+        self.client.write(data)
+
+
+@pytest.fixture
+def irc(qtbot):
+    ircobj = irclib.IRC()
+    events = []
+    ircobj.add_global_handler("all_events", lambda c, e: events.append(e), -10)
+    connection = ircobj.server(QtServerConnection)
+    connection.events = events
+    yield connection
+    connection.disconnect()
+
+
+def test_logs_on_and_dispatches_lines(qtbot, irc):
+    server = Server()
+    irc.connect("127.0.0.1", server.port, "nick", username="17")
+    assert irc.is_connected()
+
+    qtbot.waitUntil(lambda: server.received.count(b"\r\n") == 2)
+    assert server.received == b"NICK nick\r\nUSER 17 0 * :nick\r\n"
+
+    server.send(b":srv 001 nick :Welcome\r\n:a!b@c PRIVMSG #aeolus :h")
+    server.send(b"i\r\nPING :srv\r\n")
+    qtbot.waitUntil(lambda: b"PONG" in server.received)
+
+    events = [(e.eventtype(), e.target(), e.arguments()) for e in irc.events if e.eventtype() != "all_raw_messages"]
+    assert events == [("welcome", "nick", ["Welcome"]), ("pubmsg", "#aeolus", ["hi"]), ("ping", "srv", ["srv"])]
+
+
+def test_paces_outgoing_lines(qtbot, irc):
+    server = Server()
+    irc.connect("127.0.0.1", server.port, "nick")
+    for i in range(QtServerConnection.FLOOD_BURST + 3):
+        irc.privmsg("#aeolus", str(i))
+
+    qtbot.waitUntil(lambda: irc.queued() == 3)
+    qtbot.wait(100)
+    assert irc.queued() == 3
+    assert b":9\r\n" in server.received and b":10\r\n" not in server.received
+
+    irc.disconnect("bye")
+    qtbot.waitUntil(lambda: server.received.endswith(b"QUIT :bye\r\n"))
+    assert b":12\r\n" in server.received
+    assert not irc.is_connected()
+    assert irc.events[-1].eventtype() == "disconnect"
+
+
+def test_connect_failed(qtbot, irc):
+    server = Server()
+    port = server.port
+    server.server.close()
+
+    irc.connect("127.0.0.1", port, "nick")
+
+    qtbot.waitUntil(lambda: bool(irc.events) and irc.events[-1].eventtype() == "connect_failed")
+    assert not irc.is_connected()
+
+
+def test_server_hangs_up(qtbot, irc):
+    server = Server()
+    irc.connect("127.0.0.1", server.port, "nick")
+    qtbot.waitUntil(lambda: server.client is not None and b"USER" in server.received)
+
+    server.client.disconnectFromHost()
+
+    qtbot.waitUntil(lambda: not irc.is_connected())
+    assert irc.events[-1].eventtype() == "disconnect"
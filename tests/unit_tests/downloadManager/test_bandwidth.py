@@ -0,0 +1,12 @@
+import pytest
+
+from downloadManager import bandwidth
+
+
+def test_bandwidth_scheduler():
+    unlimited = bandwidth.BandwidthScheduler()
+    assert unlimited.delay(10 ** 9) == 0
+
+    limited = bandwidth.BandwidthScheduler(1000)
+    assert limited.delay(500) == 0      # Burst allowance
+    assert limited.delay(1000) == pytest.approx(1.0, abs=0.05)
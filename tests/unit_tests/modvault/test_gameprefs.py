@@ -0,0 +1,81 @@
+import os
+
+from modvault import gameprefs
+
+PREFS = """profile = {
+    name = 'player',
+    options = { active_mods = 'not this one' },
+}
+active_mods = {
+    ['uid-a'] = true,
+    -- ['uid-commented'] = true,
+    ['uid-b'] = false,
+    ['uid-c'] = true,
+}
+options = { fullscreen = true }
+"""
+
+
+def test_active_mods(tmpdir):
+    prefs = tmpdir.join("game.prefs")
+    prefs.write(PREFS)
+
+    assert gameprefs.GamePrefs(str(prefs)).activeMods() == ["uid-a", "uid-c"]
+
+
+def test_missing_file(tmpdir):
+    assert gameprefs.GamePrefs(str(tmpdir.join("game.prefs"))).activeMods() == []
+
+
+def test_set_only_touches_the_table(tmpdir):
+    prefs = tmpdir.join("game.prefs")
+    prefs.write(PREFS)
+    game = gameprefs.GamePrefs(str(prefs))
+
+    game.setActiveMods(["uid-d"])
+
+    text = prefs.read()
+    assert text.startswith(PREFS[:PREFS.index("active_mods = {\n")])
+    assert text.endswith("}\noptions = { fullscreen = true }\n")
+    assert "uid-a" not in text
+    assert gameprefs.GamePrefs(str(prefs)).activeMods() == ["uid-d"]
+    assert not os.path.exists(str(prefs) + ".tmp")
+
+
+def test_set_appends_missing_table(tmpdir):
+    prefs = tmpdir.join("game.prefs")
+    prefs.write("profile = {}\n")
+    game = gameprefs.GamePrefs(str(prefs))
+
+    game.setActiveMods(["uid-a", "uid-b"])
+    game.setActiveMods(["uid-c"])
+
+    assert prefs.read() == "profile = {}\n\n" + gameprefs.formatActiveMods(["uid-c"])
+    assert game.activeMods() == ["uid-c"]
+
+
+def test_parsed_once_until_changed(tmpdir, mocker):
+    prefs = tmpdir.join("game.prefs")
+    prefs.write(PREFS)
+    game = gameprefs.GamePrefs(str(prefs))
+    find = mocker.spy(gameprefs, "findActiveMods")
+
+    game.activeMods()
+    game.setActiveMods(["uid-a"])
+    assert game.activeMods() == ["uid-a"]
+    assert find.call_count == 1
+
+    prefs.write(PREFS.replace("['uid-b'] = false", "['uid-b'] = true") + "-- edited by FA\n")
+    assert game.activeMods() == ["uid-a", "uid-b", "uid-c"]
+    assert find.call_count == 2
+
+
+def test_find_active_mods_skips_unterminated_and_other_values():
+    assert gameprefs.findActiveMods("active_mods = 'all'\n") == (None, [])
+    assert gameprefs.findActiveMods("active_mods = {\n['uid-a'] = true,\n") == (None, [])
+
+    text = "active_mods = { [ 'uid-a' ] = true, uid_b = true }\nactive_mods = {['uid-c'] = true}\n"
+    span, uids = gameprefs.findActiveMods(text)
+    # The last assignment is the one FA goes by
+    assert uids == ["uid-c"]
+    assert text[span[0]:span[1]] == "active_mods = {['uid-c'] = true}"
@@ -0,0 +1,47 @@
+import os
+
+from modvault.modindex import ModIndex, signature
+
+INFO = {'name': 'Some Mod', 'uid': '1234', 'version': 3, 'ui_only': False, 'icon': '', 'author': 'me',
+        'description': ''}
+
+
+def test_entries_survive_a_restart(tmpdir):
+    path = str(tmpdir.join("mods.json"))
+    index = ModIndex(path)
+    index.put("SomeMod", [10, 20], INFO)
+    index.put("broken.zip", [1, 2], None)
+    index.save()
+
+    index = ModIndex(path)
+    assert index.get("SomeMod", [10, 20]) == INFO
+    assert index.get("broken.zip", [1, 2], "unknown") is None
+
+
+def test_changed_files_are_unknown(tmpdir):
+    index = ModIndex(str(tmpdir.join("mods.json")))
+    index.put("SomeMod", [10, 20], INFO)
+    assert index.get("SomeMod", [10, 21]) is None
+    assert index.get("SomeMod", None) is None
+    assert index.get("Other", [10, 20], "unknown") == "unknown"
+
+
+def test_prune(tmpdir):
+    index = ModIndex(str(tmpdir.join("mods.json")))
+    index.put("a", [1, 1], INFO)
+    index.put("b", [1, 1], INFO)
+    index.prune(["b", "c"])
+    assert "a" not in index and "b" in index and len(index) == 1
+
+
+def test_unreadable_index_is_ignored(tmpdir):
+    tmpdir.join("mods.json").write("{not json")
+    assert len(ModIndex(str(tmpdir.join("mods.json")))) == 0
+
+
+def test_signature(tmpdir):
+    path = tmpdir.join("mod_info.lua")
+    assert signature(str(path)) is None
+    path.write("name = 'x'")
+    os.utime(str(path), ns=(0, 5 * 10 ** 9))
+    assert signature(str(path)) == [10, 5 * 10 ** 9]
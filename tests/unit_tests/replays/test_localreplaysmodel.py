@@ -0,0 +1,91 @@
+import os
+
+import pytest
+from PyQt5 import QtCore
+
+from test_replaycatalog import write_replay, replay_info
+
+
+class FakePreviews(QtCore.QObject):
+    previewReady = QtCore.pyqtSignal(str, object)
+
+    def __init__(self):
+        QtCore.QObject.__init__(self)
+        self.requested = []
+
+    def request(self, mapname):
+        self.requested.append(mapname)
+
+
+@pytest.fixture
+def localreplaysmodel(qapp):
+    # Importing the replays package builds the client window, which needs an application
+    from replays import localreplaysmodel
+    return localreplaysmodel
+
+
+@pytest.fixture
+def model(tmpdir, localreplaysmodel):
+    replays = tmpdir.mkdir("replays")
+    write_replay(str(replays), "1-Alice.fafreplay", replay_info(1, mapname="scmp_001"))
+    write_replay(str(replays), "2-Alice.fafreplay", replay_info(2, launched_at=1500000100))
+    write_replay(str(replays), "3-Alice.fafreplay", replay_info(3, launched_at=1500200000))
+    m = localreplaysmodel.LocalReplaysModel(str(tmpdir.join("catalog.sqlite")), str(replays), FakePreviews())
+    m._catalog.refresh()
+    m._atRefreshed(localreplaysmodel._signedBuckets(m._catalog))
+    yield m
+    m.stop()
+
+
+def refresh(model, localreplaysmodel):
+    model._catalog.refresh()
+    model._atRefreshed(localreplaysmodel._signedBuckets(model._catalog))
+
+
+def test_refresh_only_touches_changed_buckets(model, localreplaysmodel, qtbot):
+    for row in range(model.rowCount()):
+        model.fetchMore(model.index(row, 0))
+    buckets = list(model._buckets)
+    pair, single = sorted(buckets, key=lambda b: b.count, reverse=True)
+    entries = list(pair.entries)
+    write_replay(model._directory, "4-Alice.fafreplay", replay_info(4, launched_at=1500200010))
+
+    reset = []
+    model.modelReset.connect(lambda: reset.append(True))
+    with qtbot.waitSignal(model.dataChanged):
+        refresh(model, localreplaysmodel)
+
+    assert not reset
+    assert model._buckets == buckets
+    assert pair.entries == entries
+    # The changed bucket was expanded, its replays are loaded again
+    assert single.count == len(single.entries) == 2
+
+
+def test_refresh_removes_and_inserts_buckets(model, localreplaysmodel):
+    inserted, removed = [], []
+    model.rowsInserted.connect(lambda parent, first, last: inserted.append((parent.isValid(), first, last)))
+    model.rowsRemoved.connect(lambda parent, first, last: removed.append((parent.isValid(), first, last)))
+    names = [b.name for b in model._buckets]
+
+    os.remove(os.path.join(model._directory, "3-Alice.fafreplay"))
+    write_replay(model._directory, "5-Alice.fafreplay", replay_info(5, launched_at=1500400000))
+    refresh(model, localreplaysmodel)
+
+    assert len(inserted) == 1 and len(removed) == 1
+    assert [b.name for b in model._buckets] == [name for name, _, _ in localreplaysmodel._signedBuckets(model._catalog)]
+    assert len(set(names) & {b.name for b in model._buckets}) == 1
+
+
+def test_preview_updates_only_replays_on_that_map(model, qtbot):
+    for row in range(model.rowCount()):
+        model.fetchMore(model.index(row, 0))
+    changed = []
+    model.dataChanged.connect(lambda first, last, roles: changed.append(model.entry(first).mapname))
+
+    model._previews.previewReady.emit("scmp_009", None)
+    assert changed == ["scmp_009", "scmp_009"]
+    # Failed previews are asked for again after the next refresh
+    assert "scmp_009" in model._icons
+    model._atRefreshed([(b.name, b.count, b.signature) for b in model._buckets])
+    assert "scmp_009" not in model._icons
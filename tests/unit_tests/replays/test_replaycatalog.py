@@ -0,0 +1,86 @@
+import json
+import os
+
+import pytest
+
+
+def write_replay(directory, name, info):
+    with open(os.path.join(directory, name), "wt") as fh:
+        fh.write(json.dumps(info) if info is not None else "garbage")
+        fh.write("\n")
+        fh.write("eJwDAAAAAAE=")
+
+
+def replay_info(uid, mapname="scmp_009", players=("Alice", "Bob"), launched_at=1500000000):
+    return {"uid": uid, "complete": True, "launched_at": launched_at, "mapname": mapname,
+            "title": "Game " + str(uid), "featured_mod": "faf",
+            "teams": {"1": [players[0]], "2": list(players[1:])}}
+
+
+@pytest.fixture
+def replaycatalog(qapp):
+    # Importing the replays package builds the client window, which needs an application
+    from replays import replaycatalog
+    return replaycatalog
+
+
+@pytest.fixture
+def catalog(tmpdir, replaycatalog):
+    replays = tmpdir.mkdir("replays")
+    c = replaycatalog.LocalReplayCatalog(str(tmpdir.join("catalog.sqlite")), str(replays))
+    yield c
+    c.close()
+
+
+def test_refresh_buckets_replays(catalog, replaycatalog):
+    write_replay(catalog.directory, "1-Alice.fafreplay", replay_info(1))
+    write_replay(catalog.directory, "2-Alice.fafreplay", dict(replay_info(2), complete=False))
+    write_replay(catalog.directory, "3-Alice.fafreplay", None)
+    write_replay(catalog.directory, "old.scfareplay", None)
+
+    assert catalog.refresh() == (4, 0)
+    buckets = dict(catalog.buckets())
+    assert buckets[replaycatalog.BUCKET_INCOMPLETE] == 1
+    assert buckets[replaycatalog.BUCKET_BROKEN] == 1
+    assert buckets[replaycatalog.BUCKET_LEGACY] == 1
+    assert sum(buckets.values()) == 4
+
+
+def test_refresh_only_reads_changes(catalog, mocker):
+    write_replay(catalog.directory, "1-Alice.fafreplay", replay_info(1))
+    write_replay(catalog.directory, "2-Alice.fafreplay", replay_info(2))
+    catalog.refresh()
+
+    read = mocker.spy(catalog, "_read_header")
+    assert catalog.refresh() == (0, 0)
+    assert not read.called
+
+    os.remove(os.path.join(catalog.directory, "1-Alice.fafreplay"))
+    assert catalog.refresh() == (0, 1)
+    assert len(catalog) == 1
+
+
+def test_search(catalog):
+    write_replay(catalog.directory, "1-Alice.fafreplay", replay_info(1, mapname="scmp_001"))
+    write_replay(catalog.directory, "2-Alice.fafreplay", replay_info(2, players=("Alice", "Carol"), launched_at=1500000100))
+    catalog.refresh()
+
+    assert {e.basename for e in catalog.search(player="bob")} == {"1-Alice.fafreplay"}
+    assert {e.basename for e in catalog.search(mapname="SCMP_009")} == {"2-Alice.fafreplay"}
+    assert len(catalog.search(player="alice", featured_mod="faf")) == 2
+    assert catalog.search(player="alice")[0].players == ["Alice", "Carol"]
+
+
+def test_signatures_follow_the_replays_of_a_bucket(catalog):
+    write_replay(catalog.directory, "1-Alice.fafreplay", replay_info(1))
+    write_replay(catalog.directory, "2-Alice.fafreplay", replay_info(2, launched_at=1500000100))
+    catalog.refresh()
+    before = catalog.signatures()
+    bucket, = before
+
+    # One replay swapped for another, the count stays the same
+    os.remove(os.path.join(catalog.directory, "1-Alice.fafreplay"))
+    write_replay(catalog.directory, "3-Alice.fafreplay", replay_info(3, launched_at=1500000200))
+    catalog.refresh()
+    assert dict(catalog.buckets())[bucket] == 2
+    assert catalog.signatures()[bucket] != before[bucket]
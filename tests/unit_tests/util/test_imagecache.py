@@ -0,0 +1,70 @@
+from PyQt5 import QtGui
+
+from util.imagecache import ImageCache, cacheKey
+
+
+def _png(tmpdir, name, width=10, height=10):
+    path = str(tmpdir.join(name))
+    image = QtGui.QImage(width, height, QtGui.QImage.Format_RGB32)
+    image.fill(0xff0000)
+    image.save(path)
+    return path
+
+
+def test_load_caches_pixmaps(tmpdir, qapp):
+    cache = ImageCache()
+    path = _png(tmpdir, "a.png")
+    pixmap = cache.load(path)
+    assert pixmap.width() == 10
+    assert cache.load(path) is pixmap
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cache.cost == 10 * 10 * pixmap.depth() // 8
+
+
+def test_missing_files_are_cached_as_none(tmpdir, qapp):
+    cache = ImageCache()
+    assert cache.load(str(tmpdir.join("nope.png"))) is None
+    assert cache.load(str(tmpdir.join("nope.png"))) is None
+    assert cache.hits == 1
+
+
+def test_sizes_are_cached_separately(tmpdir, qapp):
+    cache = ImageCache()
+    path = _png(tmpdir, "a.png", 20, 10)
+    assert cache.load(path, size=(10, 10)).size().width() == 10
+    assert cache.load(path).size().width() == 20
+    assert len(cache) == 2
+
+
+def test_least_recently_used_are_evicted(tmpdir, qapp):
+    paths = [_png(tmpdir, "{}.png".format(i)) for i in range(3)]
+    cache = ImageCache(budget=2 * 10 * 10 * 4)
+    cache.load(paths[0])
+    cache.load(paths[1])
+    cache.load(paths[0])    # Now 1 is the least recently used
+    cache.load(paths[2])
+    assert cacheKey(paths[0]) in cache
+    assert cacheKey(paths[1]) not in cache
+    assert cacheKey(paths[2]) in cache
+    assert cache.cost <= cache.budget
+
+    # Anything just loaded is kept, even when over budget on its own
+    cache.load(_png(tmpdir, "big.png", 100, 100))
+    assert len(cache) == 1
+
+    cache.setBudget(0)
+    assert len(cache) == 0 and cache.cost == 0
+
+
+def test_load_async(tmpdir, qtbot):
+    cache = ImageCache()
+    path = _png(tmpdir, "a.png")
+    with qtbot.waitSignal(cache.loaded) as blocker:
+        key = cache.loadAsync(path)
+    assert blocker.args == [key]
+    assert cache.get(key).width() == 10
+
+    with qtbot.waitSignal(cache.loaded):
+        cache.loadAsync(str(tmpdir.join("b.png")), image=QtGui.QImage(path))
+    assert cache.get(cacheKey(str(tmpdir.join("b.png")))).width() == 10
+    cache.stop()
@@ -0,0 +1,42 @@
+from util.jsonstore import JsonStore
+
+
+class Store(JsonStore):
+    KEY = 'things'
+    WHAT = 'test store'
+
+    def put(self, key, value):
+        self._entries[key] = value
+        self._dirty = True
+
+
+def test_entries_survive_a_restart(tmpdir):
+    path = str(tmpdir.join("cache", "store.json"))
+    store = Store(path)
+    store.put("a", [1, 2])
+    store.save()
+
+    assert Store(path)._entries == {"a": [1, 2]}
+    assert not tmpdir.join("cache", "store.json.tmp").exists()
+
+
+def test_other_versions_and_garbage_are_ignored(tmpdir):
+    path = tmpdir.join("store.json")
+    path.write('{"version": 2, "things": {"a": 1}}')
+    assert len(Store(str(path))) == 0
+    path.write("{not json")
+    assert len(Store(str(path))) == 0
+    path.write("[]")
+    assert len(Store(str(path))) == 0
+
+
+def test_failed_save_is_retried(tmpdir, mocker):
+    path = str(tmpdir.join("store.json"))
+    store = Store(path)
+    store.put("a", 1)
+    mocker.patch("os.replace", side_effect=OSError)
+    store.save()
+    mocker.stopall()
+
+    store.save()
+    assert Store(path)._entries == {"a": 1}
@@ -0,0 +1,126 @@
+import os
+import zipfile
+
+import pytest
+
+from vault import install
+
+
+def make_zip(path, members, compression=zipfile.ZIP_DEFLATED):
+    with zipfile.ZipFile(path, "w", compression) as zfile:
+        for name, data in members.items():
+            zfile.writestr(name, data)
+    return path
+
+
+def test_extract_installs_members(tmpdir):
+    archive = make_zip(str(tmpdir.join("map.zip")), {
+        "SCMP_100/SCMP_100_scenario.lua": "ScenarioInfo = {}",
+        "SCMP_100/SCMP_100.scmap": os.urandom(100000),
+        "SCMP_100/env/decal.dds": b"DDS ",
+    })
+    target = str(tmpdir.join("maps"))
+
+    assert install.extract(archive, target) == ["SCMP_100"]
+    assert os.path.getsize(os.path.join(target, "SCMP_100", "SCMP_100.scmap")) == 100000
+    assert os.path.isfile(os.path.join(target, "SCMP_100", "env", "decal.dds"))
+    # No staging folder left behind
+    assert os.listdir(target) == ["SCMP_100"]
+    assert sorted(os.listdir(str(tmpdir))) == ["map.zip", "maps"]
+
+
+def test_extract_merges_into_existing_folder(tmpdir):
+    target = tmpdir.mkdir("maps")
+    mapdir = target.mkdir("SCMP_100")
+    mapdir.join("mine.lua").write("kept")
+    mapdir.join("map.lua").write("old")
+    archive = make_zip(str(tmpdir.join("map.zip")), {"SCMP_100/map.lua": "new", "SCMP_100/env/new.dds": "new"})
+
+    install.extract(archive, str(target))
+
+    assert mapdir.join("mine.lua").read() == "kept"
+    assert mapdir.join("map.lua").read() == "new"
+    assert mapdir.join("env", "new.dds").read() == "new"
+
+
+def test_extract_stages_outside_the_target(tmpdir, mocker):
+    target = tmpdir.mkdir("maps")
+    archive = make_zip(str(tmpdir.join("map.zip")), {"SCMP_100/map.lua": "new"})
+    seen = []
+    extract = install._extractMembers
+
+    def listing(*args):
+        seen.append(os.listdir(str(target)))
+        return extract(*args)
+    mocker.patch.object(install, "_extractMembers", listing)
+
+    install.extract(archive, str(target))
+
+    assert seen == [[]]
+
+
+def test_extract_rejects_traversal(tmpdir):
+    archive = make_zip(str(tmpdir.join("evil.zip")), {"../outside.txt": "gotcha"})
+    target = tmpdir.mkdir("maps")
+
+    with pytest.raises(install.UnsafeArchive):
+        install.extract(archive, str(target))
+    assert not tmpdir.join("outside.txt").exists()
+    assert os.listdir(str(target)) == []
+
+
+def test_extract_rejects_zip_bomb(tmpdir):
+    archive = make_zip(str(tmpdir.join("bomb.zip")), {"bomb/zeros": bytes(16 * 1024 * 1024)})
+    target = tmpdir.mkdir("maps")
+
+    with pytest.raises(install.UnsafeArchive):
+        install.extract(archive, str(target))
+    assert os.listdir(str(target)) == []
+
+
+def test_pipeline_calls_back_on_gui_thread(qtbot, tmpdir):
+    pipeline = install.InstallPipeline()
+    archive = make_zip(str(tmpdir.join("mod.zip")), {"mymod/mod_info.lua": "name = 'mod'"})
+    installed = []
+
+    with qtbot.waitSignal(pipeline.finished, timeout=5000):
+        future = pipeline.submit(archive, str(tmpdir.join("mods")), installed.append, remove=True)
+
+    assert future.result() == ["mymod"]
+    assert installed == [["mymod"]]
+    assert not os.path.exists(archive)
+    assert pipeline.pending == 0
+    pipeline.stop()
+
+
+def test_pipeline_wait_reports_failures(qtbot, tmpdir):
+    pipeline = install.InstallPipeline()
+    good = make_zip(str(tmpdir.join("good.zip")), {"good/a.txt": "a"})
+    bad = make_zip(str(tmpdir.join("bad.zip")), {"../bad.txt": "b"})
+    installed = []
+
+    pipeline.submit(good, str(tmpdir.join("maps")), installed.append, background="good")
+    pipeline.submit(bad, str(tmpdir.join("maps")), installed.append, background="bad")
+
+    assert not pipeline.wait()
+    assert pipeline.failed == ["bad"]
+    assert installed == [["good"]]
+    # The failure was reported, later installs start with a clean slate
+    assert pipeline.wait()
+    pipeline.stop()
+
+
+def test_pipeline_failures_waited_for_are_not_reported_again(qtbot, tmpdir):
+    pipeline = install.InstallPipeline()
+    bad = make_zip(str(tmpdir.join("bad.zip")), {"../bad.txt": "b"})
+
+    assert not pipeline.wait([pipeline.submit(bad, str(tmpdir.join("maps")))])
+    assert pipeline.wait()
+
+    pipeline.submit(bad, str(tmpdir.join("maps")), background="bad")
+    qtbot.waitUntil(lambda: pipeline.pending == 0)
+    assert not pipeline.wait()
+    assert pipeline.failed == ["bad"]
+    assert pipeline.wait()
+    assert pipeline.failed == []
+    pipeline.stop()
@@ -0,0 +1,129 @@
+import zipfile
+
+from vault.luaparser import luaParser, tokenize
+
+SCENARIO = """
+version = 3 -- scenario format
+--[[ a block comment
+     over two lines with = signs ]]
+ScenarioInfo = {
+    name = 'Seton\\'s Clutch',
+    description = "Islands, \\"bridges\\" and = signs",
+    type = 'skirmish',
+    size = {1024, 512},
+    map_version = 2,
+    Configurations = {
+        ['standard'] = {
+            teams = {
+                { name = 'FFA', armies = {'ARMY_1','ARMY_2','ARMY_3',} },
+            },
+        },
+    }}
+"""
+
+SAVE = """
+Scenario = {
+    MasterChain = {
+        ['_MASTERCHAIN_'] = {
+            Markers = {
+                ['Mass 01'] = {
+                    ['type'] = STRING( 'Mass' ),
+                    ['position'] = VECTOR3( 52.5, 24.1953, 434.5 ),
+                },
+                ['Mass 02'] = {
+                    ['position'] = VECTOR3( 10, 20, 30 ),
+                },
+                ['ARMY_1'] = {
+                    ['position'] = VECTOR3( 30.5, 24.3, 470.5 ),
+                },
+            },
+        },
+    },
+}
+"""
+
+PREFS = """
+profile = { current = 1 }
+active_mods = {
+    ['a6bd6ce4-5e5b-4d8e-9d28-cdaaa4a1c5d0'] = true,
+    ['89BF1572-9EA8-11DC-1313-635F56D89591'] = false,
+}
+"""
+
+
+def _parser(tmpdir, text, name="file.lua"):
+    path = tmpdir.join(name)
+    path.write_text(text, "utf-8")
+    return luaParser(str(path))
+
+
+def test_tokenize_skips_comments():
+    text = "a = 'x' -- comment\n--[==[ long ]] comment ]==] b = [[long\nstring]]"
+    assert [(kind, text[start:end]) for kind, start, end in tokenize(text)] == [
+        ("name", "a"), ("op", "="), ("string", "'x'"),
+        ("name", "b"), ("op", "="), ("long", "[[long\nstring]]")]
+
+
+def test_scenario(tmpdir):
+    lua = _parser(tmpdir, SCENARIO)
+    result = lua.parse({
+        'scenarioinfo>name': 'name', 'size': 'map_size', 'description': 'description',
+        'count:armies': 'max_players', 'map_version': 'version', 'type': 'map_type',
+        'teams>0>name': 'battle_type'}, {'version': '1'})
+    assert not lua.error and not lua.warning
+    assert result == {
+        'name': "Seton's Clutch", 'description': 'Islands, "bridges" and = signs', 'map_type': 'skirmish',
+        'map_size': {'0': '1024', '1': '512'}, 'version': '2', 'max_players': 3, 'battle_type': 'FFA'}
+
+
+def test_wildcards_and_destinations(tmpdir):
+    lua = _parser(tmpdir, SAVE)
+    result = lua.parse({'markers>mass*>position': 'mass:__parent__',
+                        'markers>army*>position': 'army:__parent__'})
+    assert not lua.error
+    # Calls are kept as written
+    assert result == {'mass': {'mass 01': 'VECTOR3( 52.5, 24.1953, 434.5 )', 'mass 02': 'VECTOR3( 10, 20, 30 )'},
+                      'army': {'army_1': 'VECTOR3( 30.5, 24.3, 470.5 )'}}
+
+
+def test_keys_keep_case_on_request(tmpdir):
+    lua = _parser(tmpdir, PREFS)
+    lua.loweringKeys = False
+    result = lua.parse({"active_mods": "active_mods"}, {"active_mods": {}})
+    assert result["active_mods"] == {'a6bd6ce4-5e5b-4d8e-9d28-cdaaa4a1c5d0': 'true',
+                                     '89BF1572-9EA8-11DC-1313-635F56D89591': 'false'}
+
+
+def test_defaults_errors_and_warnings(tmpdir):
+    lua = _parser(tmpdir, "name = 'a'\nsub = { name = 'b' }\n")
+    result = lua.parse({'name': 'name', 'missing': 'missing', 'other': 'other'}, {'other': 'default'})
+    assert result['name'] == 'b' and result['other'] == 'default'
+    assert lua.error and lua.errors == 1
+    assert lua.warning and lua.warnings == 1
+
+
+def test_zip_member(tmpdir):
+    archive = str(tmpdir.join("mod.zip"))
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr("SomeMod/mod_info.lua", 'name = "Some Mod"\nuid = "1234"\n')
+    lua = luaParser("mod_info.lua")
+    lua.iszip = True
+    lua.zip = zipfile.ZipFile(archive)
+    assert lua.parse({'name': 'name', 'uid': 'uid'}) == {'name': 'Some Mod', 'uid': '1234'}
+    lua.zip.close()
+
+
+def test_malformed_tables(tmpdir):
+    text = "a = { 1, 2 ) }\nb = { c = ] }\nd = { [1] = ) }\ne = { ( ]\nf = 'after'\n"
+    result = _parser(tmpdir, text).parse({'a': 'a', 'b': 'b', 'd': 'd', 'f': 'f'})
+    assert result['a'] == {'0': '1', '1': '2'}
+    assert result['b'] == {'c': ''}
+    assert result['d'] == {'1': ''}
+    assert result['f'] == 'after'
+
+
+def test_every_token_is_consumed_once(tmpdir):
+    text = "a = { ) ] , ; x = 1, ) [2] = ] 'y' }\nb = { ['0'] = 'keyed', 'first' }\n"
+    result = _parser(tmpdir, text).parse({'a': 'a', 'b': 'b'})
+    assert result['a'] == {'x': '1', '2': '', '0': 'y'}
+    assert result['b'] == {'0': 'first'}